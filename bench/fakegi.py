@@ -0,0 +1,1742 @@
+# Headless stand-ins for the gi namespaces used by the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Fake Eog, Gtk, Gio, GLib etc. for running the plugins without EOG.
+
+Call install() before importing any plugin module. It puts stand-in
+modules for gi and gi.repository.* into sys.modules, implementing just
+the parts of the API that the plugins use. There is no display: widgets
+have fixed allocations, and the main loop is a FakeMainLoop which is
+iterated by hand on a virtual clock.
+
+Every signal connection and main loop source is tracked, so that a test
+driver can check for anything left behind after deactivation.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import struct
+import hashlib
+import types
+import bisect
+import random
+import shutil
+import weakref
+import threading
+import itertools
+import zlib
+import urllib.parse
+
+
+# Common object model:
+
+class _Enum (object):
+    """Namespace of integer constants, standing in for GI enums/flags."""
+
+    def __init__(self, **values):
+        super(_Enum, self).__init__()
+        self.__dict__.update(values)
+
+
+class _ParamSpec (object):
+    def __init__(self, name):
+        super(_ParamSpec, self).__init__()
+        self.name = name
+
+
+_handler_ids = itertools.count(1)
+
+
+class FakeObject (object):
+    """GObject stand-in: construct properties, signals, and notify."""
+
+    connected = weakref.WeakSet()  # objects which have had handlers
+
+    def __init__(self, **props):
+        super(FakeObject, self).__init__()
+        self._handlers = {}  # {signal: [(id, func, data, after)]}
+        for (k, v) in props.items():
+            setattr(self, "_prop_" + k.replace("-", "_"), v)
+
+    def connect(self, signal, func, *data):
+        return self._connect(signal, func, data, False)
+
+    def connect_after(self, signal, func, *data):
+        return self._connect(signal, func, data, True)
+
+    def _connect(self, signal, func, data, after):
+        hid = next(_handler_ids)
+        handlers = self._handlers.setdefault(signal, [])
+        handlers.append((hid, func, data, after))
+        FakeObject.connected.add(self)
+        return hid
+
+    def disconnect(self, hid):
+        for handlers in self._handlers.values():
+            for h in handlers:
+                if h[0] == hid:
+                    handlers.remove(h)
+                    return
+        raise ValueError("No handler with id %r" % (hid,))
+
+    def emit(self, signal, *args):
+        handlers = list(self._handlers.get(signal, []))
+        handlers.sort(key=lambda h: h[3])
+        result = None
+        for (hid, func, data, after) in handlers:
+            result = func(self, *(args + data))
+            if result is True and not signal.startswith("notify"):
+                break
+        return result
+
+    def notify(self, prop):
+        self.emit("notify::" + prop, _ParamSpec(prop))
+
+    def stop_emission_by_name(self, signal):
+        pass
+
+
+def live_handlers():
+    """Yields (object, signal) for each handler on a live object."""
+    for obj in list(FakeObject.connected):
+        for (signal, handlers) in obj._handlers.items():
+            for h in handlers:
+                yield (obj, signal)
+
+
+class _Property (object):
+    """GObject.property stand-in: a plain per-instance attribute."""
+
+    def __init__(self, type=None, default=None, **kwargs):
+        super(_Property, self).__init__()
+        self.default = default
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        return obj.__dict__.get(self.name, self.default)
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+
+# GLib:
+
+class _Source (object):
+    def __init__(self, sid, func, args, interval):
+        super(_Source, self).__init__()
+        self.id = sid
+        self.func = func
+        self.args = args
+        self.interval = interval  # None for idle sources
+        self.due = None
+
+
+class FakeMainLoop (object):
+    """Main loop stand-in with a virtual clock.
+
+    Idle and timeout sources may be added from any thread, as in GLib.
+    Nothing runs until the driver calls iterate(), run_idle() or
+    advance().
+
+    """
+
+    def __init__(self):
+        super(FakeMainLoop, self).__init__()
+        self.now = 0.0
+        self.sources = {}
+        self.bad_removals = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, func, args, interval=None):
+        with self._lock:
+            sid = next(self._ids)
+            source = _Source(sid, func, args, interval)
+            if interval is not None:
+                source.due = self.now + interval
+            self.sources[sid] = source
+            return sid
+
+    def remove(self, sid):
+        with self._lock:
+            if self.sources.pop(sid, None) is None:
+                self.bad_removals += 1
+                return False
+            return True
+
+    def iterate(self):
+        """Dispatch every source which is ready now, once."""
+        with self._lock:
+            ready = [
+                s for s in self.sources.values()
+                if s.interval is None or s.due <= self.now
+            ]
+        for source in ready:
+            with self._lock:
+                if source.id not in self.sources:
+                    continue
+            again = source.func(*source.args)
+            with self._lock:
+                if source.id not in self.sources:
+                    continue
+                if again:
+                    if source.interval is not None:
+                        source.due = self.now + source.interval
+                else:
+                    del self.sources[source.id]
+        return len(ready)
+
+    def run_idle(self, max_iterations=1000):
+        """Iterate until no idle sources remain."""
+        for i in range(max_iterations):
+            with self._lock:
+                pending = any(s.interval is None
+                              for s in self.sources.values())
+            if not pending:
+                return
+            self.iterate()
+        raise RuntimeError("Idle sources are still pending")
+
+    def advance(self, seconds):
+        """Move the virtual clock on, firing timeouts as they fall due."""
+        end = self.now + seconds
+        while True:
+            with self._lock:
+                dues = [s.due for s in self.sources.values()
+                        if s.interval is not None and s.due <= end]
+            if not dues:
+                break
+            self.now = max(self.now, min(dues))
+            self.iterate()
+        self.now = end
+        self.run_idle()
+
+
+main_loop = FakeMainLoop()
+
+
+class _FrameClock (object):
+    """GdkFrameClock stand-in, ticking at 60Hz on the virtual clock."""
+
+    REFRESH_INTERVAL = 16667  # µs
+
+    def get_frame_time(self):
+        return int(round(main_loop.now * 1000000))
+
+    def get_refresh_info(self, base_time):
+        return (self.REFRESH_INTERVAL, 0)
+
+
+frame_clock = _FrameClock()
+
+
+class _Variant (object):
+    def __init__(self, type_string, value):
+        super(_Variant, self).__init__()
+        self.type_string = type_string
+        self.value = value
+
+    def unpack(self):
+        return self.value
+
+    def get_boolean(self):
+        return bool(self.value)
+
+
+class FakeGLibError (Exception):
+    """GLib.Error stand-in."""
+
+
+def _make_glib(data_dir, cache_dir):
+    GLib = types.ModuleType("gi.repository.GLib")
+    GLib.PRIORITY_DEFAULT = 0
+    GLib.PRIORITY_LOW = 300
+    GLib.SOURCE_REMOVE = False
+    GLib.SOURCE_CONTINUE = True
+    GLib.Variant = _Variant
+    GLib.Error = FakeGLibError
+
+    def idle_add(func, *args, **kwargs):
+        return main_loop.add(func, args)
+
+    def timeout_add(ms, func, *args, **kwargs):
+        return main_loop.add(func, args, ms / 1000)
+
+    def timeout_add_seconds(s, func, *args, **kwargs):
+        return main_loop.add(func, args, float(s))
+
+    GLib.idle_add = idle_add
+    GLib.timeout_add = timeout_add
+    GLib.timeout_add_seconds = timeout_add_seconds
+    GLib.source_remove = main_loop.remove
+    GLib.unix_signal_add = lambda prio, sig, func, *args: 0
+    GLib.get_user_data_dir = lambda: data_dir
+    GLib.get_user_cache_dir = lambda: cache_dir
+    return GLib
+
+
+# Gio:
+
+class FakeSimpleAction (FakeObject):
+
+    def __init__(self, name=None, parameter_type=None, state=None):
+        super(FakeSimpleAction, self).__init__()
+        self._name = name
+        self._state = state
+        self.enabled = True
+
+    def get_name(self):
+        return self._name
+
+    def activate(self, param=None):
+        self.emit("activate", param)
+
+    def get_state(self):
+        return self._state
+
+    def change_state(self, value):
+        self._state = value
+        self.emit("change-state", value)
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+
+
+class FakeFileInfo (object):
+    def __init__(self, path):
+        super(FakeFileInfo, self).__init__()
+        self._path = path
+
+    def get_edit_name(self):
+        return os.path.basename(self._path)
+
+    def get_name(self):
+        return os.path.basename(self._path)
+
+
+class FakeFile (object):
+    """Gio.File stand-in for local paths only."""
+
+    def __init__(self, path):
+        super(FakeFile, self).__init__()
+        self._path = os.path.abspath(path)
+
+    @classmethod
+    def new_for_path(cls, path):
+        return cls(path)
+
+    @classmethod
+    def new_for_uri(cls, uri):
+        raise NotImplementedError("Only local files are faked")
+
+    def get_path(self):
+        return self._path
+
+    def get_uri(self):
+        return "file://" + urllib.parse.quote(self._path)
+
+    def get_basename(self):
+        return os.path.basename(self._path)
+
+    def get_parent(self):
+        return FakeFile(os.path.dirname(self._path))
+
+    def get_child(self, name):
+        return FakeFile(os.path.join(self._path, name))
+
+    def equal(self, other):
+        return self._path == other.get_path()
+
+    def query_info(self, attrs, flags, cancellable=None):
+        if not os.path.lexists(self._path):
+            raise OSError("No such file: %r" % (self._path,))
+        return FakeFileInfo(self._path)
+
+    def set_display_name(self, name, cancellable=None):
+        new_path = os.path.join(os.path.dirname(self._path), name)
+        os.rename(self._path, new_path)
+        file_moved(self._path, new_path)
+        return FakeFile(new_path)
+
+    def trash(self, cancellable=None):
+        os.unlink(self._path)
+        file_deleted(self._path)
+        return True
+
+    def move(self, dest, flags, cancellable=None, *args):
+        shutil.move(self._path, dest.get_path())
+        file_moved(self._path, dest.get_path())
+        return True
+
+    def monitor_directory(self, flags, cancellable=None):
+        if not os.path.isdir(self._path):
+            raise FakeGLibError("Not a directory: %r" % (self._path,))
+        return FakeFileMonitor(self._path)
+
+
+# File monitors, which only hear about what the harness tells them.
+
+FILE_MONITOR_EVENT = _Enum(
+    CHANGED=0, CHANGES_DONE_HINT=1, DELETED=2, CREATED=3,
+    ATTRIBUTE_CHANGED=4, PRE_UNMOUNT=5, UNMOUNTED=6, MOVED=7,
+    RENAMED=8, MOVED_IN=9, MOVED_OUT=10,
+)
+
+
+class FakeFileMonitor (FakeObject):
+    """Gio.FileMonitor stand-in for one directory."""
+
+    live = weakref.WeakSet()
+
+    def __init__(self, directory):
+        super(FakeFileMonitor, self).__init__()
+        self.directory = os.path.abspath(directory)
+        self.cancelled = False
+        FakeFileMonitor.live.add(self)
+
+    def cancel(self):
+        self.cancelled = True
+        FakeFileMonitor.live.discard(self)
+        return True
+
+    def set_rate_limit(self, ms):
+        pass
+
+
+def _file_event(directory, event, path, other=None):
+    for monitor in list(FakeFileMonitor.live):
+        if monitor.directory == directory and not monitor.cancelled:
+            monitor.emit(
+                "changed",
+                FakeFile(path),
+                (other is not None) and FakeFile(other) or None,
+                event,
+            )
+
+
+def file_created(path):
+    path = os.path.abspath(path)
+    _file_event(os.path.dirname(path), FILE_MONITOR_EVENT.CREATED, path)
+
+
+def file_deleted(path):
+    path = os.path.abspath(path)
+    _file_event(os.path.dirname(path), FILE_MONITOR_EVENT.DELETED, path)
+
+
+def file_moved(src, dst):
+    """Reports a rename or move, like a monitor with WATCH_MOVES."""
+    (src, dst) = (os.path.abspath(src), os.path.abspath(dst))
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    (src_dir, dst_dir) = (os.path.dirname(src), os.path.dirname(dst))
+    E = FILE_MONITOR_EVENT
+    if src_dir == dst_dir:
+        _file_event(src_dir, E.RENAMED, src, dst)
+    else:
+        _file_event(src_dir, E.MOVED_OUT, src, dst)
+        _file_event(dst_dir, E.MOVED_IN, dst, src)
+
+
+def _make_gio():
+    Gio = types.ModuleType("gi.repository.Gio")
+    Gio.SimpleAction = FakeSimpleAction
+    Gio.File = FakeFile
+    Gio.FileQueryInfoFlags = _Enum(NONE=0, NOFOLLOW_SYMLINKS=1)
+    Gio.FileCopyFlags = _Enum(NONE=0, OVERWRITE=1, NOFOLLOW_SYMLINKS=8)
+    Gio.FILE_ATTRIBUTE_STANDARD_EDIT_NAME = "standard::edit-name"
+    Gio.FileMonitor = FakeFileMonitor
+    Gio.FileMonitorEvent = FILE_MONITOR_EVENT
+    Gio.FileMonitorFlags = _Enum(NONE=0, WATCH_MOUNTS=1, SEND_MOVED=2,
+                                 WATCH_HARD_LINKS=4, WATCH_MOVES=8)
+    return Gio
+
+
+# Gtk, Gdk and friends:
+
+class FakeWidget (FakeObject):
+    """Widget stand-in with a fixed allocation and no drawing."""
+
+    def __init__(self, **props):
+        super(FakeWidget, self).__init__(**props)
+        self._children = []
+        self._parent = None
+        self._visible = False
+        self._width = 100
+        self._height = 100
+        self._state_flags = 0
+        self._size_request = (-1, -1)
+        self.destroyed = False
+
+    # Hierarchy:
+
+    def add(self, child):
+        self._children.append(child)
+        child._parent = self
+
+    def pack_start(self, child, *args):
+        self.add(child)
+
+    def pack_end(self, child, *args):
+        self.add(child)
+
+    def remove(self, child):
+        self._children.remove(child)
+        child._parent = None
+
+    def get_children(self):
+        return list(self._children)
+
+    def get_parent(self):
+        return self._parent
+
+    def destroy(self):
+        """Destroys the widget and its children, dropping all handlers."""
+        if self.destroyed:
+            return
+        self.destroyed = True
+        for child in list(self._children):
+            child.destroy()
+        if self._parent is not None:
+            self._parent.remove(self)
+        self.emit("destroy")
+        self._handlers.clear()
+
+    # Visibility and geometry:
+
+    def show(self):
+        self._visible = True
+
+    def show_all(self):
+        self._visible = True
+        for c in self._children:
+            c.show_all()
+
+    def hide(self):
+        self._visible = False
+
+    def set_visible(self, visible):
+        self._visible = bool(visible)
+
+    def get_visible(self):
+        return self._visible
+
+    def get_mapped(self):
+        return self._visible
+
+    def set_no_show_all(self, flag):
+        pass
+
+    def set_sensitive(self, flag):
+        pass
+
+    def get_allocated_width(self):
+        return self._width
+
+    def get_allocated_height(self):
+        return self._height
+
+    def set_size_request(self, w, h):
+        self._size_request = (w, h)
+
+    def set_hexpand(self, flag):
+        pass
+
+    def set_vexpand(self, flag):
+        pass
+
+    def add_events(self, mask):
+        pass
+
+    def _allocate(self, w, h):
+        self._width = w
+        self._height = h
+        self.emit("size-allocate", None)
+
+    def queue_draw(self):
+        pass
+
+    def grab_focus(self):
+        pass
+
+    def set_tooltip_text(self, text):
+        pass
+
+    def get_style_context(self):
+        return _StyleContext(self)
+
+    def get_scale_factor(self):
+        return 1
+
+    def get_window(self):
+        return None
+
+    # Frame clock:
+
+    def get_frame_clock(self):
+        return frame_clock
+
+    def add_tick_callback(self, func):
+        """Calls func(widget, frame_clock) once per frame, in a source."""
+        interval = frame_clock.REFRESH_INTERVAL / 1000000
+        return main_loop.add(func, (self, frame_clock), interval)
+
+    def remove_tick_callback(self, tick_id):
+        main_loop.remove(tick_id)
+
+
+class _StyleContext (object):
+    def __init__(self, widget):
+        super(_StyleContext, self).__init__()
+        self._widget = widget
+
+    def get_state(self):
+        return self._widget._state_flags
+
+
+class FakeAdjustment (FakeObject):
+    def __init__(self):
+        super(FakeAdjustment, self).__init__()
+        self.lower = 0.0
+        self.upper = 0.0
+        self.page_size = 0.0
+        self.step_increment = 0.0
+        self.value = 0.0
+
+    def get_lower(self):
+        return self.lower
+
+    def get_upper(self):
+        return self.upper
+
+    def get_page_size(self):
+        return self.page_size
+
+    def get_step_increment(self):
+        return self.step_increment
+
+    def get_value(self):
+        return self.value
+
+    def set_value(self, value):
+        value = min(self.upper - self.page_size, max(self.lower, value))
+        if value != self.value:
+            self.value = value
+            self.emit("value-changed")
+
+    def configure(self, value, lower, upper, step_increment,
+                  page_increment, page_size):
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.step_increment = float(step_increment)
+        self.page_size = float(page_size)
+        self.set_value(value)
+
+    def _configure(self, upper, page_size):
+        """What a scrolled view does when its content is resized."""
+        self.upper = float(upper)
+        self.page_size = float(page_size)
+        self.set_value(self.value)
+
+
+class FakeScrollbar (FakeWidget):
+    def __init__(self, orientation=0, adjustment=None):
+        super(FakeScrollbar, self).__init__()
+        self._orientation = orientation
+        self._adjustment = adjustment or FakeAdjustment()
+        self._width = self._height = 12
+
+    def get_orientation(self):
+        return self._orientation
+
+    def get_adjustment(self):
+        return self._adjustment
+
+
+class FakeOverlay (FakeWidget):
+    def add_overlay(self, child):
+        """Adds a child covering the whole overlay, and allocates it."""
+        self.add(child)
+        child._allocate(self._width, self._height)
+
+    def reorder_overlay(self, child, index):
+        """Moves an overlay child down the stack. Index 0 is the lowest."""
+        overlays = [c for c in self._children
+                    if not isinstance(c, FakeScrollbar)]
+        self._children.remove(child)
+        overlays.remove(child)
+        if index < len(overlays):
+            self._children.insert(self._children.index(overlays[index]),
+                                  child)
+        else:
+            self._children.append(child)
+
+
+class FakeGrid (FakeWidget):
+    """Grid stand-in. Anything but a scrollbar gets the whole space."""
+
+    def attach(self, child, left, top, width, height):
+        self.add(child)
+
+    def _allocate(self, w, h):
+        for child in self._children:
+            if not isinstance(child, FakeScrollbar):
+                child._allocate(w, h)
+        super(FakeGrid, self)._allocate(w, h)
+
+
+class FakeScrolledWindow (FakeWidget):
+    """ScrolledWindow stand-in. Resizing its child configures its bars.
+
+    As in GTK, the new size is allocated on a later main loop iteration,
+    and the child's size-allocate comes after the adjustments are set.
+
+    """
+
+    def __init__(self, **props):
+        super(FakeScrolledWindow, self).__init__(**props)
+        self._hscrollbar = FakeScrollbar(0)
+        self._vscrollbar = FakeScrollbar(1)
+        self._allocate_id = None
+
+    def get_hscrollbar(self):
+        return self._hscrollbar
+
+    def get_vscrollbar(self):
+        return self._vscrollbar
+
+    def get_hadjustment(self):
+        return self._hscrollbar.get_adjustment()
+
+    def get_vadjustment(self):
+        return self._vscrollbar.get_adjustment()
+
+    def queue_resize(self):
+        if self._allocate_id is None:
+            self._allocate_id = main_loop.add(self._allocate_idle_cb, ())
+
+    def destroy(self):
+        if self._allocate_id is not None:
+            main_loop.remove(self._allocate_id)
+            self._allocate_id = None
+        super(FakeScrolledWindow, self).destroy()
+
+    def _allocate_idle_cb(self):
+        self._allocate_id = None
+        for child in self._children:
+            (w, h) = child._size_request
+            child._width = max(w, self._width)
+            child._height = max(h, self._height)
+            self._hscrollbar.get_adjustment()._configure(w, self._width)
+            self._vscrollbar.get_adjustment()._configure(h, self._height)
+            self._hscrollbar.set_visible(w > self._width)
+            self._vscrollbar.set_visible(h > self._height)
+            child.emit("size-allocate", None)
+        return False
+
+
+class FakeDrawingArea (FakeWidget):
+    def set_size_request(self, w, h):
+        self._size_request = (w, h)
+        if isinstance(self._parent, FakeScrolledWindow):
+            self._parent.queue_resize()
+
+
+class FakeCairoContext (object):
+    """Cairo context stand-in, which just counts what's painted."""
+
+    def __init__(self):
+        super(FakeCairoContext, self).__init__()
+        self.paints = 0
+
+    def set_source_rgb(self, r, g, b):
+        pass
+
+    def set_source_surface(self, surface, x, y):
+        pass
+
+    def paint(self):
+        self.paints += 1
+
+    def save(self):
+        pass
+
+    def restore(self):
+        pass
+
+    def translate(self, x, y):
+        pass
+
+    def scale(self, sx, sy):
+        pass
+
+    def rectangle(self, x, y, w, h):
+        pass
+
+    def fill(self):
+        self.paints += 1
+
+
+class FakeHeaderBar (FakeWidget):
+    def __init__(self):
+        super(FakeHeaderBar, self).__init__()
+        self.subtitle = None
+
+    def set_subtitle(self, subtitle):
+        self.subtitle = subtitle
+
+
+class FakeButton (FakeWidget):
+    def __init__(self, label=None, **props):
+        super(FakeButton, self).__init__(**props)
+        self.label = label
+        self.action_name = None
+
+    def set_label(self, label):
+        self.label = label
+
+    def set_action_name(self, name):
+        self.action_name = name
+
+
+class FakeLabel (FakeWidget):
+    def __init__(self, label=None, **props):
+        super(FakeLabel, self).__init__(**props)
+        self.label = label
+
+    def set_text(self, text):
+        self.label = text
+
+    def set_ellipsize(self, mode):
+        pass
+
+
+class FakeEntry (FakeWidget):
+    def __init__(self, **props):
+        super(FakeEntry, self).__init__(**props)
+        self._text = ""
+
+    def set_text(self, text):
+        self._text = text
+
+    def get_text(self):
+        return self._text
+
+    def set_activates_default(self, flag):
+        pass
+
+    def set_input_purpose(self, purpose):
+        pass
+
+    def set_input_hints(self, hints):
+        pass
+
+
+class FakeTreeListStore (object):
+    """Gtk.ListStore stand-in: a list of rows."""
+
+    def __init__(self, *column_types):
+        super(FakeTreeListStore, self).__init__()
+        self._rows = []
+
+    def append(self, row):
+        self._rows.append(list(row))
+
+    def __getitem__(self, path):
+        return self._rows[path]
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class _TreeSelection (object):
+    def __init__(self, tree):
+        super(_TreeSelection, self).__init__()
+        self._tree = tree
+        self.selected = []
+
+    def set_mode(self, mode):
+        pass
+
+    def get_selected_rows(self):
+        return (self._tree.model, list(self.selected))
+
+
+class FakeTreeView (FakeWidget):
+    def __init__(self, model=None, **props):
+        super(FakeTreeView, self).__init__(**props)
+        self.model = model
+        self._selection = _TreeSelection(self)
+
+    def get_selection(self):
+        return self._selection
+
+    def set_headers_visible(self, flag):
+        pass
+
+    def append_column(self, column):
+        pass
+
+
+class FakeTreeViewColumn (object):
+    def __init__(self, title, renderer, **attributes):
+        super(FakeTreeViewColumn, self).__init__()
+
+
+class FakeWindow (FakeWidget):
+    def __init__(self, **props):
+        super(FakeWindow, self).__init__(**props)
+        self._title = None
+        self._fullscreen = False
+        self._width = 1024
+        self._height = 768
+        self._gdk_window = None
+
+    def set_title(self, title):
+        self._title = title
+
+    def set_transient_for(self, parent):
+        pass
+
+    def set_position(self, position):
+        pass
+
+    def set_default_size(self, w, h):
+        self._width, self._height = w, h
+
+    def resize(self, w, h):
+        self._width, self._height = w, h
+
+    def fullscreen(self):
+        self._fullscreen = True
+
+    def unfullscreen(self):
+        self._fullscreen = False
+
+    def present(self):
+        self.show()
+
+    def get_display(self):
+        return _display
+
+    def get_window(self):
+        if not self.get_mapped():
+            return None
+        if self._gdk_window is None:
+            self._gdk_window = _GdkWindow(self)
+        return self._gdk_window
+
+
+class FakeDialog (FakeWindow):
+    """Dialog stand-in. run() answers with the class's canned response.
+
+    If there isn't one, the dialog's default response is used, as if the
+    user had just pressed Return.
+
+    """
+
+    response = None  # set by install(), if wanted
+    on_run = None  # optional callable(dialog), e.g. to type into it
+
+    def __init__(self, title=None, parent=None, flags=0, buttons=None,
+                 **props):
+        super(FakeDialog, self).__init__(**props)
+        self.vbox = FakeWidget()
+        self.add(self.vbox)
+        self._default_response = None
+
+    def set_default_response(self, response):
+        self._default_response = response
+
+    def run(self):
+        if type(self).on_run is not None:
+            type(self).on_run(self)
+        if type(self).response is not None:
+            return type(self).response
+        return self._default_response
+
+    def set_default_size(self, w, h):
+        pass
+
+
+class FakeFileChooserDialog (FakeDialog):
+    filename = None
+
+    def __init__(self, title=None, parent=None, action=None, buttons=None,
+                 **props):
+        super(FakeFileChooserDialog, self).__init__(title, parent)
+
+    def set_local_only(self, flag):
+        pass
+
+    def set_current_folder(self, folder):
+        pass
+
+    def add_filter(self, file_filter):
+        pass
+
+    def get_filename(self):
+        return type(self).filename
+
+
+class FakeFileFilter (object):
+    def set_name(self, name):
+        pass
+
+    def add_pattern(self, pattern):
+        pass
+
+    def add_mime_type(self, mime_type):
+        pass
+
+
+class _GdkWindow (object):
+    def __init__(self, window):
+        super(_GdkWindow, self).__init__()
+        self._window = window
+
+    def get_state(self):
+        if self._window._fullscreen:
+            return _WINDOW_STATE_FULLSCREEN
+        return 0
+
+
+_WINDOW_STATE_FULLSCREEN = 16
+
+
+class _Rectangle (object):
+    def __init__(self, x, y, width, height):
+        super(_Rectangle, self).__init__()
+        self.x, self.y, self.width, self.height = x, y, width, height
+
+
+class _Monitor (object):
+    def get_geometry(self):
+        return _Rectangle(0, 0, 3840, 2160)
+
+    def get_scale_factor(self):
+        return 1
+
+
+class _Pointer (object):
+    def get_position(self):
+        return (None, 10, 10)
+
+
+class _Seat (object):
+    def get_pointer(self):
+        return _Pointer()
+
+
+class _Display (object):
+    def get_default_seat(self):
+        return _Seat()
+
+    def get_monitor_at_point(self, x, y):
+        return _Monitor()
+
+    def get_monitor_at_window(self, window):
+        return _Monitor()
+
+    def get_primary_monitor(self):
+        return _Monitor()
+
+    def get_monitor(self, n):
+        return _Monitor()
+
+
+_display = _Display()
+
+
+def _accelerator_parse(accel):
+    """Split "<Mod>...key" into (key, mods), canonicalising modifiers."""
+    mods = []
+    rest = accel
+    while rest.startswith("<"):
+        end = rest.index(">")
+        mod = rest[1:end].lower()
+        mod = {"primary": "control", "ctrl": "control"}.get(mod, mod)
+        mods.append(mod)
+        rest = rest[end + 1:]
+    if not rest:
+        return (0, 0)
+    return (rest, "".join("<%s>" % m.capitalize() for m in sorted(mods)))
+
+
+def _make_gtk():
+    Gtk = types.ModuleType("gi.repository.Gtk")
+    Gtk.Orientation = _Enum(HORIZONTAL=0, VERTICAL=1)
+    Gtk.StateFlags = _Enum(NORMAL=0, DIR_LTR=128, DIR_RTL=256)
+    Gtk.DialogFlags = _Enum(MODAL=1, DESTROY_WITH_PARENT=2)
+    Gtk.ResponseType = _Enum(NONE=-1, REJECT=-2, ACCEPT=-3, OK=-5,
+                             CANCEL=-6, CLOSE=-7, APPLY=-10)
+    Gtk.WindowPosition = _Enum(NONE=0, CENTER=1, MOUSE=2)
+    Gtk.WindowType = _Enum(TOPLEVEL=0, POPUP=1)
+    Gtk.InputPurpose = _Enum(FREE_FORM=0)
+    Gtk.InputHints = _Enum(NONE=0, SPELLCHECK=1, LOWERCASE=8)
+    Gtk.FileChooserAction = _Enum(OPEN=0, SAVE=1, SELECT_FOLDER=2)
+    Gtk.SelectionMode = _Enum(NONE=0, SINGLE=1, BROWSE=2, MULTIPLE=3)
+    Gtk.STOCK_CANCEL = "gtk-cancel"
+    Gtk.STOCK_OPEN = "gtk-open"
+    Gtk.Widget = FakeWidget
+    Gtk.Container = FakeWidget
+    Gtk.Box = FakeWidget
+    Gtk.Grid = FakeGrid
+    Gtk.Overlay = FakeOverlay
+    Gtk.DrawingArea = FakeDrawingArea
+    Gtk.ScrolledWindow = FakeScrolledWindow
+    Gtk.ListStore = FakeTreeListStore
+    Gtk.TreeView = FakeTreeView
+    Gtk.TreeViewColumn = FakeTreeViewColumn
+    Gtk.CellRendererText = FakeWidget
+    Gtk.Window = FakeWindow
+    Gtk.Dialog = FakeDialog
+    Gtk.FileChooserDialog = FakeFileChooserDialog
+    Gtk.FileFilter = FakeFileFilter
+    Gtk.HeaderBar = FakeHeaderBar
+    Gtk.Button = FakeButton
+    Gtk.Label = FakeLabel
+    Gtk.Entry = FakeEntry
+    Gtk.Scrollbar = FakeScrollbar
+    Gtk.Adjustment = FakeAdjustment
+    Gtk.accelerator_parse = _accelerator_parse
+    Gtk.accelerator_name = lambda key, mods: mods + key
+    return Gtk
+
+
+def _make_gdk():
+    Gdk = types.ModuleType("gi.repository.Gdk")
+    Gdk.WindowState = _Enum(FULLSCREEN=_WINDOW_STATE_FULLSCREEN)
+    Gdk.keyval_name = lambda keyval: keyval
+    Gdk.EventMask = _Enum(BUTTON_MOTION_MASK=16, BUTTON_PRESS_MASK=256,
+                          SCROLL_MASK=2097152, SMOOTH_SCROLL_MASK=8388608)
+    Gdk.ModifierType = _Enum(BUTTON1_MASK=256)
+    Gdk.ScrollDirection = _Enum(UP=0, DOWN=1, LEFT=2, RIGHT=3, SMOOTH=4)
+    Gdk.cairo_surface_create_from_pixbuf = \
+        lambda pixbuf, scale, window: pixbuf
+    return Gdk
+
+
+class FakePixbufFormat (object):
+    """GdkPixbuf.PixbufFormat stand-in."""
+
+    def __init__(self, name):
+        super(FakePixbufFormat, self).__init__()
+        self._name = name
+
+    def get_name(self):
+        return self._name
+
+
+class FakePixbuf (object):
+    """Pixbuf stand-in. Pixels are noise, seeded by seed_for_path(path).
+    """
+
+    seed_for_path = None  # optional callable(path) for similar "photos"
+
+    def __init__(self, width, height, seed=None):
+        super(FakePixbuf, self).__init__()
+        self._width = width
+        self._height = height
+        self._seed = seed
+
+    @classmethod
+    def new(cls, colorspace, has_alpha, bits, width, height):
+        return cls(width, height)
+
+    @classmethod
+    def new_from_file_at_scale(cls, path, width, height, preserve):
+        if not os.path.exists(path):
+            raise OSError("No such file: %r" % (path,))
+        seed = path
+        if cls.seed_for_path is not None:
+            seed = cls.seed_for_path(path)
+        return cls(width, height, seed)
+
+    @classmethod
+    def new_from_file(cls, path):
+        (w, h) = _read_fake_size(path)
+        return cls(w, h, path)
+
+    @staticmethod
+    def get_file_info(path):
+        try:
+            (w, h) = _read_fake_size(path)
+        except (OSError, ValueError):
+            return (None, 0, 0)
+        return (FakePixbufFormat("fake"), w, h)
+
+    def scale_simple(self, width, height, interp):
+        return FakePixbuf(width, height, self._seed)
+
+    def new_subpixbuf(self, x, y, width, height):
+        if x + width > self._width or y + height > self._height:
+            raise ValueError("Subpixbuf is out of bounds")
+        return FakePixbuf(width, height, self._seed)
+
+    def savev(self, path, type_, keys, values):
+        """Writes a fake header, or for PNGs, just the text chunks."""
+        if type_ != "png":
+            with open(path, "wb") as fp:
+                fp.write(b"FAKE %dx%d\n" % (self._width, self._height))
+            return True
+        chunks = []
+        for (key, value) in zip(keys, values):
+            if key.startswith("tEXt::"):
+                data = b"%s\0%s" % (key[len("tEXt::"):].encode("latin-1"),
+                                     value.encode("latin-1"))
+                chunks.append((b"tEXt", data))
+        chunks.append((b"IEND", b""))
+        with open(path, "wb") as fp:
+            fp.write(b"\x89PNG\r\n\x1a\n")
+            for (type_, data) in chunks:
+                fp.write(struct.pack(">I4s", len(data), type_) + data)
+                fp.write(struct.pack(">I", zlib.crc32(type_ + data)))
+        return True
+
+    def get_has_alpha(self):
+        return False
+
+    def get_n_channels(self):
+        return 3
+
+    def get_rowstride(self):
+        return self._width * 3
+
+    def get_pixels(self):
+        rng = random.Random(self._seed)
+        return rng.randbytes(self._width * self._height * 3)
+
+    def get_width(self):
+        return self._width
+
+    def get_height(self):
+        return self._height
+
+    def apply_embedded_orientation(self):
+        return self
+
+    def fill(self, pixel):
+        pass
+
+    def copy_area(self, src_x, src_y, width, height, dest, dest_x, dest_y):
+        if (src_x + width > self._width or src_y + height > self._height
+                or dest_x + width > dest._width
+                or dest_y + height > dest._height):
+            raise ValueError("Copied area is out of bounds")
+
+    def composite(self, dest, dest_x, dest_y, width, height,
+                  offset_x, offset_y, scale_x, scale_y, interp, alpha):
+        if dest_x + width > dest._width or dest_y + height > dest._height:
+            raise ValueError("Composited area is out of bounds")
+
+
+def _read_tiff_page(data):
+    """Returns the (width, height, strips) of a TIFF's first page.
+
+    Like GdkPixbuf's TIFF loader, this only looks at the first page.
+
+    """
+    order = {b"II": "<", b"MM": ">"}[data[:2]]
+    (version, offset) = struct.unpack_from(order + "HI", data, 2)
+    if version != 42:
+        raise ValueError("Not a classic TIFF")
+    (n,) = struct.unpack_from(order + "H", data, offset)
+    sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1}
+    fields = {}
+    for pos in range(offset + 2, offset + 2 + 12 * n, 12):
+        (tag, type_, count) = struct.unpack_from(order + "HHI", data, pos)
+        nbytes = sizes[type_] * count
+        value_pos = pos + 8
+        if nbytes > 4:
+            (value_pos,) = struct.unpack_from(order + "I", data, value_pos)
+        if value_pos + nbytes > len(data):
+            raise ValueError("TIFF tag %d is out of bounds" % (tag,))
+        if type_ in (3, 4):
+            fmt = order + "%d%s" % (count, (type_ == 3) and "H" or "I")
+            fields[tag] = struct.unpack_from(fmt, data, value_pos)
+    strips = []
+    for (start, length) in zip(fields[273], fields[279]):
+        if start + length > len(data):
+            raise ValueError("TIFF strip is out of bounds")
+        strips.append(data[start:start + length])
+    return (fields[256][0], fields[257][0], strips)
+
+
+def _read_fake_size(path):
+    """The (width, height) of an image file written for the fakes."""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        (w, h, strips) = _read_tiff_page(data)
+        return (w, h)
+    header = data.split(b"\n", 1)[0]
+    if not header.startswith(b"FAKE "):
+        raise ValueError("Unrecognized image data in %r" % (path,))
+    (w, h) = header[len(b"FAKE "):].split(b"x")
+    return (int(w), int(h))
+
+
+class FakePixbufLoader (object):
+    """PixbufLoader stand-in for fake image data.
+
+    The data must start with a b"FAKE <width>x<height>" line. Whatever
+    follows is only used to seed the pixels. Uncompressed TIFFs work
+    too, but their strips are only used to seed the pixels.
+
+    """
+
+    def __init__(self):
+        super(FakePixbufLoader, self).__init__()
+        self._data = []
+        self._pixbuf = None
+
+    def write(self, buf):
+        if not isinstance(buf, bytes):
+            raise TypeError("PixbufLoader.write() needs bytes here")
+        self._data.append(buf)
+        return True
+
+    def close(self):
+        data = b"".join(self._data)
+        if data[:4] in (b"II*\x00", b"MM\x00*"):
+            (w, h, strips) = _read_tiff_page(data)
+            seed = hashlib.md5(b"".join(strips)).hexdigest()
+        else:
+            header = data.split(b"\n", 1)[0]
+            if not header.startswith(b"FAKE "):
+                raise ValueError("Unrecognized image data")
+            (w, h) = header[len(b"FAKE "):].split(b"x")
+            seed = hashlib.md5(data).hexdigest()
+        self._pixbuf = FakePixbuf(int(w), int(h), seed)
+        return True
+
+    def get_pixbuf(self):
+        return self._pixbuf
+
+
+def _make_gdkpixbuf():
+    GdkPixbuf = types.ModuleType("gi.repository.GdkPixbuf")
+    GdkPixbuf.Pixbuf = FakePixbuf
+    GdkPixbuf.PixbufLoader = FakePixbufLoader
+    GdkPixbuf.Colorspace = _Enum(RGB=0)
+    GdkPixbuf.InterpType = _Enum(NEAREST=0, TILES=1, BILINEAR=2, HYPER=3)
+    return GdkPixbuf
+
+
+def _make_pango():
+    Pango = types.ModuleType("gi.repository.Pango")
+    Pango.EllipsizeMode = _Enum(NONE=0, START=1, MIDDLE=2, END=3)
+    return Pango
+
+
+def _make_gobject():
+    GObject = types.ModuleType("gi.repository.GObject")
+    GObject.Object = FakeObject
+    GObject.GObject = FakeObject
+    GObject.property = _Property
+    GObject.Property = _Property
+    GObject.SignalFlags = _Enum(RUN_FIRST=1, RUN_LAST=2)
+    return GObject
+
+
+# Eog:
+
+ZOOM_MODE_FREE = 0
+ZOOM_MODE_SHRINK_TO_FIT = 1
+IMAGE_STATUS_LOADED = 3
+
+
+class FakeImage (FakeObject):
+    """EogImage stand-in: a file path plus pretend pixel dimensions."""
+
+    def __init__(self, path, width, height):
+        super(FakeImage, self).__init__()
+        self._file = FakeFile(path)
+        self._pixbuf = FakePixbuf(width, height)
+
+    def get_file(self):
+        return self._file
+
+    def get_pixbuf(self):
+        return self._pixbuf
+
+    def get_status(self):
+        return IMAGE_STATUS_LOADED
+
+    def get_caption(self):
+        return self._file.get_basename()
+
+    def is_file_writable(self):
+        return os.access(self._file.get_path(), os.W_OK)
+
+
+class FakeListStore (FakeObject):
+    """EogListStore stand-in, kept sorted by path like EOG's.
+
+    Positions are looked up by bisection, so that a sync of thousands
+    of files doesn't spend its time in the fake.
+
+    """
+
+    def __init__(self, images, image_size=(1200, 1800)):
+        super(FakeListStore, self).__init__()
+        self._images = sorted(images, key=self._key)
+        self._paths = [self._key(img) for img in self._images]
+        self._image_size = image_size
+        self._listings = {}  # {directory: set([name])}
+
+    @staticmethod
+    def _key(img):
+        return img.get_file().get_path()
+
+    def length(self):
+        return len(self._images)
+
+    def get_pos_by_image(self, img):
+        path = img.get_file().get_path()
+        i = bisect.bisect_left(self._paths, path)
+        if i < len(self._paths) and self._paths[i] == path:
+            return i
+        return -1
+
+    def get_image_by_pos(self, pos):
+        if 0 <= pos < len(self._images):
+            return self._images[pos]
+        return None
+
+    def append_image(self, img):
+        path = self._key(img)
+        i = bisect.bisect_right(self._paths, path)
+        self._paths.insert(i, path)
+        self._images.insert(i, img)
+        self.emit("row-inserted", None, None)
+
+    def remove_image(self, img):
+        pos = self.get_pos_by_image(img)
+        if pos >= 0:
+            del self._images[pos]
+            del self._paths[pos]
+            self.emit("row-deleted", pos)
+
+    def resync(self, directory):
+        """Apply file creations and deletions since the last resync.
+
+        This stands in for EOG's file monitor, so only changes count:
+        an image removed from the store while its file is untouched
+        stays removed.
+
+        """
+        listing = set(os.listdir(directory))
+        previous = self._listings.get(directory, listing)
+        self._listings[directory] = listing
+        for name in previous - listing:
+            img = FakeImage(os.path.join(directory, name), 1, 1)
+            self.remove_image(img)
+        for name in listing - previous:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                img = FakeImage(path, *self._image_size)
+                if self.get_pos_by_image(img) < 0:
+                    self.append_image(img)
+
+
+class FakeScrollView (FakeOverlay):
+    """EogScrollView stand-in, with real scrollbar adjustments."""
+
+    def __init__(self):
+        super(FakeScrollView, self).__init__()
+        self._image = None
+        self._zoom = 1.0
+        self._zoom_mode = ZOOM_MODE_SHRINK_TO_FIT
+        self._width = 1920
+        self._height = 1080
+        self.hscroll = FakeScrollbar(0)
+        self.vscroll = FakeScrollbar(1)
+        self.add(self.hscroll)
+        self.add(self.vscroll)
+
+    def get_image(self):
+        return self._image
+
+    def set_image(self, image):
+        self._image = image
+        if self._zoom_mode != ZOOM_MODE_FREE:
+            self._fit()
+        self._update_adjustments()
+        self.notify("image")
+
+    def get_zoom(self):
+        return self._zoom
+
+    def set_zoom(self, zoom):
+        self._zoom = zoom
+        self._update_adjustments()
+        self.emit("zoom-changed", zoom)
+
+    def get_zoom_mode(self):
+        return self._zoom_mode
+
+    def set_zoom_mode(self, mode):
+        if mode == self._zoom_mode:
+            return
+        self._zoom_mode = mode
+        if mode != ZOOM_MODE_FREE:
+            self._fit()
+            self._update_adjustments()
+        self.notify("zoom-mode")
+
+    def scrollbars_visible(self):
+        return any(sb.get_visible() for sb in (self.hscroll, self.vscroll))
+
+    def _fit(self):
+        if self._image is None:
+            return
+        pixbuf = self._image.get_pixbuf()
+        zoom = min(1.0, self._width / pixbuf.get_width(),
+                   self._height / pixbuf.get_height())
+        if zoom != self._zoom:
+            self._zoom = zoom
+            self.emit("zoom-changed", zoom)
+
+    def _update_adjustments(self):
+        if self._image is None:
+            return
+        pixbuf = self._image.get_pixbuf()
+        w = pixbuf.get_width() * self._zoom
+        h = pixbuf.get_height() * self._zoom
+        self.hscroll.get_adjustment()._configure(w, self._width)
+        self.vscroll.get_adjustment()._configure(h, self._height)
+        self.hscroll.set_visible(w > self._width)
+        self.vscroll.set_visible(h > self._height)
+
+
+class FakeThumbView (FakeWidget):
+    def __init__(self, window):
+        super(FakeThumbView, self).__init__()
+        self._window = window
+
+    def set_current_image(self, image, deselect_other):
+        self._window.set_current_image(image)
+
+
+class FakeApplication (FakeObject):
+    """Gtk.Application stand-in holding the accel table."""
+
+    DEFAULT_ACCELS = {
+        "win.go-next": ["Right"],
+        "win.go-previous": ["Left"],
+        "win.go-first": ["Home"],
+        "win.go-last": ["End"],
+        "win.view-fullscreen": ["F11"],
+        "win.view-slideshow": ["F5"],
+        "win.undo": ["<Primary>z"],
+        "win.delete": ["<Shift>Delete"],
+        "win.move-trash": ["Delete"],
+        "win.rotate-90": ["<Primary>r"],
+        "win.toggle-zoom-fit": ["f"],
+        "win.zoom-in": ["plus", "equal"],
+        "win.zoom-out": ["minus"],
+        "win.close": ["<Primary>w"],
+    }
+
+    def __init__(self):
+        super(FakeApplication, self).__init__()
+        self._accels = {k: list(v) for (k, v) in self.DEFAULT_ACCELS.items()}
+        self.accel_reads = 0
+        self.accel_writes = 0
+
+    def list_action_descriptions(self):
+        return [name for (name, accels) in self._accels.items() if accels]
+
+    def get_accels_for_action(self, name):
+        self.accel_reads += 1
+        return list(self._accels.get(name, []))
+
+    def set_accels_for_action(self, name, accels):
+        self.accel_writes += 1
+        if accels:
+            self._accels[name] = list(accels)
+        else:
+            self._accels.pop(name, None)
+
+    def get_accel_table(self):
+        return {k: list(v) for (k, v) in self._accels.items()}
+
+
+class FakeEogWindow (FakeWindow):
+    """EogWindow stand-in with EOG's own navigation actions."""
+
+    def __init__(self, application, images):
+        super(FakeEogWindow, self).__init__()
+        self._application = application
+        self._view = FakeScrollView()
+        self._store = FakeListStore(images)
+        self._thumb_view = FakeThumbView(self)
+        self._titlebar = FakeHeaderBar()
+        self._actions = {}
+        self._image = None
+        self.add(self._view)
+        for (name, func) in [
+                ("go-next", self._go_next_cb),
+                ("go-previous", self._go_previous_cb),
+                ("undo", None),
+                ("delete", None),
+                ("move-trash", None)]:
+            action = FakeSimpleAction(name=name)
+            if func is not None:
+                action.connect("activate", func)
+            self._actions[name] = action
+        fullscreen = FakeSimpleAction(name="view-fullscreen", state=False)
+        fullscreen.connect("change-state", self._fullscreen_cb)
+        self._actions["view-fullscreen"] = fullscreen
+        self._store.connect("row-deleted", self._row_deleted_cb)
+        if self._store.length():
+            self.set_current_image(self._store.get_image_by_pos(0))
+
+    # EogWindow API:
+
+    def get_application(self):
+        return self._application
+
+    def get_view(self):
+        return self._view
+
+    def get_store(self):
+        return self._store
+
+    def get_thumb_view(self):
+        return self._thumb_view
+
+    def get_titlebar(self):
+        return self._titlebar
+
+    def get_image(self):
+        return self._image
+
+    def set_current_image(self, image):
+        if image is self._image:
+            return
+        self._image = image
+        self._view.set_image(image)
+
+    # GActionMap/GActionGroup API:
+
+    def add_action(self, action):
+        self._actions[action.get_name()] = action
+
+    def remove_action(self, name):
+        self._actions.pop(name, None)
+
+    def has_action(self, name):
+        return name in self._actions
+
+    def lookup_action(self, name):
+        return self._actions.get(name)
+
+    def list_actions(self):
+        return list(self._actions)
+
+    def activate_action(self, name, param):
+        self._actions[name].activate(param)
+
+    def change_action_state(self, name, value):
+        self._actions[name].change_state(value)
+
+    # Built-in action handlers:
+
+    def _go(self, delta):
+        store = self._store
+        pos = store.get_pos_by_image(self._image) if self._image else -1
+        img = store.get_image_by_pos(pos + delta)
+        if img is not None:
+            self.set_current_image(img)
+
+    def _go_next_cb(self, action, param):
+        self._go(1)
+
+    def _go_previous_cb(self, action, param):
+        self._go(-1)
+
+    def _row_deleted_cb(self, store, pos):
+        """Like EOG, move off the current image if it's removed."""
+        if self._image is None or store.get_pos_by_image(self._image) >= 0:
+            return
+        n = store.length()
+        self.set_current_image(store.get_image_by_pos(min(pos, n - 1)))
+
+    def _fullscreen_cb(self, action, value):
+        self._fullscreen = value.get_boolean()
+
+
+class FakeWindowActivatable (object):
+    """Marker base class for window plugins."""
+
+
+def _make_eog():
+    Eog = types.ModuleType("gi.repository.Eog")
+    Eog.ZoomMode = _Enum(FREE=ZOOM_MODE_FREE,
+                         SHRINK_TO_FIT=ZOOM_MODE_SHRINK_TO_FIT)
+    Eog.ImageStatus = _Enum(UNKNOWN=0, LOADING=1, LOADED=IMAGE_STATUS_LOADED)
+    Eog.WindowActivatable = FakeWindowActivatable
+    Eog.Window = FakeEogWindow
+    Eog.ScrollView = FakeScrollView
+    Eog.ListStore = FakeListStore
+    Eog.Image = FakeImage
+    return Eog
+
+
+# Installation:
+
+def install(data_dir, cache_dir, dialog_response=None):
+    """Install the fake gi modules into sys.modules.
+
+    Directories for GLib.get_user_data_dir() and get_user_cache_dir()
+    must be given, so that nothing touches the real user's files.
+
+    """
+    gi = types.ModuleType("gi")
+    gi.require_version = lambda namespace, version: None
+    repository = types.ModuleType("gi.repository")
+    gi.repository = repository
+    namespaces = {
+        "GLib": _make_glib(data_dir, cache_dir),
+        "GObject": _make_gobject(),
+        "Gio": _make_gio(),
+        "Gtk": _make_gtk(),
+        "Gdk": _make_gdk(),
+        "GdkPixbuf": _make_gdkpixbuf(),
+        "Pango": _make_pango(),
+        "Eog": _make_eog(),
+    }
+    sys.modules["gi"] = gi
+    sys.modules["gi.repository"] = repository
+    for (name, module) in namespaces.items():
+        setattr(repository, name, module)
+        sys.modules["gi.repository." + name] = module
+    FakeDialog.response = dialog_response
+    return namespaces
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Frame-by-frame benchmark of the pager's animated page scrolling.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Time the pager's animated page scrolls, a frame at a time.
+
+Without a display, the pager is run in a fake EOG window (see
+bench/fakegi.py) on a 4K screen, paging through 8K-wide images fitted
+to the width. The fake frame clock ticks at 60Hz, and the wall time
+each frame's work takes is measured against the 16.7ms budget::
+
+    python3 bench/page_scroll.py --pages 200
+
+It also reports how far each frame moves the view, and how many frames
+moved it by less than a whole pixel, which would mean redrawing
+everything on screen for nothing.
+With --interrupt, every other page is paged on from mid-scroll, as
+when a key is held down.
+
+Real frame rates need a real display. Run EOG with
+EOGTRICKS_FRAME_LOG=frames.tsv, page through something big, quit,
+and then summarise what was recorded with::
+
+    python3 bench/page_scroll.py --frame-log frames.tsv
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import fakegi  # noqa: E402
+from plugin_harness import load_plugin_classes  # noqa: E402
+
+SCREEN_SIZE = (3840, 2160)
+IMAGE_SIZE = (7680, 21600)  # 8K wide, 5 screens long at fit-width
+FRAME_SECONDS = 1 / 60
+
+
+def summarise_log(filename):
+    from eogtricks.frames import FrameTimeLog
+    log = FrameTimeLog.read(filename)
+    print("%s: %s" % (filename, log.summary()))
+    if not log.intervals:
+        return True
+    dts = sorted(dt for (t, dt, r) in log.intervals)
+    refresh = statistics.median(r for (t, dt, r) in log.intervals)
+    p95 = dts[min(len(dts) - 1, int(len(dts) * 0.95))]
+    print("refresh %0.2fms (%0.1fHz), p95 interval %0.2fms" % (
+        refresh / 1000, 1e6 / refresh, p95 / 1000))
+    return log.dropped == 0
+
+
+def run(args, scratch):
+    data_dir = os.path.join(scratch, "data")
+    cache_dir = os.path.join(scratch, "cache")
+    image_dir = os.path.join(scratch, "images")
+    for d in (data_dir, cache_dir, image_dir):
+        os.makedirs(d)
+    os.environ.setdefault("EOGTRICKS_WORKERS", "0")
+    ns = fakegi.install(data_dir, cache_dir)
+    classes = [c for c in load_plugin_classes(ns["Eog"])
+               if c.__name__ == "PagerPlugin"]
+    from eogtricks.scrollanim import DURATION_MS
+
+    images = []
+    for i in range(args.images):
+        path = os.path.join(image_dir, "page%03d.jpg" % (i,))
+        with open(path, "wb") as fp:
+            fp.write(b"FAKE %dx%d\n" % IMAGE_SIZE)
+        images.append(fakegi.FakeImage(path, *IMAGE_SIZE))
+    window = fakegi.FakeEogWindow(fakegi.FakeApplication(), images)
+    window.get_store().resync(image_dir)
+    plugin = classes[0]()
+    plugin.window = window
+    plugin.do_activate()
+    window.show()
+    view = window.get_view()
+    view._allocate(*SCREEN_SIZE)
+    window.activate_action("zoom-fit-width", None)
+    fakegi.main_loop.run_idle()
+    adj = view.vscroll.get_adjustment()
+
+    frame_costs = []  # seconds of work per frame
+    steps = []  # pixels moved per frame
+    short_steps = 0
+    scroll_frames = []  # frames taken by each scroll
+    for page in range(args.pages):
+        t0 = time.perf_counter()
+        window.activate_action("page-forward", None)
+        fakegi.main_loop.run_idle()
+        frame_costs.append(time.perf_counter() - t0)
+        frames = 0
+        limit = None
+        if args.interrupt and page % 2 == 0:
+            limit = DURATION_MS / 1000 / FRAME_SECONDS / 2
+        while plugin._scroll_anim is not None and plugin._scroll_anim.running:
+            if limit is not None and frames >= limit:
+                window.emit("key-press-event", None)
+                break
+            before = adj.get_value()
+            t0 = time.perf_counter()
+            fakegi.main_loop.advance(FRAME_SECONDS)
+            frame_costs.append(time.perf_counter() - t0)
+            frames += 1
+            step = abs(adj.get_value() - before)
+            if step:
+                steps.append(step)
+                if step < 1:
+                    short_steps += 1
+        scroll_frames.append(frames)
+
+    plugin.do_deactivate()
+    fakegi.main_loop.run_idle()
+
+    n = len(frame_costs)
+    costs = sorted(frame_costs)
+    p95 = costs[min(n - 1, int(n * 0.95))]
+    over = sum(1 for c in frame_costs if c > FRAME_SECONDS)
+    print("%d pages of %dx%d images on a %dx%d screen, %dms scrolls%s" % (
+        args.pages, IMAGE_SIZE[0], IMAGE_SIZE[1],
+        SCREEN_SIZE[0], SCREEN_SIZE[1], DURATION_MS,
+        args.interrupt and ", interrupted" or ""))
+    print("%d frames, %0.1f per scroll" % (
+        n, statistics.mean(scroll_frames) if scroll_frames else 0))
+    print("work per frame: mean %0.1fµs, p95 %0.1fµs, max %0.1fµs, "
+          "%d over budget" % (
+              statistics.mean(costs) * 1e6, p95 * 1e6, costs[-1] * 1e6,
+              over))
+    if steps:
+        print("steps: mean %0.1fpx, max %0.1fpx, %d under a pixel" % (
+            statistics.mean(steps), max(steps), short_steps))
+    print("frame clock: %s" % (plugin._frame_log.summary(),))
+    return over == 0 and short_steps == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pages", type=int, default=200,
+                        help="page scrolls to run (default: %(default)s)")
+    parser.add_argument("--images", type=int, default=50,
+                        help="images in the folder (default: %(default)s)")
+    parser.add_argument("--interrupt", action="store_true",
+                        help="page on again halfway through every "
+                             "other scroll")
+    parser.add_argument("--frame-log", metavar="FILE",
+                        help="summarise a log recorded with "
+                             "EOGTRICKS_FRAME_LOG instead")
+    args = parser.parse_args()
+
+    if args.frame_log:
+        ok = summarise_log(args.frame_log)
+    else:
+        with tempfile.TemporaryDirectory(prefix="eogtricks-scroll-") as d:
+            ok = run(args, d)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
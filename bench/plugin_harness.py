@@ -0,0 +1,621 @@
+#!/usr/bin/env python3
+# Headless exercise and benchmark harness for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Drive every plugin through fake EOG windows, timing and leak checking.
+
+No EOG, GTK or display is needed: bench/fakegi.py stands in for them.
+All the plugins in the tree are activated in each of a number of
+simulated windows, a long random but repeatable script of actions is
+run against those windows, and then everything is deactivated again::
+
+    python3 bench/plugin_harness.py --windows 100 --actions 5000
+
+Now and then a simulated sync tool drops a batch of files into a
+window's folder, or takes them away again, renaming the current image
+as it goes. The window must still be showing that image afterwards.
+To time a big sync, try --windows 2 --actions 100 --sync-files 10000.
+
+The cost of each action is reported, including any idle callbacks it
+queues. After each activate/deactivate cycle the harness checks that
+no signal handlers, main loop sources, accelerators, actions, widgets
+or threads were left behind. Background threads which plugins leave
+to finish by themselves get a few seconds' grace first. It exits with
+status 1 if anything leaked or any action raised, so it doubles as a
+smoke test.
+
+Images are tiny placeholder files in a scratch directory, and the user
+data dir (and so the trash) is redirected there too.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import collections
+import gc
+import glob
+import importlib.util
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import zipfile
+
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = os.path.join(TOP_DIR, "eog")
+sys.path.insert(0, TOP_DIR)
+
+import fakegi  # noqa: E402
+
+
+# Action names and their relative frequencies in the script.
+SCRIPT_WEIGHTS = [
+    ("page-forward", 30),
+    ("page-backward", 10),
+    ("go-next", 15),
+    ("go-previous", 5),
+    ("zoom-fit-width", 5),
+    ("zoom-fit-height", 5),
+    ("zoom-fit-min", 3),
+    ("safer-trash", 8),
+    ("eogtricks-undo", 5),
+    ("review-staged-deletions", 1),
+    ("do-quick-move", 3),
+    ("do-quick-move-group", 2),
+    ("toggle-quick-move-collect", 1),
+    ("next-burst-group", 3),
+    ("previous-burst-group", 2),
+    ("edit-filename-tags", 2),
+    ("open-page-archive", 2),
+    ("close-pages", 1),
+    ("toggle-tiled-view", 2),
+    ("toggle-spread-view", 2),
+    ("pregenerate-thumbnails", 1),
+    ("external-sync", 1),
+]
+
+# Virtual seconds between bursts of actions on the main loop clock,
+# so that the plugins' timers get to fire.
+SECONDS_PER_BURST = 5
+ACTIONS_PER_BURST = 50
+
+# Comic pages, mostly, with the odd spread and panorama, and the odd
+# stitched panorama big enough for the tiled view.
+IMAGE_SIZES = [(1200, 1800), (1800, 1200), (2400, 1800), (900, 4000),
+               (12000, 3000)]
+
+# Consecutive images that look the same, as far as hashing goes.
+BURST_LENGTH = 4
+
+# Pages in each window's comic book archive.
+ARCHIVE_PAGES = 24
+
+# Every so many images is a scanned multi-page TIFF.
+TIFF_EVERY = 8
+TIFF_PAGES = (2, 6)
+
+# Threads which deactivation leaves to end by themselves, rather than
+# hold up closing the window, and how long they get before they count
+# as leaked. Matched by name prefix, for the service's pool threads.
+SELF_ENDING_THREADS = ("eogtricks-bursts", "eogtricks-quickmove",
+                       "eogtricks-safer-delete", "eogtricks-service")
+THREAD_GRACE_SECONDS = 10
+
+
+def plugin_modules():
+    """Returns the (module name, path) of each plugin in the tree."""
+    modules = []
+    for info_path in sorted(glob.glob(os.path.join(PLUGIN_DIR, "*.plugin"))):
+        with open(info_path) as fp:
+            for line in fp:
+                if line.startswith("Module="):
+                    name = line.split("=", 1)[1].strip()
+                    path = os.path.join(PLUGIN_DIR, name + ".py")
+                    modules.append((name, path))
+    return modules
+
+
+def load_plugin_classes(Eog):
+    """Imports the plugin modules, and returns their extension classes."""
+    classes = []
+    for (name, path) in plugin_modules():
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        for obj in vars(module).values():
+            if (isinstance(obj, type)
+                    and issubclass(obj, Eog.WindowActivatable)
+                    and obj.__module__ == name):
+                classes.append(obj)
+    return classes
+
+
+class Timings (object):
+    """Wall-clock samples, grouped by name."""
+
+    def __init__(self):
+        super(Timings, self).__init__()
+        self.samples = collections.defaultdict(list)
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def report(self, title):
+        print("\n%-40s %7s %9s %9s %9s %9s" % (
+            title, "count", "mean µs", "p50 µs", "p95 µs", "max µs"))
+        for name in sorted(self.samples):
+            times = sorted(self.samples[name])
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+            print("%-40s %7d %9.1f %9.1f %9.1f %9.1f" % (
+                name, len(times),
+                statistics.mean(times) * 1e6,
+                statistics.median(times) * 1e6,
+                p95 * 1e6,
+                times[-1] * 1e6,
+            ))
+
+
+class Harness (object):
+    """A fake application with windows, and the plugins to drive."""
+
+    def __init__(self, scratch, n_windows, n_images, seed, sync_files):
+        super(Harness, self).__init__()
+        self.scratch = scratch
+        self.sync_files = sync_files
+        self.rng = random.Random(seed)
+        data_dir = os.path.join(scratch, "data")
+        cache_dir = os.path.join(scratch, "cache")
+        os.makedirs(data_dir)
+        os.makedirs(cache_dir)
+        # Work in-process: worker processes can't see the fakes.
+        os.environ.setdefault("EOGTRICKS_WORKERS", "0")
+        ns = fakegi.install(data_dir, cache_dir)
+        fakegi.FakePixbuf.seed_for_path = self._burst_seed
+        self.Gtk = ns["Gtk"]
+        self.Eog = ns["Eog"]
+        self.plugin_classes = load_plugin_classes(self.Eog)
+        from eogtricks.accels import AccelRegistry
+        from eogtricks.folderwatch import FolderWatch
+        from eogtricks.service import Service
+        from eogtricks.undo import UndoHistory
+        self.AccelRegistry = AccelRegistry
+        self.FolderWatch = FolderWatch
+        self.Service = Service
+        self.UndoHistory = UndoHistory
+
+        self.app = fakegi.FakeApplication()
+        self.windows = []
+        self.dirs = {}  # {window: image directory}
+        self.targets = {}  # {window: quick-move target directory}
+        self.archives = {}  # {window: comic book archive}
+        self.synced = {}  # {window: [path]}, files dropped in by a sync
+        os.makedirs(os.path.join(scratch, "archives"))
+        for w in range(n_windows):
+            image_dir = os.path.join(scratch, "images", "w%03d" % (w,))
+            os.makedirs(image_dir)
+            images = []
+            for i in range(n_images):
+                size = self.rng.choice(IMAGE_SIZES)
+                if i % TIFF_EVERY == TIFF_EVERY - 1:
+                    name = "page%03d [bench].tif" % (i,)
+                    path = os.path.join(image_dir, name)
+                    self._make_tiff(path, size)
+                else:
+                    name = "page%03d [bench].jpg" % (i,)
+                    path = os.path.join(image_dir, name)
+                    with open(path, "wb") as fp:
+                        fp.write(b"FAKE %dx%d\n" % size)
+                images.append(fakegi.FakeImage(path, *size))
+            window = fakegi.FakeEogWindow(self.app, images)
+            window.get_store().resync(image_dir)
+            self.windows.append(window)
+            self.dirs[window] = image_dir
+            self.targets[window] = os.path.join(
+                scratch, "moved", "w%03d" % (w,))
+            os.makedirs(self.targets[window])
+            self.archives[window] = os.path.join(
+                scratch, "archives", "w%03d.cbz" % (w,))
+            self._make_archive(self.archives[window])
+            self.synced[window] = []
+
+        self.plugins = {}  # {window: [plugin]}
+        self.timings = Timings()
+        self.errors = []
+        self._rename_serial = 0
+        fakegi.FakeDialog.on_run = self._dialog_run_cb
+
+    # Simulated content and user input:
+
+    @staticmethod
+    def _burst_seed(path):
+        """Same pixels for each run of BURST_LENGTH pages."""
+        name = os.path.basename(path)
+        page = int(name[len("page"):len("page") + 3])
+        return "%s:%d" % (os.path.dirname(path), page // BURST_LENGTH)
+
+    def _make_archive(self, path):
+        """Writes a CBZ of fake pages, some stored and some deflated.
+
+        The member names are in a shuffled order, with unpadded numbers,
+        so the pages only come out right with a natural sort.
+
+        """
+        pages = list(range(1, ARCHIVE_PAGES + 1))
+        self.rng.shuffle(pages)
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("ComicInfo.xml", b"<ComicInfo/>")
+            for page in pages:
+                (w, h) = self.rng.choice(IMAGE_SIZES)
+                data = b"FAKE %dx%d\n" % (w, h)
+                if page % 2:
+                    data += self.rng.randbytes(256 * 1024)
+                    method = zipfile.ZIP_STORED
+                else:
+                    data += bytes(256 * 1024)
+                    method = zipfile.ZIP_DEFLATED
+                name = "issue 1/page %d.jpg" % (page,)
+                archive.writestr(name, data, compress_type=method)
+
+    def _make_tiff(self, path, first_size):
+        """Writes a multi-page TIFF, with a little noise for its strips.
+
+        Each page has several strips, not all of them adjacent, and
+        values stored outside its directory, so that rebuilding a page
+        as a TIFF of its own gets exercised properly.
+
+        """
+        order = self.rng.choice("<>")
+        n_pages = self.rng.randint(*TIFF_PAGES)
+        sizes = [first_size]
+        sizes += [self.rng.choice(IMAGE_SIZES) for i in range(n_pages - 1)]
+
+        def field(tag, type_, count, value):
+            head = struct.pack(order + "HHI", tag, type_, count)
+            if isinstance(value, int):
+                return head + struct.pack(order + "I", value)
+            return head + value.ljust(4, b"\0")
+
+        out = bytearray((order == "<") and b"II" or b"MM")
+        out += struct.pack(order + "HI", 42, 0)
+        next_pos = 4
+        for (page, (w, h)) in enumerate(sizes):
+            offsets = []
+            strips = [self.rng.randbytes(self.rng.randint(1, 4096))
+                      for i in range(4)]
+            for (i, strip) in enumerate(strips):
+                if i == 2:
+                    out += b"gap"
+                offsets.append(len(out))
+                out += strip
+            out += b"\0" * (len(out) & 1)
+            desc = b"Scan, page %d of %d\0" % (page + 1, len(sizes))
+            desc_pos = len(out)
+            out += desc + b"\0" * (len(desc) & 1)
+            offsets_pos = len(out)
+            out += struct.pack(order + "4I", *offsets)
+            counts_pos = len(out)
+            out += struct.pack(order + "4I", *[len(d) for d in strips])
+            fields = [
+                field(256, 3, 1, struct.pack(order + "H", w)),
+                field(257, 4, 1, struct.pack(order + "I", h)),
+                field(259, 3, 1, struct.pack(order + "H", 1)),
+                field(270, 2, len(desc), desc_pos),
+                field(273, 4, 4, offsets_pos),
+                field(279, 4, 4, counts_pos),
+            ]
+            ifd_pos = len(out)
+            struct.pack_into(order + "I", out, next_pos, ifd_pos)
+            out += struct.pack(order + "H", len(fields)) + b"".join(fields)
+            next_pos = len(out)
+            out += struct.pack(order + "I", 0)
+        with open(path, "wb") as fp:
+            fp.write(out)
+
+    def _dialog_run_cb(self, dialog):
+        """Type a new tag into any entry, and answer yes."""
+        entries = [c for c in dialog.vbox.get_children()
+                   if isinstance(c, fakegi.FakeEntry)]
+        for entry in entries:
+            self._rename_serial += 1
+            entry.set_text(entry.get_text() + " t%d" % (self._rename_serial,))
+
+    def _sync_files(self, window):
+        """Adds or removes a batch of files, and renames the current image.
+
+        Returns the current image's new path, or None if it was one of
+        the files removed.
+
+        """
+        image_dir = self.dirs[window]
+        synced = self.synced[window]
+        img = window.get_image()
+        current = img and img.get_file().get_path()
+        if synced:
+            for path in synced:
+                if os.path.exists(path):
+                    os.unlink(path)
+                    fakegi.file_deleted(path)
+            if current in synced:
+                current = None
+            synced[:] = []
+        else:
+            serial = self.rng.randrange(1000000)
+            for i in range(self.sync_files):
+                name = "page%03d [sync %06d %05d].jpg" % (
+                    self.rng.randrange(1000), serial, i)
+                path = os.path.join(image_dir, name)
+                with open(path, "wb") as fp:
+                    fp.write(b"FAKE %dx%d\n" % self.rng.choice(IMAGE_SIZES))
+                fakegi.file_created(path)
+                synced.append(path)
+        if current is None or not os.path.exists(current):
+            return None
+        self._rename_serial += 1
+        (root, ext) = os.path.splitext(current)
+        new_path = "%s r%d%s" % (root, self._rename_serial, ext)
+        os.rename(current, new_path)
+        fakegi.file_moved(current, new_path)
+        return new_path
+
+    def _timed_sync(self, window):
+        """Runs a sync, and lets the batch of changes arrive."""
+        from eogtricks.folderwatch import COALESCE_MS
+        from eogtricks.folderwatch import MAX_TICKS
+        name = "external-sync"
+        elapsed = 0.0
+        try:
+            expected = self._sync_files(window)
+            t0 = time.perf_counter()
+            window.get_store().resync(self.dirs[window])
+            fakegi.main_loop.advance((MAX_TICKS + 1) * COALESCE_MS / 1000)
+            elapsed += time.perf_counter() - t0
+            img = window.get_image()
+            actual = img and img.get_file().get_path()
+            if expected is None:
+                # It was deleted, so any image still there will do.
+                store = window.get_store()
+                ok = img is not None and store.get_pos_by_image(img) >= 0
+            else:
+                ok = (actual == expected)
+            if not ok:
+                raise AssertionError("Showing %r after a sync, not %r"
+                                     % (actual, expected))
+        except Exception:
+            self.errors.append((name, traceback.format_exc()))
+        self.timings.record(name, elapsed)
+
+    def _choose_folder(self, window):
+        fakegi.FakeFileChooserDialog.filename = self.targets[window]
+        self._timed_action(window, "new-quick-move-folder")
+
+    # Running things:
+
+    def _timed_action(self, window, name):
+        """Activates an action, and runs whatever idle work it causes."""
+        if not window.has_action(name):
+            return
+        elapsed = 0.0
+        try:
+            t0 = time.perf_counter()
+            window.activate_action(name, None)
+            elapsed += time.perf_counter() - t0
+            # Stand-in for EOG's file monitor: not the plugins' cost.
+            window.get_store().resync(self.dirs[window])
+            t0 = time.perf_counter()
+            fakegi.main_loop.run_idle()
+            self._draw_overlays(window)
+            elapsed += time.perf_counter() - t0
+        except Exception:
+            self.errors.append((name, traceback.format_exc()))
+        self.timings.record(name, elapsed)
+
+    def _draw_overlays(self, window):
+        """Let anything the plugins overlay on the view draw a frame."""
+        widgets = [c for c in window.get_view().get_children()
+                   if c.get_visible()]
+        while widgets:
+            widget = widgets.pop()
+            if isinstance(widget, fakegi.FakeDrawingArea):
+                widget.emit("draw", fakegi.FakeCairoContext())
+            widgets.extend(widget.get_children())
+
+    def activate_all(self):
+        for window in self.windows:
+            plugins = []
+            for cls in self.plugin_classes:
+                plugin = cls()
+                plugin.window = window
+                t0 = time.perf_counter()
+                plugin.do_activate()
+                self.timings.record("activate " + cls.__name__,
+                                    time.perf_counter() - t0)
+                plugins.append(plugin)
+            self.plugins[window] = plugins
+
+            # Map the window, and let it draw its first frame.
+            window.show()
+            view = window.get_view()
+            view.emit("size-allocate", None)
+            view.emit("draw", None)
+            fakegi.main_loop.run_idle()
+            self._choose_folder(window)
+
+    def deactivate_all(self):
+        for window in self.windows:
+            for plugin in reversed(self.plugins.pop(window)):
+                t0 = time.perf_counter()
+                plugin.do_deactivate()
+                self.timings.record("deactivate " + type(plugin).__name__,
+                                    time.perf_counter() - t0)
+                plugin.window = None
+            window.hide()
+        fakegi.main_loop.run_idle()
+        deadline = time.monotonic() + THREAD_GRACE_SECONDS
+        for thread in threading.enumerate():
+            if thread.name.startswith(SELF_ENDING_THREADS):
+                thread.join(max(0, deadline - time.monotonic()))
+        fakegi.main_loop.run_idle()
+
+    def run_script(self, n_actions):
+        names = [n for (n, w) in SCRIPT_WEIGHTS]
+        weights = [w for (n, w) in SCRIPT_WEIGHTS]
+        for i in range(n_actions):
+            window = self.rng.choice(self.windows)
+            name = self.rng.choices(names, weights)[0]
+            if name == "open-page-archive":
+                fakegi.FakeFileChooserDialog.filename = self.archives[window]
+            if name == "external-sync":
+                self._timed_sync(window)
+            else:
+                self._timed_action(window, name)
+            if (i + 1) % ACTIONS_PER_BURST == 0:
+                fakegi.main_loop.advance(SECONDS_PER_BURST)
+        fakegi.main_loop.advance(SECONDS_PER_BURST * 10)
+
+    # Leak checking:
+
+    def snapshot(self):
+        """Everything that plugins must put back when deactivated."""
+        gc.collect()
+        handlers = collections.Counter(
+            "%s::%s" % (type(obj).__name__, signal)
+            for (obj, signal) in fakegi.live_handlers()
+        )
+        sources = collections.Counter(
+            getattr(s.func, "__qualname__", repr(s.func))
+            for s in fakegi.main_loop.sources.values()
+        )
+        return {
+            "signal handlers": handlers,
+            "main loop sources": sources,
+            "accels": collections.Counter(
+                "%s=%s" % (name, "|".join(accels))
+                for (name, accels) in self.app.get_accel_table().items()
+            ),
+            "actions": collections.Counter(
+                name for w in self.windows for name in w.list_actions()
+            ),
+            "header bar widgets": collections.Counter(
+                type(c).__name__ for w in self.windows
+                for c in w.get_titlebar().get_children()
+            ),
+            "view overlays": collections.Counter(
+                type(c).__name__ for w in self.windows
+                for c in w.get_view().get_children()
+            ),
+            "threads": collections.Counter(
+                t.name for t in threading.enumerate()
+            ),
+            "accel registries": collections.Counter(
+                type(r).__name__
+                for r in self.AccelRegistry._registries.values()
+            ),
+            "services": collections.Counter(
+                type(s).__name__
+                for s in self.Service._services.values()
+            ),
+            "undo histories": collections.Counter(
+                type(h).__name__
+                for h in self.UndoHistory._histories.values()
+            ),
+            "folder watches": collections.Counter(
+                type(w).__name__
+                for w in self.FolderWatch._watches.values()
+            ),
+            "file monitors": collections.Counter(
+                m.directory for m in fakegi.FakeFileMonitor.live
+            ),
+        }
+
+    def compare(self, before, after):
+        """Returns a list of (what, item, change) for everything leaked."""
+        leaks = []
+        for what in before:
+            diff = after[what]
+            diff.subtract(before[what])
+            for (item, n) in sorted(diff.items()):
+                if n:
+                    leaks.append((what, item, n))
+        if fakegi.main_loop.bad_removals:
+            leaks.append(("main loop sources", "removed twice or unknown",
+                          fakegi.main_loop.bad_removals))
+        return leaks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--windows", type=int, default=100,
+                        help="simulated windows (default: %(default)s)")
+    parser.add_argument("--images", type=int, default=40,
+                        help="images per window (default: %(default)s)")
+    parser.add_argument("--actions", type=int, default=5000,
+                        help="scripted actions per cycle "
+                             "(default: %(default)s)")
+    parser.add_argument("--cycles", type=int, default=2,
+                        help="activate/deactivate cycles "
+                             "(default: %(default)s)")
+    parser.add_argument("--sync-files", type=int, default=200,
+                        help="files added by each simulated sync "
+                             "(default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed for the script "
+                             "(default: %(default)s)")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="eogtricks-harness-") as scratch:
+        harness = Harness(scratch, args.windows, args.images, args.seed,
+                          args.sync_files)
+        print("Plugins: %s" % (", ".join(
+            c.__name__ for c in harness.plugin_classes),))
+        print("%d windows × %d images, %d actions × %d cycles" % (
+            args.windows, args.images, args.actions, args.cycles))
+        for cycle in range(args.cycles):
+            before = harness.snapshot()
+            harness.activate_all()
+            harness.run_script(args.actions)
+            harness.deactivate_all()
+            leaks = harness.compare(before, harness.snapshot())
+            for (what, item, n) in leaks:
+                print("LEAK (cycle %d): %s: %s: %+d" % (cycle, what, item, n))
+            failed = failed or bool(leaks)
+
+        print("\nAccel table: %d reads, %d writes" % (
+            harness.app.accel_reads, harness.app.accel_writes))
+        harness.timings.report("Action or callback")
+        for (name, tb) in harness.errors[:10]:
+            print("\nERROR in %s:\n%s" % (name, tb))
+        if harness.errors:
+            print("%d action(s) raised" % (len(harness.errors),))
+            failed = True
+    if not failed:
+        print("\nNo leaks.")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# Plugin load time benchmark for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Measure what the EOGtricks plugins cost EOG at startup.
+
+By default, this times importing each plugin module in a fresh Python
+process, against a baseline of just importing EOG's own typelib::
+
+    python3 bench/plugin_load.py --runs 20
+
+With --launch, it times EOG itself from launch until its window is
+visible, with no plugins and then with all of the EOGtricks plugins
+from this tree enabled. This needs a display and xdotool::
+
+    python3 bench/plugin_load.py --launch some-image.jpg
+
+The plugins and the eogtricks package are run from the working tree.
+EOG's settings are redirected to a scratch directory, so your own
+configuration is left alone.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import glob
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = os.path.join(TOP_DIR, "eog")
+
+BASELINE_CODE = """
+import time
+t0 = time.perf_counter()
+import gi
+gi.require_version("Eog", "3.0")
+from gi.repository import Eog
+t1 = time.perf_counter()
+{plugin_code}
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t1)
+"""
+
+PLUGIN_CODE = """
+import importlib.util
+spec = importlib.util.spec_from_file_location({name!r}, {path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+"""
+
+
+def plugin_modules():
+    """Returns the (module name, path) of each plugin in the tree."""
+    modules = []
+    for info_path in sorted(glob.glob(os.path.join(PLUGIN_DIR, "*.plugin"))):
+        with open(info_path) as fp:
+            for line in fp:
+                if line.startswith("Module="):
+                    name = line.split("=", 1)[1].strip()
+                    path = os.path.join(PLUGIN_DIR, name + ".py")
+                    modules.append((name, path))
+    return modules
+
+
+def time_import(modules, runs):
+    """Median seconds to import the modules, after importing Eog."""
+    plugin_code = "\n".join(
+        PLUGIN_CODE.format(name=name, path=path)
+        for (name, path) in modules
+    )
+    code = BASELINE_CODE.format(plugin_code=plugin_code)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [TOP_DIR] + env.get("PYTHONPATH", "").split(os.pathsep)
+    ).rstrip(os.pathsep)
+    env.pop("EOGTRICKS_DEBUG", None)
+    baseline_times = []
+    plugin_times = []
+    for i in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", code], env=env)
+        base, plugins = (float(f) for f in out.split())
+        baseline_times.append(base)
+        plugin_times.append(plugins)
+    return statistics.median(baseline_times), statistics.median(plugin_times)
+
+
+def bench_imports(runs):
+    modules = plugin_modules()
+    base, total = time_import(modules, runs)
+    print("Baseline: importing Eog takes %0.2fms" % (base * 1000,))
+    for (name, path) in modules:
+        _, t = time_import([(name, path)], runs)
+        print("%-36s %8.2fms" % (name, t * 1000))
+    print("%-36s %8.2fms" % ("all plugins", total * 1000))
+
+
+def _launch_once(image, plugins, scratch):
+    """Seconds from launching EOG to its window becoming visible."""
+    config_dir = os.path.join(scratch, "config")
+    data_dir = os.path.join(scratch, "data")
+    keyfile_dir = os.path.join(config_dir, "glib-2.0", "settings")
+    os.makedirs(keyfile_dir, exist_ok=True)
+    with open(os.path.join(keyfile_dir, "keyfile"), "w") as fp:
+        fp.write("[org/gnome/eog/plugins]\n")
+        fp.write("active-plugins=%r\n" % (list(plugins),))
+
+    # Make the working tree's plugins visible to EOG.
+    user_plugin_dir = os.path.join(data_dir, "eog", "plugins")
+    if not os.path.isdir(user_plugin_dir):
+        os.makedirs(user_plugin_dir)
+        for path in glob.glob(os.path.join(PLUGIN_DIR, "*")):
+            target = os.path.join(user_plugin_dir, os.path.basename(path))
+            os.symlink(path, target)
+
+    env = dict(os.environ)
+    env["GSETTINGS_BACKEND"] = "keyfile"
+    env["XDG_CONFIG_HOME"] = config_dir
+    env["XDG_DATA_HOME"] = data_dir
+    env["PYTHONPATH"] = TOP_DIR
+    env.pop("EOGTRICKS_DEBUG", None)
+
+    t0 = time.perf_counter()
+    eog = subprocess.Popen(["eog", "--new-instance", image], env=env)
+    try:
+        subprocess.check_call(
+            ["xdotool", "search", "--sync", "--onlyvisible",
+             "--pid", str(eog.pid)],
+            stdout=subprocess.DEVNULL,
+        )
+        return time.perf_counter() - t0
+    finally:
+        eog.terminate()
+        eog.wait()
+
+
+def bench_launch(image, runs):
+    if not shutil.which("xdotool"):
+        sys.exit("The --launch benchmark needs xdotool to detect windows")
+    image = os.path.abspath(image)
+    plugins = [name for (name, path) in plugin_modules()]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="eogtricks-bench-") as scratch:
+        for (label, active) in [("baseline", []), ("all plugins", plugins)]:
+            times = [_launch_once(image, active, scratch)
+                     for i in range(runs)]
+            results[label] = statistics.median(times)
+            print("%-12s launch to window: %8.1fms (median of %d)"
+                  % (label, results[label] * 1000, runs))
+    cost = results["all plugins"] - results["baseline"]
+    print("EOGtricks plugin cost: %+0.1fms" % (cost * 1000,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=10,
+                        help="runs per measurement (default: %(default)s)")
+    parser.add_argument("--launch", metavar="IMAGE",
+                        help="time EOG launches showing IMAGE")
+    args = parser.parse_args()
+    if args.launch:
+        bench_launch(args.launch, args.runs)
+    else:
+        bench_imports(args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,36 +18,29 @@
 
 from __future__ import print_function
 
-import re
-import os
-import logging
-
 from gi.repository import Eog
 from gi.repository import GObject
 from gi.repository import Gio
 from gi.repository import Gtk
 from gi.repository import Pango
-from gi.repository import GLib
 
+import os
 
-logger = logging.getLogger(__name__)
-if os.environ.get("EOGTRICKS_DEBUG"):
-    logging.basicConfig(level=logging.DEBUG)
+import eogtricks
+from eogtricks.accels import AccelRegistry
+from eogtricks.folderwatch import FolderWatch
+from eogtricks.service import Service
+from eogtricks.tags import FORBIDDEN_ENTRY_CHARS
+from eogtricks.tags import split_tags
+from eogtricks.tags import join_tags
+from eogtricks.tags import tags2editstr
+from eogtricks.tags import editstr2tags
+from eogtricks.watchdog import watched
 
-TAG_RE = re.compile(r'\s*(\[[^\[\]]*\])\s*')
-FORBIDDEN_ENTRY_CHARS = '[ ] ; ,'.split(' ')
-FORBIDDEN_CHARS = re.compile(r'[\[\];,/]')
-FORBIDDEN_CHAR_REPLACEMENT = '_'
 
+logger = eogtricks.get_logger(__name__)
 
-def uniq(list, seen=None):
-    if seen is None:
-        seen = set()
-    for item in list:
-        if item in seen:
-            continue
-        seen.add(item)
-        yield(item)
+HINT_TAGS = 12  # most used tags in the folder, shown under the entry
 
 
 def check_entry_text(widget, string, len, pos):
@@ -57,76 +50,6 @@ def check_entry_text(widget, string, len, pos):
             widget.stop_emission_by_name('insert-text')
 
 
-def split_tags(basename):
-    basename, ext = os.path.splitext(basename)
-    tokens = TAG_RE.split(basename)
-    tokens = [t for t in tokens if t != ""]
-    if not tokens:
-        return ([], basename, [], ext)
-
-    start_tags = []
-    end_tags = []
-
-    if TAG_RE.fullmatch(tokens[0]):
-        block = tokens[0].strip("[]").strip()
-        tokens = tokens[1:]
-        start_tags.extend(block.split())
-    non_tag_tokens = []
-    for token in tokens:
-        if TAG_RE.fullmatch(token):
-            block = token.strip("[]").strip()
-            end_tags.extend(block.split())
-        else:
-            non_tag_tokens.append(token)
-
-    basename = "".join(non_tag_tokens)
-
-    seen = set()
-    start_tags = list(uniq(start_tags, seen))
-    end_tags = list(uniq(end_tags, seen))
-
-    return (start_tags, basename, end_tags, ext)
-
-
-def tags2editstr(start_tags, end_tags):
-    seen = set()
-    start_tags = list(uniq(start_tags, seen))
-    end_tags = list(uniq(end_tags, seen))
-    if start_tags and end_tags:
-        return ' / '.join((' '.join(start_tags), ' '.join(end_tags)))
-    elif end_tags and not start_tags:
-        return ' '.join(end_tags)
-    elif start_tags and not end_tags:
-        return ' '.join(start_tags) + ' /'
-    else:
-        return ''
-
-
-def editstr2tags(editstr):
-    blocks = editstr.split('/')
-    while len(blocks) > 2:
-        blocks[1] = blocks[1] + ' ' + blocks.pop()
-    tags = []
-    for b in blocks:
-        b_tags = b.lower().strip().split()
-        b_tags = [
-            FORBIDDEN_CHARS.sub(FORBIDDEN_CHAR_REPLACEMENT, w)
-            for w in b_tags
-            if w != ''
-        ]
-        tags.append(b_tags)
-    start_tags = []
-    end_tags = []
-    if len(tags) == 2:
-        start_tags, end_tags = tags
-    else:
-        end_tags = tags[0]
-    seen = set()
-    start_tags = list(uniq(start_tags, seen))
-    end_tags = list(uniq(end_tags, seen))
-    return start_tags, end_tags
-
-
 class TagEditor (GObject.GObject, Eog.WindowActivatable):
 
     ACTION_NAME = "edit-filename-tags"
@@ -137,20 +60,32 @@ class TagEditor (GObject.GObject, Eog.WindowActivatable):
         super().__init__()
         self.action = Gio.SimpleAction(name=self.ACTION_NAME)
         self.action.connect("activate", self._action_activated_cb)
+        self._service = None
+        self._watch = None
 
     def do_activate(self):
         logger.debug("Activated. Adding action win.%s", self.ACTION_NAME)
         self.window.add_action(self.action)
-        app = self.window.get_application()
-        app.set_accels_for_action(
-            "win." + self.ACTION_NAME,
-            ["numbersign"],
-        )
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.claim("eogtricks-bracket-tags", {
+            "win." + self.ACTION_NAME: ["numbersign"],
+        })
+        self._service = Service.for_app(self.window.get_application())
+        self._service.attach()
+        self._watch = FolderWatch.for_window(self.window)
+        self._watch.attach()
 
     def do_deactivate(self):
         logger.debug("Deactivated. Removing action win.%s", self.ACTION_NAME)
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.release("eogtricks-bracket-tags")
         self.window.remove_action(self.ACTION_NAME)
+        self._watch.detach()
+        self._watch = None
+        self._service.detach()
+        self._service = None
 
+    @watched
     def _action_activated_cb(self, action, param):
         img = self.window.get_image()
         if not img:
@@ -196,11 +131,23 @@ class TagEditor (GObject.GObject, Eog.WindowActivatable):
         label = Gtk.Label("Editing tags for “%s”" % orig_edit_name)
         label.set_ellipsize(Pango.EllipsizeMode.MIDDLE)
 
+        # The folder's most used tags, from the shared tag index.
+        folder_tags = self._service.folder_tags(
+            os.path.dirname(file.get_path()),
+        )
+        common = [t for (t, n) in folder_tags.most_common()
+                  if t not in tags1 and t not in tags2][:HINT_TAGS]
+        hint = Gtk.Label("Used here: " + " ".join(common))
+        hint.set_ellipsize(Pango.EllipsizeMode.END)
+        hint.set_sensitive(False)
+
         dialog.vbox.pack_start(label, 1, 1, 0)
         dialog.vbox.pack_start(entry, 0, 0, 0)
+        dialog.vbox.pack_start(hint, 0, 0, 0)
 
         entry.show()
         label.show()
+        hint.set_visible(bool(common))
 
         response = dialog.run()
         try:
@@ -208,46 +155,29 @@ class TagEditor (GObject.GObject, Eog.WindowActivatable):
                 return
 
             tags1, tags2 = editstr2tags(entry.get_text())
-            new_edit_name = ""
-            if tags1:
-                new_edit_name += "[{}] ".format(" ".join(tags1))
-            new_edit_name += basename
-            if tags2:
-                new_edit_name += " [{}]".format(" ".join(tags2))
-            new_edit_name += ext
+            new_edit_name = join_tags(tags1, basename, tags2, ext)
 
             # Rename the image by setting its GFile's display name.
 
             if new_edit_name != orig_edit_name:
                 logger.debug("Rename %r → %r", orig_edit_name, new_edit_name)
-                store = self.window.get_store()
-                old_pos = store.get_pos_by_image(img)
-                file.set_display_name(new_edit_name)
 
                 # If you rename the current image, the image is
                 # re-inserted at its new aphabetical location, and the
                 # UI's idea of the current image resets to position
                 # zero. This is confusing and makes things feel really
                 # inconsistent.
-
-                GLib.idle_add(self._set_current_idle_cb, old_pos)
+                #
+                # Keep the cursor position in the sequence at +1/0/-1
+                # away from its previous position instead. The place is
+                # found from the image before it once the folder's
+                # changes arrive, so it stays right even if a sync is
+                # adding or removing other files at the same time.
+
+                self._watch.hold_place(img)
+                file.set_display_name(new_edit_name)
 
         except:
             raise
         finally:
             dialog.destroy()
-
-    def _set_current_idle_cb(self, old_pos):
-        # Keeps the cursor position in the sequence at +1/0/-1 away
-        # from its previous position.
-        view = self.window.get_thumb_view()
-        store = self.window.get_store()
-        img = store.get_image_by_pos(old_pos)
-        view.set_current_image(img, True)
-        return False
-
-    def _print_accels(self):
-        app = self.window.get_application()
-        for detailed_name in app.list_action_descriptions():
-            print(detailed_name, end=", ")
-            print(app.get_accels_for_action(detailed_name))
@@ -0,0 +1,309 @@
+# Near-duplicate grouping plugin for Eye of GNOME.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import threading
+
+from gi.repository import Eog
+from gi.repository import GObject
+from gi.repository import Gio
+from gi.repository import GLib
+
+import eogtricks
+from eogtricks import groups
+from eogtricks.accels import AccelRegistry
+from eogtricks.folderwatch import Coalescer
+from eogtricks.folderwatch import FolderWatch
+from eogtricks.service import Service
+from eogtricks.watchdog import watched
+
+
+logger = eogtricks.get_logger(__name__)
+
+phash = eogtricks.lazy_import("eogtricks.phash")
+
+
+NEXT_GROUP_ACTION_NAME = "next-burst-group"
+PREVIOUS_GROUP_ACTION_NAME = "previous-burst-group"
+
+# Hash algorithm: "dhash" (the default), or "phash" (needs NumPy).
+HASH_ALGORITHM = os.environ.get("EOGTRICKS_BURST_HASH", "dhash")
+
+# Images whose hashes differ by at most this many bits are grouped.
+HASH_DISTANCE = int(os.environ.get("EOGTRICKS_BURST_DISTANCE") or 10)
+
+RESCAN_DELAY_MS = 1000  # after the folder's contents last changed
+
+
+class BurstGroups (GObject.Object, Eog.WindowActivatable):
+    """Group near-identical images, and jump between the groups.
+
+    Perceptual hashes of everything in the window's store are worked
+    out in the background, and images that look nearly the same are
+    grouped. The groups are published for other plugins: quick-move
+    uses them to move a whole group at once. Hashing uses the
+    application's worker processes, and hashes are cached on disk, so
+    a second window on the same folder finds them already done.
+
+    """
+
+    window = GObject.property(type=Eog.Window)
+
+    def __init__(self):
+        super(BurstGroups, self).__init__()
+        self._accels = {
+            "win." + NEXT_GROUP_ACTION_NAME: ["bracketright"],
+            "win." + PREVIOUS_GROUP_ACTION_NAME: ["bracketleft"],
+        }
+        self._actions = []
+        self._signal_handlers = []
+        self._group_index = {}  # {path: group number}
+        self._groups = []  # [[path]], as published
+        self._renames = []  # [(old path, new path)], for the hash cache
+        self._rescan = Coalescer(self._rescan_cb, RESCAN_DELAY_MS)
+        self._watch = None
+        self._watch_handle = None
+        self._generation = 0
+        self._cancelled = None
+        self._service = None
+
+    # Plugin activation and deactivation:
+
+    def _setup_action(self, name, cb):
+        action = Gio.SimpleAction(name=name)
+        action.connect("activate", cb)
+        self._actions.append(action)
+        self.window.add_action(action)
+        return action
+
+    def do_activate(self):
+        self._setup_action(NEXT_GROUP_ACTION_NAME,
+                           self._next_group_activate_cb)
+        self._setup_action(PREVIOUS_GROUP_ACTION_NAME,
+                           self._previous_group_activate_cb)
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.claim("eogtricks-bursts", self._accels)
+        self._service = Service.for_app(self.window.get_application())
+        self._service.attach()
+
+        store = self.window.get_store()
+        handler_info = [
+            ("row-inserted", self._store_changed_cb),
+            ("row-deleted", self._store_changed_cb),
+        ]
+        for sig, func in handler_info:
+            handler_id = store.connect(sig, func)
+            self._signal_handlers.append((store, handler_id))
+        self._watch = FolderWatch.for_window(self.window)
+        self._watch.attach()
+        self._watch_handle = self._watch.connect(self._folder_changed_cb)
+        self._rescan.poke()
+        logger.debug("Activated.")
+
+    def do_deactivate(self):
+        for (obj, hid) in self._signal_handlers:
+            obj.disconnect(hid)
+        self._signal_handlers[:] = []
+        self._watch.disconnect(self._watch_handle)
+        self._watch.detach()
+        self._watch = None
+        self._watch_handle = None
+        self._rescan.cancel()
+        self._stop_hashing()
+        self._service.detach()
+        self._service = None
+        groups.withdraw(self.window)
+        self._group_index.clear()
+        self._groups = []
+        self._renames = []
+
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.release("eogtricks-bursts")
+        for action in self._actions:
+            self.window.remove_action(action.get_name())
+        self._actions[:] = []
+        logger.debug("Deactivated.")
+
+    # Action callbacks:
+
+    @watched
+    def _next_group_activate_cb(self, action, param):
+        """Skip to the first image after the current image's group."""
+        self._go_to_group(+1)
+
+    @watched
+    def _previous_group_activate_cb(self, action, param):
+        """Skip back to the start of the previous group."""
+        self._go_to_group(-1)
+
+    def _group_key(self, img):
+        """Identifies an image's group. Ungrouped images are their own."""
+        path = img.get_file().get_path()
+        return self._group_index.get(path, path)
+
+    def _go_to_group(self, direction):
+        img = self.window.get_image()
+        if not img:
+            return
+        store = self.window.get_store()
+        n = store.length()
+        pos = store.get_pos_by_image(img)
+        if pos < 0:
+            return
+        key = self._group_key(img)
+
+        # Find the nearest image outside the current group.
+        target = None
+        i = pos + direction
+        while 0 <= i < n:
+            other = store.get_image_by_pos(i)
+            if self._group_key(other) != key:
+                target = i
+                break
+            i += direction
+        if target is None:
+            return
+
+        # Going backwards, land on the start of that image's run.
+        if direction < 0:
+            key = self._group_key(store.get_image_by_pos(target))
+            while target > 0:
+                other = store.get_image_by_pos(target - 1)
+                if self._group_key(other) != key:
+                    break
+                target -= 1
+
+        view = self.window.get_thumb_view()
+        view.set_current_image(store.get_image_by_pos(target), True)
+
+    # Keeping up with the folder:
+
+    @watched
+    def _store_changed_cb(self, store, *args):
+        # Called for every row during a sync, so keep it cheap.
+        self._rescan.poke()
+
+    @watched
+    def _folder_changed_cb(self, changes):
+        """Keep the groups right until the next rescan catches up.
+
+        Renamed images keep their place in their groups, and deleted
+        ones leave them. The renames are passed on to the hash cache,
+        so that the rescan only has to hash new or rewritten files.
+
+        """
+        if not (changes.renamed or changes.deleted):
+            return
+        self._renames.extend(changes.renamed.items())
+        found = []
+        for group in self._groups:
+            group = [changes.renamed.get(p, p) for p in group
+                     if p not in changes.deleted]
+            if len(group) > 1:
+                found.append(group)
+        self._set_groups(found)
+
+    def _set_groups(self, found):
+        self._groups = found
+        self._group_index = {
+            path: i
+            for (i, group) in enumerate(found)
+            for path in group
+        }
+        groups.publish(self.window, found)
+
+    @watched
+    def _rescan_cb(self):
+        store = self.window.get_store()
+        paths = []
+        for i in range(store.length()):
+            img = store.get_image_by_pos(i)
+            path = img.get_file().get_path()
+            if path is not None:
+                paths.append(path)
+
+        # Any scan in progress is out of date now.
+        if self._cancelled is not None:
+            self._cancelled.set()
+        self._generation += 1
+        if not paths:
+            return
+        self._cancelled = threading.Event()
+        thread = threading.Thread(
+            name="eogtricks-bursts",
+            target=self._hash_thread_run,
+            args=(self._generation, paths, self._renames, self._cancelled,
+                  self._service),
+            daemon=True,
+        )
+        thread.start()
+        self._renames = []
+
+    def _stop_hashing(self):
+        """Cancel all scans.
+
+        Their threads aren't waited for: chunks already running in the
+        worker processes can take a while. The threads end by
+        themselves once those are done, and the generation check in
+        _hashed_idle_cb() drops their results.
+
+        """
+        self._generation += 1
+        if self._cancelled is not None:
+            self._cancelled.set()
+            self._cancelled = None
+
+    # Hashing thread. Nothing in here may touch the UI directly.
+
+    def _hash_thread_run(self, generation, paths, renames, cancelled,
+                         service):
+        algorithm = phash.available_algorithm(HASH_ALGORITHM)
+        cache = phash.HashCache()
+        try:
+            if renames:
+                cache.rename_many(renames)
+            hashes = phash.hash_paths(
+                paths, algorithm,
+                cache=cache,
+                workers=0,
+                cancelled=cancelled,
+                service=service,
+            )
+            if hashes is None:
+                return
+            found = phash.group_hashes(hashes, HASH_DISTANCE)
+        except Exception:
+            logger.exception("Hashing failed")
+            return
+        finally:
+            cache.close()
+        logger.debug("%d image(s) hashed, %d group(s)",
+                     len(hashes), len(found))
+        GLib.idle_add(self._hashed_idle_cb, generation, found)
+
+    # Completion callback, back in the main thread:
+
+    @watched
+    def _hashed_idle_cb(self, generation, found):
+        if generation != self._generation:
+            return False
+        self._set_groups(found)
+        return False
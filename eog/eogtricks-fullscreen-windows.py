@@ -19,17 +19,50 @@
 
 from __future__ import print_function, division
 
-import logging
 import os
+import time
 
 from gi.repository import Eog
 from gi.repository import GObject
 from gi.repository import GLib
+from gi.repository import Gdk
 
+import eogtricks
+from eogtricks.watchdog import watched
 
-logger = logging.getLogger(__name__)
-if os.environ.get("EOGTRICKS_DEBUG"):
-    logging.basicConfig(level=logging.DEBUG)
+
+logger = eogtricks.get_logger(__name__)
+
+# Append startup timings to this file, if set.
+STARTUP_LOG_FILE = os.environ.get("EOGTRICKS_STARTUP_LOG")
+
+
+def _process_age():
+    """Returns how long ago this process started, in seconds.
+
+    Returns None if that can't be known on this platform.
+
+    """
+    try:
+        with open("/proc/self/stat") as fp:
+            stat = fp.read()
+        # Field 22 is the start time in clock ticks since boot. Split
+        # after the command name, which may contain spaces.
+        fields = stat.rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        started = start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except Exception:
+        return None
+
+
+# Best guess at when the process was launched, on the monotonic clock.
+_launch_age = _process_age()
+if _launch_age is None:
+    _launch_age = 0.0
+LAUNCH_TIME = time.monotonic() - _launch_age
+
+_first_frame_measured = False
 
 
 class FullscreenWindows (GObject.Object, Eog.WindowActivatable):
@@ -39,11 +72,23 @@ class FullscreenWindows (GObject.Object, Eog.WindowActivatable):
 
     def __init__(self):
         super(FullscreenWindows, self).__init__()
+        self._activated_time = None
+        self._allocations = 0
+        self._signal_handlers = []
 
     def do_activate(self):
         """Maximize each window this plugin is activated for."""
         assert self.window.has_action("view-fullscreen"), \
             "Eog.Window doesn't have the view-fullscreen action any more"
+        self._activated_time = time.monotonic()
+
+        # If the window hasn't been shown yet, make its first size the
+        # size of the screen. Otherwise the first image is laid out and
+        # scaled for the windowed size, and then all over again when
+        # the window manager gets round to fullscreening it.
+
+        if not self.window.get_mapped():
+            self._presize_to_monitor()
 
         # Could use self.window.fullscreen(), but doing it this way
         # resizes the image nicely too. And without it, the edge
@@ -55,8 +100,93 @@ class FullscreenWindows (GObject.Object, Eog.WindowActivatable):
             GLib.Variant("b", True),
         )
 
+        if not _first_frame_measured:
+            view = self.window.get_view()
+            handler_info = [
+                ("size-allocate", self._size_allocate_cb),
+                ("draw", self._draw_cb),
+            ]
+            for sig, func in handler_info:
+                handler_id = view.connect_after(sig, func)
+                self._signal_handlers.append((view, handler_id))
+
         return False
 
     def do_deactivate(self):
-        """Does nothing on deactivation"""
-        pass
+        """Tidies up any outstanding measurement on deactivation"""
+        self._disconnect_handlers()
+
+    # Initial geometry:
+
+    def _presize_to_monitor(self):
+        """Size the unmapped window to fit the monitor it will appear on."""
+        display = self.window.get_display()
+        monitor = None
+        try:
+            pointer = display.get_default_seat().get_pointer()
+            screen, x, y = pointer.get_position()
+            monitor = display.get_monitor_at_point(x, y)
+        except Exception:
+            logger.exception("Can't find the monitor under the pointer")
+        if monitor is None:
+            monitor = display.get_primary_monitor() or display.get_monitor(0)
+        if monitor is None:
+            return
+        geom = monitor.get_geometry()
+        logger.debug("Presizing to %dx%d before mapping",
+                     geom.width, geom.height)
+        self.window.set_default_size(geom.width, geom.height)
+        self.window.resize(geom.width, geom.height)
+        self.window.fullscreen()
+
+    # Time to first fitted frame:
+
+    @watched
+    def _size_allocate_cb(self, view, alloc):
+        self._allocations += 1
+
+    @watched
+    def _draw_cb(self, view, cr):
+        """Record the first fullscreen draw with a loaded image."""
+        global _first_frame_measured
+        if _first_frame_measured:
+            self._disconnect_handlers()
+            return False
+        image = view.get_image()
+        if image is None or image.get_status() != Eog.ImageStatus.LOADED:
+            return False
+        gdk_window = self.window.get_window()
+        if gdk_window is None:
+            return False
+        if not (gdk_window.get_state() & Gdk.WindowState.FULLSCREEN):
+            return False
+
+        _first_frame_measured = True
+        now = time.monotonic()
+        since_launch = now - LAUNCH_TIME
+        since_activate = now - self._activated_time
+        name = image.get_caption()
+        logger.info(
+            "First fitted frame of %r: %0.3fs after launch, "
+            "%0.3fs after activation, %d view allocation(s)",
+            name, since_launch, since_activate, self._allocations,
+        )
+        if STARTUP_LOG_FILE:
+            try:
+                with open(STARTUP_LOG_FILE, "a") as fp:
+                    fp.write("%s\t%0.4f\t%0.4f\t%d\t%s\n" % (
+                        time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        since_launch, since_activate,
+                        self._allocations, name,
+                    ))
+            except OSError:
+                logger.exception("Can't write to %r", STARTUP_LOG_FILE)
+        GLib.idle_add(self._disconnect_handlers)
+        return False
+
+    @watched
+    def _disconnect_handlers(self):
+        for (obj, hid) in self._signal_handlers:
+            obj.disconnect(hid)
+        self._signal_handlers[:] = []
+        return False
@@ -19,7 +19,6 @@
 from __future__ import print_function
 from __future__ import division
 
-import logging
 import os
 from enum import Enum
 
@@ -29,10 +28,21 @@ from gi.repository import Gtk
 from gi.repository import Gio
 from gi.repository import GLib
 
+import eogtricks
+from eogtricks.accels import AccelRegistry
+from eogtricks.folderwatch import Coalescer
+from eogtricks.frames import FrameTimeLog
+from eogtricks.scrollanim import ScrollAnimation
+from eogtricks.service import Service
+from eogtricks.watchdog import watched
 
-logger = logging.getLogger(__name__)
-if os.environ.get("EOGTRICKS_DEBUG"):
-    logging.basicConfig(level=logging.DEBUG)
+
+logger = eogtricks.get_logger(__name__)
+
+pages = eogtricks.lazy_import("eogtricks.pages")
+pageview = eogtricks.lazy_import("eogtricks.pageview")
+spreads = eogtricks.lazy_import("eogtricks.spreads")
+tileview = eogtricks.lazy_import("eogtricks.tileview")
 
 
 FIT_PAGE_WIDTH_ACTION_NAME = "zoom-fit-width"
@@ -40,8 +50,16 @@ FIT_PAGE_HEIGHT_ACTION_NAME = "zoom-fit-height"
 FIT_PAGE_MIN_ACTION_NAME = "zoom-fit-min"
 PAGE_FORWARD_ACTION_NAME = "page-forward"
 PAGE_BACKWARD_ACTION_NAME = "page-backward"
+OPEN_PAGES_ACTION_NAME = "open-page-archive"
+CLOSE_PAGES_ACTION_NAME = "close-pages"
+TILED_VIEW_ACTION_NAME = "toggle-tiled-view"
+SPREAD_VIEW_ACTION_NAME = "toggle-spread-view"
+
+ARCHIVE_PATTERNS = ["*.cbz", "*.CBZ", "*.zip", "*.ZIP"]
+TIFF_EXTENSIONS = {".tif", ".tiff"}
 
 PAGE_SCROLL_FRACTION = 0.9  # of a page
+RESPREAD_DELAY_MS = 250  # after the folder changes, when showing spreads
 
 
 class PageFit (Enum):
@@ -74,18 +92,32 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         super(PagerPlugin, self).__init__()
         self._hscroll = None
         self._vscroll = None
-        self._old_accels = {}
         self._accels = {
             "win." + FIT_PAGE_MIN_ACTION_NAME: ["x"],
             "win." + FIT_PAGE_WIDTH_ACTION_NAME: ["w"],
             "win." + FIT_PAGE_HEIGHT_ACTION_NAME: ["h"],
             "win." + PAGE_BACKWARD_ACTION_NAME: ["Prior", "b", "BackSpace"],
             "win." + PAGE_FORWARD_ACTION_NAME: ["Next", "space", "Return"],
+            "win." + OPEN_PAGES_ACTION_NAME: ["<Control><Shift>o"],
+            "win." + CLOSE_PAGES_ACTION_NAME: ["<Control><Shift>w"],
+            "win." + TILED_VIEW_ACTION_NAME: ["t"],
+            "win." + SPREAD_VIEW_ACTION_NAME: ["d"],
         }
         self._signal_handlers = []
         self._just_paged_direction = 0
         self._actions = []
         self._fit_page_mode = PageFit.NONE
+        self._page_view = None
+        self._page_source = None
+        self._image_pages = False
+        self._spread_images = None  # [Eog.Image] when showing spreads
+        self._spread_sizes = None  # Future reading sizes for spreads
+        self._respread = Coalescer(self._respread_cb, RESPREAD_DELAY_MS)
+        self._enter_last_page = False
+        self._tiled_view = None
+        self._service = None
+        self._scroll_anim = None
+        self._frame_log = FrameTimeLog()
 
     # Plugin activation:
 
@@ -107,30 +139,8 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
 
     def _setup_accels(self):
         """Establish the plugin's key bindings."""
-        assert not self._old_accels
-        app = self._app
-
-        action_descs = app.list_action_descriptions()
-
-        # Preseve existing keybindings
-        # where the keys will be shadowed by the new actions.
-        shadowed_keys = set()
-        for (name, keys) in self._accels.items():
-            for key in keys:
-                shadowed_keys.add(key)
-        for name in action_descs:
-            old_keys = app.get_accels_for_action(name)
-            new_keys = [k for k in old_keys if k not in shadowed_keys]
-            if new_keys == old_keys:
-                continue
-            self._old_accels[name] = old_keys
-            app.set_accels_for_action(name, new_keys)
-        logger.debug("Preserved %r", self._old_accels)
-
-        # Associate the new keybindings with their actions.
-        for (name, keys) in self._accels.items():
-            app.set_accels_for_action(name, keys)
-        logger.debug("Added bindings: %r", self._accels)
+        registry = AccelRegistry.for_app(self._app)
+        registry.claim("eogtricks-pager", self._accels)
 
     def _setup_action(self, name, cb):
         action = Gio.SimpleAction(name=name)
@@ -164,11 +174,31 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
             PAGE_FORWARD_ACTION_NAME,
             self._page_command_activate_cb,
         )
+        self._setup_action(
+            OPEN_PAGES_ACTION_NAME,
+            self._open_pages_activate_cb,
+        )
+        self._setup_action(
+            CLOSE_PAGES_ACTION_NAME,
+            self._close_pages_activate_cb,
+        )
+        self._setup_action(
+            TILED_VIEW_ACTION_NAME,
+            self._tiled_view_activate_cb,
+        )
+        self._setup_action(
+            SPREAD_VIEW_ACTION_NAME,
+            self._spread_view_activate_cb,
+        )
         assert self._actions
 
         # Keys
         self._setup_accels()
 
+        # Background work, shared with other windows
+        self._service = Service.for_app(self._app)
+        self._service.attach()
+
         # UI
         self._setup_scroll_bars()
 
@@ -177,27 +207,25 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         handler_info = [
             ("notify::image", self._notify_image_cb),
             ("notify::zoom-mode", self._notify_zoom_mode_cb),
+            ("zoom-changed", self._zoom_changed_cb),
         ]
         for sig, func in handler_info:
             handler_id = scroll_view.connect(sig, func)
             self._signal_handlers.append((scroll_view, handler_id))
+        store = self.window.get_store()
+        for sig in ["row-inserted", "row-deleted"]:
+            handler_id = store.connect(sig, self._store_changed_cb)
+            self._signal_handlers.append((store, handler_id))
+        handler_id = self.window.connect("key-press-event",
+                                         self._key_press_cb)
+        self._signal_handlers.append((self.window, handler_id))
 
     # Plugin deactivation:
 
     def _teardown_accels(self):
         """Revert the plugin's key bindings."""
-        app = self._app
-
-        # Remove the accels set up earlier
-        for name in self._accels.keys():
-            app.set_accels_for_action(name, [])
-        logger.debug("Removed bindings: %r", self._accels)
-
-        # Restore any previously shadowed bindings to their prior state.
-        for (name, old_keys) in self._old_accels.items():
-            app.set_accels_for_action(name, old_keys)
-        logger.debug("Restored %r", self._old_accels)
-        self._old_accels.clear()
+        registry = AccelRegistry.for_app(self._app)
+        registry.release("eogtricks-pager")
 
     def do_deactivate(self):
         logger.debug("Deactivating...")
@@ -206,7 +234,17 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         for (obj, hid) in self._signal_handlers:
             obj.disconnect(hid)
         self._signal_handlers[:] = []
+        self._respread.cancel()
+        self._cancel_spread_sizes()
+        self._stop_scroll_anim()
+        if self._frame_log.intervals:
+            logger.debug("Page scrolling: %s", self._frame_log.summary())
+            self._frame_log.save()
         self._teardown_accels()
+        self._close_pages()
+        self._close_tiled_view()
+        self._service.detach()
+        self._service = None
 
         # Remove the actions from the window.
         for action in self._actions:
@@ -215,14 +253,17 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
 
     # Action callbacks:
 
+    @watched
     def _fit_to_width_activate_cb(self, action, param):
         """Fit to the image width now, and on each new image load."""
         self._set_fit_mode(PageFit.WIDTH)
 
+    @watched
     def _fit_to_height_activate_cb(self, action, param):
         """Fit to the image width now, and on each new image load."""
         self._set_fit_mode(PageFit.HEIGHT)
 
+    @watched
     def _fit_to_min_activate_cb(self, action, param):
         """Fit to min(width, height) now, and on each new image load.
 
@@ -236,6 +277,10 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         logger.debug("Setting fit mode to %r", fit_mode)
         self._fit_page_mode = fit_mode
 
+        if self._page_view is not None:
+            self._fit_page_view()
+            return
+
         if fit_mode == PageFit.NONE:
             return
 
@@ -247,17 +292,18 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
             fit_dim = self._get_image_fit_dimension()
 
         if fit_dim == PageDimension.WIDTH:
-            adv_sb = self._vscroll
-            fit_sb = self._hscroll
+            adv_sb = self._get_scrollbar(Gtk.Orientation.VERTICAL)
+            fit_sb = self._get_scrollbar(Gtk.Orientation.HORIZONTAL)
         elif fit_dim == PageDimension.HEIGHT:
-            adv_sb = self._hscroll
-            fit_sb = self._vscroll
+            adv_sb = self._get_scrollbar(Gtk.Orientation.HORIZONTAL)
+            fit_sb = self._get_scrollbar(Gtk.Orientation.VERTICAL)
 
         self._scroll_to(fit_sb, 0.5)
         self._fit_dimension(fit_dim)
         frac = self._get_end_fraction(adv_sb, LayoutEnd.START)
         GLib.idle_add(self._scroll_to, adv_sb, frac)
 
+    @watched
     def _page_command_activate_cb(self, action, param):
         """Handle the user commands to page either backward or forward.
 
@@ -267,6 +313,12 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
 
         """
 
+        # Paging again before a scroll has finished moving starts the
+        # next one from where the last was going.
+        if self._scroll_anim is not None:
+            self._scroll_anim.finish()
+            self._scroll_anim = None
+
         # Decide which scrollbar. This code uses the scrollbar
         # visibility state as a proxy for "has the image been zoomed to
         # less that the size of the screen (in a particular dimension)?
@@ -280,11 +332,13 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
             fit_dim = PageDimension.HEIGHT
 
         if fit_dim == PageDimension.WIDTH:
-            sb = self._vscroll
+            sb = self._get_scrollbar(Gtk.Orientation.VERTICAL)
         else:
-            sb = self._hscroll
+            sb = self._get_scrollbar(Gtk.Orientation.HORIZONTAL)
         view = self.window.get_view()
-        sb_visible = view.scrollbars_visible() and sb.get_visible()
+        sb_visible = sb.get_visible()
+        if self._get_overlay() is None:
+            sb_visible = sb_visible and view.scrollbars_visible()
         sb_frac = self._get_scroll_frac(sb)
 
         # Decide the "logical" pager direction, and a secondary action
@@ -306,7 +360,8 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         # eog bug or design decision.
 
         sb_adv_sign = direction_sign
-        if self._get_rtl() and (sb is self._hscroll):
+        horizontal = (sb.get_orientation() == Gtk.Orientation.HORIZONTAL)
+        if self._get_rtl() and horizontal:
             sb_adv_sign *= -1
 
         if sb_adv_sign == 1:
@@ -319,24 +374,343 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
 
         # Move by a screenful, or progress to the next or previous
         # image. Sometimes that means going to a specific end of the
-        # previous or next image.
-        if view.get_zoom_mode() != Eog.ZoomMode.FREE:
+        # previous or next image. Archive and multi-page TIFF pages
+        # work the same way.
+        fitted = (view.get_zoom_mode() != Eog.ZoomMode.FREE)
+        if self._page_view is None and fitted:
             logger.debug("%s: %s (fitted)", action_name, go_action_name)
             self._just_paged_direction = 0
-            self.window.activate_action(go_action_name, None)
+            self._go_image(direction_sign, go_action_name)
         elif sb_visible and (sb_frac is not None) and within_limit(sb_frac):
             logger.debug("%s: scroll %s page within the current image",
                          action_name, sb_adv_sign)
 
             self._scroll_by_pages(sb, sb_adv_sign * PAGE_SCROLL_FRACTION)
+        elif self._page_view is not None:
+            end = (direction_sign > 0) and LayoutEnd.START or LayoutEnd.END
+            scroll = {sb.get_orientation(): self._get_end_fraction(sb, end)}
+            if self._page_view.go(direction_sign, scroll):
+                logger.debug("%s: page %d", action_name,
+                             self._page_view.get_index())
+            elif self._image_pages:
+                # The pages are closed when the image changes.
+                logger.debug("%s: past the image's pages, %s",
+                             action_name, go_action_name)
+                self._just_paged_direction = 0 if fitted else direction_sign
+                self._go_image(direction_sign, go_action_name,
+                               enter_pages=False)
         else:
             logger.debug("%s: %s and go to top/bottom",
                          action_name, go_action_name)
             self._just_paged_direction = direction_sign
-            self.window.activate_action(go_action_name, None)
+            self._go_image(direction_sign, go_action_name)
+
+    def _go_image(self, direction, go_action_name, enter_pages=True):
+        """Go to the next or previous image, via any pages it has."""
+        if (enter_pages and direction > 0
+                and self._open_image_pages(1, LayoutEnd.START)):
+            logger.debug("Paging on into the image's second page")
+            self._just_paged_direction = 0
+            return
+        self._enter_last_page = (direction < 0)
+        self.window.activate_action(go_action_name, None)
+
+    # Archive pages:
+
+    @watched
+    def _open_pages_activate_cb(self, action, param):
+        """Choose a comic book archive, and page through it."""
+        dialog = Gtk.FileChooserDialog(
+            "Open comic book archive", self.window,
+            Gtk.FileChooserAction.OPEN,
+            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+             Gtk.STOCK_OPEN, Gtk.ResponseType.OK),
+        )
+        archives = Gtk.FileFilter()
+        archives.set_name("Comic book archives")
+        for pattern in ARCHIVE_PATTERNS:
+            archives.add_pattern(pattern)
+        dialog.add_filter(archives)
+        dialog.set_local_only(True)
+        image = self.window.get_image()
+        if image is not None and image.get_file().get_path():
+            folder = os.path.dirname(image.get_file().get_path())
+            dialog.set_current_folder(folder)
+        dialog.set_default_response(Gtk.ResponseType.OK)
+
+        try:
+            if dialog.run() != Gtk.ResponseType.OK:
+                return
+            path = dialog.get_filename()
+        finally:
+            dialog.destroy()
+        self._open_pages(path)
+
+    @watched
+    def _close_pages_activate_cb(self, action, param):
+        """Go back to EOG's own view."""
+        if self._spread_images is not None:
+            self._close_spreads()
+        self._close_pages()
+
+    def _open_pages(self, path):
+        """Show the pages of an archive over EOG's view."""
+        try:
+            source = pages.open_source(path)
+        except Exception:
+            logger.exception("Failed to open %r", path)
+            return
+        if source is None or len(source) == 0:
+            logger.warning("No pages found in %r", path)
+            if source is not None:
+                source.close()
+            return
+        logger.debug("Opened %r: %d pages", path, len(source))
+        if not self._show_pages(source, 0, LayoutEnd.START):
+            source.close()
+
+    def _open_image_pages(self, index, end):
+        """Show the current image's pages, if it has more than one.
+
+        EOG only shows the first page of a multi-page TIFF, so the pager
+        carries on into the rest. Returns whether it did.
+
+        """
+        image = self.window.get_image()
+        if image is None:
+            return False
+        path = image.get_file().get_path()
+        if not path:
+            return False
+        if os.path.splitext(path)[1].lower() not in TIFF_EXTENSIONS:
+            return False
+        try:
+            source = pages.open_source(path)
+        except Exception:
+            logger.debug("Can't read pages of %r", path, exc_info=True)
+            return False
+        if source is None:
+            return False
+        if len(source) < 2 or not self._show_pages(source, index, end):
+            source.close()
+            return False
+        self._image_pages = True
+        return True
+
+    def _show_pages(self, source, index, end):
+        """Show a PageSource over EOG's view. Returns whether it could.
+
+        Negative page indices count back from the end. The end param is
+        the LayoutEnd of the page to scroll to.
+
+        """
+        view = self.window.get_view()
+        if not isinstance(view, Gtk.Overlay):
+            logger.error("Cannot show pages: the image view isn't an overlay")
+            return False
+        self._close_pages()
+        self._page_source = source
+        self._page_view = pageview.PageView(self._service)
+        view.add_overlay(self._page_view)
+        self._page_view.show_all()
+        self._fit_page_view()
+        if index < 0:
+            index += len(source)
+        self._page_view.set_source(source, index, self._get_page_ends(end))
+        return True
+
+    def _close_pages(self):
+        self._image_pages = False
+        self._spread_images = None
+        self._cancel_spread_sizes()
+        if self._page_view is None:
+            return
+        self._page_view.close()
+        self._page_view.destroy()
+        self._page_view = None
+        self._page_source.close()
+        self._page_source = None
+
+    # Two-page spreads:
+
+    @watched
+    def _spread_view_activate_cb(self, action, param):
+        """Show the folder's images as facing pages, or stop doing that."""
+        if self._spread_images is not None:
+            self._close_spreads()
+        elif self._spread_sizes is not None:
+            self._cancel_spread_sizes()
+        else:
+            self._open_spreads()
+
+    def _open_spreads(self, current=None):
+        """Show the store's images in pairs, from an image's spread.
+
+        By default that's the current image. Pairing only needs the
+        images' header sizes, which are read on a worker first. The
+        spreads are composited to fit the view as it is then, at screen
+        resolution.
+
+        """
+        store = self.window.get_store()
+        images = []
+        paths = []
+        for i in range(store.length()):
+            img = store.get_image_by_pos(i)
+            path = img.get_file().get_path()
+            if path:
+                images.append(img)
+                paths.append(path)
+        if not paths:
+            return
+        self._cancel_spread_sizes()
+        service = self._service
+        future = service.submit(None, self._read_sizes, service, paths)
+        future.add_done_callback(
+            lambda f: GLib.idle_add(
+                self._spread_sizes_idle_cb, f, images, paths, current,
+            ),
+        )
+        self._spread_sizes = future
+
+    @staticmethod
+    def _read_sizes(service, paths):
+        # Runs on a worker thread.
+        return [service.file_info(p)[1:] for p in paths]
+
+    def _cancel_spread_sizes(self):
+        if self._spread_sizes is not None:
+            self._service.release(self._spread_sizes)
+            self._spread_sizes = None
+
+    @watched
+    def _spread_sizes_idle_cb(self, future, images, paths, current):
+        """Lay out the spreads, once the image sizes are known."""
+        if future is not self._spread_sizes:
+            return False
+        self._spread_sizes = None
+        if future.cancelled():
+            return False
+        try:
+            sizes = future.result()
+        except Exception:
+            logger.exception("Failed to read the image sizes for spreads")
+            return False
+        view = self.window.get_view()
+        scale = view.get_scale_factor()
+        source = spreads.SpreadSource(
+            paths, sizes,
+            view.get_allocated_width() * scale,
+            view.get_allocated_height() * scale,
+            rtl=bool(self._get_rtl()),
+        )
+        index = 0
+        if current is None:
+            current = self.window.get_image()
+        if current is not None and current.get_file().get_path():
+            index = source.spread_of(current.get_file().get_path()) or 0
+        logger.debug("Showing %d images as %d spreads",
+                     len(paths), len(source))
+        if not self._show_pages(source, index, LayoutEnd.START):
+            source.close()
+            return False
+        self._spread_images = images
+        return False
+
+    def _close_spreads(self):
+        """Stop showing spreads, leaving EOG on the last one shown."""
+        source = self._page_source
+        page = source.spreads[self._page_view.get_index()][0]
+        img = self._spread_images[page]
+        self._close_pages()
+        store = self.window.get_store()
+        if store.get_pos_by_image(img) >= 0:
+            self.window.get_thumb_view().set_current_image(img, True)
+
+    @watched
+    def _store_changed_cb(self, store, *args):
+        """Pair the images up again once the folder settles down."""
+        if self._spread_images is None:
+            return
+        # Called for every row during a sync, so keep it cheap.
+        self._respread.poke()
+
+    @watched
+    def _respread_cb(self):
+        """Re-pair the images, staying on the same spread if possible.
+
+        Spreads whose files haven't changed are still in the cache.
+
+        """
+        if self._spread_images is None:
+            return
+        store = self.window.get_store()
+        spread = self._page_source.spreads[self._page_view.get_index()]
+        current = None
+        for page in spread:
+            img = self._spread_images[page]
+            if store.get_pos_by_image(img) >= 0:
+                current = img
+                break
+        self._open_spreads(current)
+
+    # Tiled view of very large images:
+
+    @watched
+    def _tiled_view_activate_cb(self, action, param):
+        """Show very large images from tiles, or stop doing that."""
+        if self._tiled_view is not None:
+            self._close_tiled_view()
+            return
+        view = self.window.get_view()
+        if not isinstance(view, Gtk.Overlay):
+            logger.error("Cannot tile: the image view isn't an overlay")
+            return
+        self._tiled_view = tileview.TiledView(self._service)
+        view.add_overlay(self._tiled_view)
+        view.reorder_overlay(self._tiled_view, 0)  # under any pages
+        self._update_tiled_view(LayoutEnd.START)
+
+    def _update_tiled_view(self, end):
+        """Point the tiled view at the current image, scrolled to an end.
+        """
+        view = self.window.get_view()
+        image = view.get_image()
+        path = None
+        if image is not None:
+            path = image.get_file().get_path()
+        self._tiled_view.set_image(path, view.get_zoom(),
+                                   self._get_page_ends(end))
+
+    def _close_tiled_view(self):
+        if self._tiled_view is None:
+            return
+        self._tiled_view.close()
+        self._tiled_view.destroy()
+        self._tiled_view = None
+
+    def _fit_page_view(self):
+        """Apply the fit mode to the archive page view."""
+        fit = {
+            PageFit.NONE: pageview.Fit.PAGE,
+            PageFit.WIDTH: pageview.Fit.WIDTH,
+            PageFit.HEIGHT: pageview.Fit.HEIGHT,
+            PageFit.MIN: pageview.Fit.MIN,
+        }[self._fit_page_mode]
+        self._page_view.set_fit(fit, self._get_page_ends(LayoutEnd.START))
+
+    def _get_page_ends(self, end):
+        """Page view scroll fractions for the same end in both directions.
+        """
+        hscroll = self._get_scrollbar(Gtk.Orientation.HORIZONTAL)
+        return {
+            Gtk.Orientation.HORIZONTAL: self._get_end_fraction(hscroll, end),
+            Gtk.Orientation.VERTICAL: (end is LayoutEnd.END) and 1.0 or 0.0,
+        }
 
     # Fitting and scrolling:
 
+    @watched
     def _fit_dimension(self, dim, compensate=True):
         """Fits the image to the EogScrollView's width or height.
 
@@ -396,12 +770,14 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         finally:
             return False
 
+    @watched
     def _scroll_to(self, range, frac):
         """Scrolls a GtkRange to a given fraction of its whole.
 
         This can be called as a one-shot idle function.
 
         """
+        self._stop_scroll_anim()
         frac = min(1.0, max(0.0, float(frac)))
         v_adj = range.get_adjustment()
 
@@ -420,7 +796,8 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
     def _get_end_fraction(self, sb, end):
         """Return the fraction to scroll to for a logical end. RTL aware."""
         frac = (end is LayoutEnd.END) and 1.0 or 0.0
-        if sb is self._hscroll and self._get_rtl():
+        horizontal = (sb.get_orientation() == Gtk.Orientation.HORIZONTAL)
+        if horizontal and self._get_rtl():
             # Should not have to perform this RTL compensation, surely?
             # I guess EOG thinks it shows images, not text.
             # Alternatively, could replace it with a user choice to just
@@ -478,20 +855,73 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
 
         value += n * page_size
         value = min(top, max(bottom, value))
-        v_adj.set_value(value)
+        self._stop_scroll_anim()
+        self._scroll_anim = ScrollAnimation(
+            self.window.get_view(), v_adj, value,
+            frame_log=self._frame_log,
+        )
+        self._scroll_anim.start()
 
         frac = (value - bottom) / (top - bottom)
 
         frac = min(1.0, max(0.0, float(frac)))
         return frac
 
+    def _stop_scroll_anim(self):
+        """Stops any animated page scroll where it is."""
+        if self._scroll_anim is not None:
+            self._scroll_anim.cancel()
+            self._scroll_anim = None
+
     # Signal handlers:
 
+    @watched
+    def _key_press_cb(self, window, event):
+        """Any key finishes an animated page scroll straight away."""
+        if self._scroll_anim is not None:
+            self._scroll_anim.finish()
+            self._scroll_anim = None
+        return False
+
+    @watched
     def _notify_image_cb(self, view, param):
         """Fit the smallest edge, &/or scroll to ends when the image changes.
         """
         logger.debug("_notify_image_cb: change of %r detected", param.name)
 
+        # The pages of the old image are no use now, but the new image
+        # may have pages of its own to enter from the end.
+        if self._image_pages:
+            self._close_pages()
+
+        # When showing spreads, follow EOG to the image's spread.
+        if self._spread_images is not None:
+            image = view.get_image()
+            index = None
+            if image is not None and image.get_file().get_path():
+                index = self._page_source.spread_of(
+                    image.get_file().get_path(),
+                )
+            if index is not None:
+                self._page_view.set_index(
+                    index, self._get_page_ends(LayoutEnd.START),
+                )
+            self._enter_last_page = False
+            self._just_paged_direction = 0
+            return
+
+        enter_last_page = self._enter_last_page
+        self._enter_last_page = False
+        if self._tiled_view is not None:
+            end = LayoutEnd.START
+            if self._just_paged_direction < 0:
+                end = LayoutEnd.END
+            self._update_tiled_view(end)
+        if enter_last_page and self._open_image_pages(-1, LayoutEnd.END):
+            logger.debug("_notify_image_cb: entered the last page")
+            self._just_paged_direction = 0
+            return
+
         fit_dim = None
         if self._fit_page_mode == PageFit.MIN:
             fit_dim = self._get_image_fit_dimension()
@@ -522,6 +952,7 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
 
         self._just_paged_direction = 0
 
+    @watched
     def _notify_zoom_mode_cb(self, view, param):
         """Changing the zoom mode turns off auto width/height fitting."""
         if self._just_paged_direction != 0:
@@ -535,16 +966,27 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         self._fit_page_mode = PageFit.NONE
         logger.debug("fit-page-min → %r", self._fit_page_mode)
 
+    @watched
+    def _zoom_changed_cb(self, view, zoom):
+        """Keep the tiled view at the same zoom as EOG's."""
+        if self._tiled_view is not None:
+            self._tiled_view.set_zoom(zoom)
+
     # Helpers:
 
     def _get_image_fit_dimension(self):
-        view = self.window.get_view()
-        image = view.get_image()
-        if image is None:
-            return PageDimension.WIDTH
-        assert (image.get_status() == Eog.ImageStatus.LOADED), \
-            "Image is not yet loaded, have to change assumptions here"
-        pixbuf = image.get_pixbuf()
+        if self._page_view is not None:
+            pixbuf = self._page_view.get_pixbuf()
+            if pixbuf is None:
+                return PageDimension.WIDTH
+        else:
+            view = self.window.get_view()
+            image = view.get_image()
+            if image is None:
+                return PageDimension.WIDTH
+            assert (image.get_status() == Eog.ImageStatus.LOADED), \
+                "Image is not yet loaded, have to change assumptions here"
+            pixbuf = image.get_pixbuf()
         w = pixbuf.get_width()
         h = pixbuf.get_height()
         if w < h:
@@ -552,17 +994,30 @@ class PagerPlugin (GObject.Object, Eog.WindowActivatable):
         else:
             return PageDimension.HEIGHT
 
+    def _get_overlay(self):
+        """The view shown over EOG's, with its own scrollbars, or None."""
+        if self._page_view is not None:
+            return self._page_view
+        if self._tiled_view is not None and self._tiled_view.is_ready():
+            return self._tiled_view
+        return None
+
+    def _get_scrollbar(self, orientation):
+        """The scrollbar to page with: the overlaid view's, if any."""
+        overlay = self._get_overlay()
+        if overlay is not None:
+            if orientation == Gtk.Orientation.HORIZONTAL:
+                return overlay.get_hscrollbar()
+            return overlay.get_vscrollbar()
+        if orientation == Gtk.Orientation.HORIZONTAL:
+            return self._hscroll
+        return self._vscroll
+
     @property
     def _app(self):
         """Returns the main application object."""
         return self.window.get_application()
 
-    def _dump_accels(self):
-        app = self._app
-        for n in sorted(app.list_action_descriptions()):
-            a = app.get_accels_for_action(n)
-            print("%s → %r" % (n, a))
-
     def _walk(self, widget):
         """Recursively walk the descendent widgets of a container."""
         widgets = [widget]
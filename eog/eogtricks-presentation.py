@@ -0,0 +1,378 @@
+# Presentation Mode plugin for Eye of GNOME.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+from gi.repository import Eog
+from gi.repository import GObject
+from gi.repository import Gio
+from gi.repository import GLib
+from gi.repository import Gtk
+from gi.repository import Gdk
+from gi.repository import GdkPixbuf
+
+import eogtricks
+from eogtricks.accels import AccelRegistry
+from eogtricks.frames import FrameTimeLog
+from eogtricks.service import Service
+from eogtricks.service import file_id
+from eogtricks.watchdog import watched
+
+
+logger = eogtricks.get_logger(__name__)
+
+
+PRESENTATION_ACTION_NAME = "presentation"
+
+# Seconds per slide. Zero means advance on keypresses only.
+SLIDE_SECONDS = float(os.environ.get("EOGTRICKS_SLIDE_SECONDS", "10"))
+
+TRANSITION_MS = 300
+PREFETCH_AHEAD = 2
+PREFETCH_BEHIND = 1
+
+NEXT_KEYS = {"space", "Right", "Down", "Page_Down", "Return", "KP_Enter"}
+PREVIOUS_KEYS = {"BackSpace", "Left", "Up", "Page_Up"}
+QUIT_KEYS = {"Escape", "q"}
+
+
+def load_fitted_pixbuf(path, width, height):
+    """Decode an image file to fit exactly within width × height pixels.
+
+    The embedded orientation is applied. This is safe to call from
+    worker threads.
+
+    """
+    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, width, height,
+                                                     True)
+    rotated = pixbuf.apply_embedded_orientation()
+    if (rotated.get_width(), rotated.get_height()) != \
+            (pixbuf.get_width(), pixbuf.get_height()):
+        # The orientation swapped the axes, so the first decode was
+        # fitted to the wrong box. Decode again for the rotated one.
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, height,
+                                                         width, True)
+        rotated = pixbuf.apply_embedded_orientation()
+    return rotated
+
+
+class PresentationWindow (Gtk.Window):
+    """Fullscreen slide display with prefetching and timed transitions."""
+
+    def __init__(self, parent, images, start_pos, service):
+        super(PresentationWindow, self).__init__(
+            type=Gtk.WindowType.TOPLEVEL,
+        )
+        self._service = service
+        self.set_transient_for(parent)
+        self.set_title("Presentation")
+        self._images = images
+        self._pos = start_pos
+        self._surfaces = {}  # {pos: cairo.Surface}
+        self._futures = {}  # {pos: Future}
+        self._current = None
+        self._previous = None
+        self._waiting_for = None
+        self._transition_start = None
+        self._tick_id = None
+        self._slide_timer_id = None
+        self.frame_log = FrameTimeLog()
+
+        display = parent.get_display()
+        monitor = display.get_monitor_at_window(parent.get_window())
+        geom = monitor.get_geometry()
+        self._scale = monitor.get_scale_factor()
+        self._width = geom.width
+        self._height = geom.height
+
+        self._area = Gtk.DrawingArea()
+        self._area.connect("draw", self._draw_cb)
+        self.add(self._area)
+        self.connect("key-press-event", self._key_press_cb)
+        self.connect("realize", self._realize_cb)
+        self.connect("destroy", self._destroy_cb)
+
+    @property
+    def image(self):
+        """The EogImage for the slide currently being shown."""
+        return self._images[self._pos]
+
+    # Startup and shutdown:
+
+    @watched
+    def _realize_cb(self, widget):
+        self.fullscreen()
+        self._prefetch()
+
+    @watched
+    def _destroy_cb(self, widget):
+        if self._tick_id is not None:
+            self._area.remove_tick_callback(self._tick_id)
+            self._tick_id = None
+        if self._slide_timer_id is not None:
+            GLib.source_remove(self._slide_timer_id)
+            self._slide_timer_id = None
+        for future in self._futures.values():
+            self._service.release(future)
+        self._futures.clear()
+        self._surfaces.clear()
+
+    # Prefetching:
+
+    def _prefetch(self):
+        """Decode the slides around the current one, and drop the rest."""
+        n = len(self._images)
+        wanted = set()
+        for offset in range(-PREFETCH_BEHIND, PREFETCH_AHEAD + 1):
+            p = self._pos + offset
+            if 0 <= p < n:
+                wanted.add(p)
+        for p in list(self._surfaces):
+            if p not in wanted:
+                del self._surfaces[p]
+        for p in list(self._futures):
+            if p not in wanted:
+                self._service.release(self._futures.pop(p))
+
+        # Current slide first, then forwards, then backwards.
+        order = sorted(wanted, key=lambda p: (p < self._pos,
+                                              abs(p - self._pos)))
+        w = self._width * self._scale
+        h = self._height * self._scale
+        for p in order:
+            if p in self._surfaces or p in self._futures:
+                continue
+            path = self._images[p].get_file().get_path()
+            try:
+                key = ("fitted", file_id(path), w, h)
+            except OSError:
+                key = None
+            future = self._service.submit(key, load_fitted_pixbuf, path, w, h)
+            future.add_done_callback(
+                lambda f, p=p: GLib.idle_add(self._decoded_idle_cb, p, f),
+            )
+            self._futures[p] = future
+
+    @watched
+    def _decoded_idle_cb(self, pos, future):
+        if self._futures.get(pos) is not future:
+            return False
+        del self._futures[pos]
+        if future.cancelled():
+            return False
+        try:
+            pixbuf = future.result()
+        except Exception:
+            logger.exception("Failed to decode slide %d", pos)
+            pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, False,
+                                          8, 1, 1)
+            pixbuf.fill(0)
+        gdk_window = self.get_window()
+        if gdk_window is None:
+            return False
+
+        # Upload now, not during the transition.
+        self._surfaces[pos] = Gdk.cairo_surface_create_from_pixbuf(
+            pixbuf, self._scale, gdk_window,
+        )
+        logger.debug("Slide %d ready", pos)
+        if self._waiting_for == pos:
+            self._waiting_for = None
+            self._show(pos)
+        elif self._current is None and pos == self._pos:
+            self._show(pos)
+        return False
+
+    # Navigation:
+
+    def go(self, delta):
+        n = len(self._images)
+        new_pos = self._pos + delta
+        if not (0 <= new_pos < n):
+            return
+        self._pos = new_pos
+        if new_pos in self._surfaces:
+            self._show(new_pos)
+        else:
+            logger.debug("Slide %d isn't ready yet", new_pos)
+            self.frame_log.stalls += 1
+            self._waiting_for = new_pos
+        self._prefetch()
+
+    def _show(self, pos):
+        """Start a transition to a decoded slide."""
+        self._previous = self._current
+        self._current = self._surfaces[pos]
+        self._transition_start = None
+        self.frame_log.reset_sequence()
+        if self._tick_id is None:
+            self._tick_id = self._area.add_tick_callback(self._tick_cb)
+        self._restart_slide_timer()
+
+    def _restart_slide_timer(self):
+        if self._slide_timer_id is not None:
+            GLib.source_remove(self._slide_timer_id)
+            self._slide_timer_id = None
+        if SLIDE_SECONDS > 0:
+            self._slide_timer_id = GLib.timeout_add(
+                int(SLIDE_SECONDS * 1000),
+                self._slide_timer_cb,
+            )
+
+    @watched
+    def _slide_timer_cb(self):
+        self._slide_timer_id = None
+        if self._pos + 1 < len(self._images):
+            self.go(1)
+        return False
+
+    # Frame-clock driven drawing:
+
+    @watched
+    def _tick_cb(self, widget, frame_clock):
+        frame_time = frame_clock.get_frame_time()
+        if self._transition_start is None:
+            self._transition_start = frame_time
+        self.frame_log.record(frame_clock)
+        widget.queue_draw()
+        elapsed_ms = (frame_time - self._transition_start) / 1000
+        if elapsed_ms >= TRANSITION_MS:
+            self._previous = None
+            self._tick_id = None
+            return GLib.SOURCE_REMOVE
+        return GLib.SOURCE_CONTINUE
+
+    def _transition_fraction(self):
+        if self._previous is None or self._transition_start is None:
+            return 1.0
+        frame_clock = self._area.get_frame_clock()
+        now = frame_clock.get_frame_time()
+        frac = (now - self._transition_start) / 1000 / TRANSITION_MS
+        return min(1.0, max(0.0, frac))
+
+    def _paint_surface(self, cr, surface, alpha):
+        w = self._area.get_allocated_width()
+        h = self._area.get_allocated_height()
+        sw = surface.get_width() / self._scale
+        sh = surface.get_height() / self._scale
+        cr.set_source_surface(surface, (w - sw) / 2, (h - sh) / 2)
+        if alpha >= 1.0:
+            cr.paint()
+        else:
+            cr.paint_with_alpha(alpha)
+
+    @watched
+    def _draw_cb(self, widget, cr):
+        cr.set_source_rgb(0, 0, 0)
+        cr.paint()
+        frac = self._transition_fraction()
+        if self._previous is not None and frac < 1.0:
+            self._paint_surface(cr, self._previous, 1.0)
+        if self._current is not None:
+            self._paint_surface(cr, self._current, frac)
+        return True
+
+    # Input:
+
+    @watched
+    def _key_press_cb(self, widget, event):
+        name = Gdk.keyval_name(event.keyval)
+        if name in NEXT_KEYS:
+            self.go(1)
+        elif name in PREVIOUS_KEYS:
+            self.go(-1)
+        elif name in QUIT_KEYS:
+            self.destroy()
+        else:
+            return False
+        return True
+
+
+class Presentation (GObject.Object, Eog.WindowActivatable):
+    """Present the images fullscreen, with smooth prefetched transitions."""
+
+    window = GObject.property(type=Eog.Window)
+
+    def __init__(self):
+        super(Presentation, self).__init__()
+        self.action = Gio.SimpleAction(name=PRESENTATION_ACTION_NAME)
+        self.action.connect("activate", self._presentation_activate_cb)
+        self._presentation = None
+        self._service = None
+
+    def do_activate(self):
+        logger.debug("Activated. Adding action win.%s",
+                     PRESENTATION_ACTION_NAME)
+        self.window.add_action(self.action)
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.claim("eogtricks-presentation", {
+            "win." + PRESENTATION_ACTION_NAME: ["<Shift>F5"],
+        })
+        self._service = Service.for_app(self.window.get_application())
+        self._service.attach()
+
+    def do_deactivate(self):
+        logger.debug("Deactivated. Removing action win.%s",
+                     PRESENTATION_ACTION_NAME)
+        if self._presentation is not None:
+            self._presentation.destroy()
+        self._service.detach()
+        self._service = None
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.release("eogtricks-presentation")
+        self.window.remove_action(PRESENTATION_ACTION_NAME)
+
+    @watched
+    def _presentation_activate_cb(self, action, param):
+        if self._presentation is not None:
+            self._presentation.present()
+            return
+        store = self.window.get_store()
+        n = store.length()
+        if n == 0:
+            return
+        images = [store.get_image_by_pos(i) for i in range(n)]
+        current = self.window.get_image()
+        start_pos = 0
+        if current is not None:
+            start_pos = max(0, store.get_pos_by_image(current))
+
+        logger.debug("Starting presentation of %d images at %d",
+                     n, start_pos)
+        presentation = PresentationWindow(self.window, images, start_pos,
+                                          self._service)
+        presentation.connect("destroy", self._presentation_destroy_cb)
+        presentation.show_all()
+        self._presentation = presentation
+
+    @watched
+    def _presentation_destroy_cb(self, presentation):
+        """Report the frame timings, and sync EOG to the last slide."""
+        self._presentation = None
+        frame_log = presentation.frame_log
+        logger.info("Presentation ended: %s", frame_log.summary())
+        frame_log.save()
+
+        img = presentation.image
+        store = self.window.get_store()
+        if store.get_pos_by_image(img) >= 0:
+            view = self.window.get_thumb_view()
+            view.set_current_image(img, True)
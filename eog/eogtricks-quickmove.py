@@ -19,27 +19,103 @@
 
 from __future__ import print_function
 
-import re
 import os
-import shutil
-import logging
+import queue
+import threading
 
 from gi.repository import Eog
 from gi.repository import GObject
 from gi.repository import Gio
 from gi.repository import Gtk
-from gi.repository import Pango
-from gi.repository import GLib
 
+import eogtricks
+from eogtricks import groups
+from eogtricks.accels import AccelRegistry
+from eogtricks.undo import UndoHistory
+from eogtricks.watchdog import watched
+
+
+logger = eogtricks.get_logger(__name__)
+
+shutil = eogtricks.lazy_import("shutil")
+fcntl = eogtricks.lazy_import("fcntl")
+
+FICLONE = 0x40049409  # from linux/fs.h
+
+# Longest a closing window waits for queued moves to be done.
+# The worker carries on with any left over by itself.
+DEACTIVATE_WAIT_SECONDS = 1.0
+
+
+def _reflink(src, dst):
+    """Makes dst a copy-on-write clone of src, sharing its data blocks."""
+    fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with open(src, "rb") as fp:
+            fcntl.ioctl(fd, FICLONE, fp.fileno())
+    except Exception:
+        os.close(fd)
+        os.unlink(dst)
+        raise
+    os.close(fd)
+    shutil.copystat(src, dst)
+
+
+def collect(src, folder):
+    """Puts a file into a folder without moving it or copying its data.
+
+    A hard link is made if possible. If not, because the folder is on
+    another filesystem or the filesystem has no hard links, a reflink
+    is tried, and then a symlink. Returns the new path, and which it
+    was.
+
+    """
+    dst = os.path.join(folder, os.path.basename(src))
+    if os.path.lexists(dst):
+        raise FileExistsError(dst)
+    try:
+        os.link(src, dst)
+        return (dst, "hardlink")
+    except OSError as e:
+        logger.debug("Can't hard link %r: %s", src, e)
+    try:
+        _reflink(src, dst)
+        return (dst, "reflink")
+    except OSError as e:
+        logger.debug("Can't reflink %r: %s", src, e)
+    os.symlink(os.path.abspath(src), dst)
+    return (dst, "symlink")
+
+
+class _QuickMoveEntry (object):
+    """Files moved or collected in one go, and where they ended up."""
+
+    def __init__(self, mode, folder, srcs):
+        super(_QuickMoveEntry, self).__init__()
+        self.mode = mode
+        self.folder = folder
+        self.srcs = srcs
+        self.done = []  # [(src, dst, lstat of dst)]
 
-logger = logging.getLogger(__name__)
-if os.environ.get("EOGTRICKS_DEBUG"):
-    logging.basicConfig(level=logging.DEBUG)
 
 class QuickMove(GObject.GObject, Eog.WindowActivatable):
+    """Moves or collects images into a target folder, one key press each.
+
+    Each target folder has a mode. Moving is the default. A folder in
+    collect mode gets links to the images instead, which leaves the
+    originals where they are and costs no copying. Both happen on a
+    worker thread, and Ctrl+Z undoes them along with the other plugins'
+    changes, see eogtricks.undo.
+
+    """
 
     ACTION_NEW_NAME = "new-quick-move-folder"
     ACTION_MOVE_NAME = "do-quick-move"
+    ACTION_MOVE_GROUP_NAME = "do-quick-move-group"
+    ACTION_COLLECT_NAME = "toggle-quick-move-collect"
+
+    MOVE = "move"
+    COLLECT = "collect"
 
     window = GObject.property(type=Eog.Window)
     folder = None # os.path.expanduser('~')
@@ -48,47 +124,125 @@ class QuickMove(GObject.GObject, Eog.WindowActivatable):
         super().__init__()
         self.action_new = Gio.SimpleAction(name=self.ACTION_NEW_NAME)
         self.action_move = Gio.SimpleAction(name=self.ACTION_MOVE_NAME)
+        self.action_move_group = Gio.SimpleAction(
+            name=self.ACTION_MOVE_GROUP_NAME)
+        self.action_collect = Gio.SimpleAction(
+            name=self.ACTION_COLLECT_NAME)
         self.action_new.connect("activate", self._new_activated_cb)
         self.action_move.connect("activate", self._move_activated_cb)
+        self.action_move_group.connect("activate",
+                                       self._move_group_activated_cb)
+        self.action_collect.connect("activate", self._collect_activated_cb)
+        self.modes = {}  # {folder: MOVE or COLLECT}
+        self._history = None
+        self._jobs = None
+        self._worker = None
 
     def do_activate(self):
         logger.debug("Activated. Adding action win.%s", self.ACTION_NEW_NAME)
         logger.debug("Activated. Adding action win.%s", self.ACTION_MOVE_NAME)
         self.window.add_action(self.action_new)
         self.window.add_action(self.action_move)
-        app = self.window.get_application()
-        app.set_accels_for_action( "win." + self.ACTION_NEW_NAME, ['N'], )
-        app.set_accels_for_action( "win." + self.ACTION_MOVE_NAME, ['M'], )
-        self.window.get_titlebar().set_subtitle("Target: None")
+        self.window.add_action(self.action_move_group)
+        self.window.add_action(self.action_collect)
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.claim("eogtricks-quickmove", {
+            "win." + self.ACTION_NEW_NAME: ['N'],
+            "win." + self.ACTION_MOVE_NAME: ['M'],
+            "win." + self.ACTION_MOVE_GROUP_NAME: ['<Control>m'],
+            "win." + self.ACTION_COLLECT_NAME: ['C'],
+        })
+        self._history = UndoHistory.for_window(self.window)
+        self._history.attach()
+        self._jobs = queue.Queue()
+        self._worker = threading.Thread(
+            name="eogtricks-quickmove",
+            target=self._worker_run,
+            daemon=True,
+        )
+        self._worker.start()
+        self._update_subtitle()
 
     def do_deactivate(self):
         logger.debug("Deactivated. Removing action win.%s", self.ACTION_NEW_NAME)
         logger.debug("Deactivated. Removing action win.%s", self.ACTION_MOVE_NAME)
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.release("eogtricks-quickmove")
         self.window.remove_action(self.ACTION_NEW_NAME)
         self.window.remove_action(self.ACTION_MOVE_NAME)
+        self.window.remove_action(self.ACTION_MOVE_GROUP_NAME)
+        self.window.remove_action(self.ACTION_COLLECT_NAME)
+
+        # Give anything queued a moment to finish, but moves across
+        # filesystems copy whole files, so don't hold the window up.
+        self._jobs.put(None)
+        self._worker.join(DEACTIVATE_WAIT_SECONDS)
+        if self._worker.is_alive():
+            # The queue still holds the stop marker.
+            logger.warning(
+                "Still moving in the background, with %d more job(s) "
+                "queued. Files not yet moved if EOG quits are left "
+                "where they are.",
+                max(0, self._jobs.qsize() - 1),
+            )
+        self._worker = None
+        self._jobs = None
+        self._history.detach(self)
+        self._history = None
 
+    @watched
     def _move_activated_cb(self, action, param):
-        if not self.folder:
+        img = self.window.get_image()
+        if not img:
             return
+        self._move_images(img, [img])
 
+    @watched
+    def _move_group_activated_cb(self, action, param):
+        """Move the current image and any images grouped with it."""
         img = self.window.get_image()
         if not img:
             return
-        if not img.is_file_writable():
+        group = groups.get_group(self.window, img.get_file().get_path())
+        if not group:
+            self._move_images(img, [img])
             return
+        store = self.window.get_store()
+        imgs = []
+        for i in range(store.length()):
+            other = store.get_image_by_pos(i)
+            if other.get_file().get_path() in group:
+                imgs.append(other)
+        logger.debug("Moving a group of %d", len(imgs))
+        self._move_images(img, imgs)
 
-        src = img.get_file().get_path()
-        srcdir = os.path.dirname(src)
-        dest = self.folder
+    @watched
+    def _collect_activated_cb(self, action, param):
+        """Switch the target folder between moving and collecting."""
+        if not self.folder:
+            return
+        if self.modes.get(self.folder) == self.COLLECT:
+            self.modes[self.folder] = self.MOVE
+        else:
+            self.modes[self.folder] = self.COLLECT
+        logger.debug("Target %r mode: %s", self.folder,
+                     self.modes[self.folder])
+        self._update_subtitle()
 
-        if srcdir == dest:
+    def _move_images(self, current, imgs):
+        """Move images to the target folder, stepping past them first."""
+        if not self.folder:
             return
 
-        # Create directory if it doesn't exist.
-        try:
-            os.makedirs(dest)
-        except OSError:
-            pass
+        dest = self.folder
+        mode = self.modes.get(dest, self.MOVE)
+        imgs = [
+            img for img in imgs
+            if (mode == self.COLLECT or img.is_file_writable())
+            and os.path.dirname(img.get_file().get_path()) != dest
+        ]
+        if current not in imgs:
+            return
 
         # If you rename the current image, the image is
         # re-inserted at its new aphabetical location, and the
@@ -96,17 +250,65 @@ class QuickMove(GObject.GObject, Eog.WindowActivatable):
         # zero. This is confusing and makes things feel really
         # inconsistent.
 
+        # Collected images stay put, but stepping past them
+        # is still what you want when picking out selects.
+
+        # The positions are found in one pass over the store, which
+        # may be large and changing while a sync is running.
+
         store = self.window.get_store()
-        old_pos = store.get_pos_by_image(img)
+        current_path = current.get_file().get_path()
+        paths = set(img.get_file().get_path() for img in imgs)
+        old_pos = -1
+        moving = set()
+        for i in range(store.length()):
+            path = store.get_image_by_pos(i).get_file().get_path()
+            if path in paths:
+                moving.add(i)
+                if path == current_path:
+                    old_pos = i
+        if old_pos < 0:
+            return
         view = self.window.get_thumb_view()
 
-        logger.debug("Adjusting view position to %d", old_pos+1)
-        img2 = store.get_image_by_pos(old_pos+1)
-        view.set_current_image(img2, True)
+        new_pos = old_pos + 1
+        while new_pos in moving:
+            new_pos += 1
+        if new_pos >= store.length():
+            new_pos = old_pos - 1
+            while new_pos in moving:
+                new_pos -= 1
+        if new_pos >= 0:
+            logger.debug("Adjusting view position to %d", new_pos)
+            img2 = store.get_image_by_pos(new_pos)
+            view.set_current_image(img2, True)
 
-        logger.debug("Move %r → %r", src, dest)
-        shutil.move(src, dest)
+        srcs = [img.get_file().get_path() for img in imgs]
+        entry = _QuickMoveEntry(mode, dest, srcs)
+        self._jobs.put((self._do_entry, entry))
+        self._history.push(entry, self._undo_entry, self)
 
+    def _undo_entry(self, entry):
+        """Put back a move or collect, when it's next in the undo history.
+
+        The worker does things in order, so this happens after the move
+        or collect itself, even if that's still queued.
+
+        """
+        logger.debug("Undo %s of %d file(s) to %r", entry.mode,
+                     len(entry.srcs), entry.folder)
+        self._jobs.put((self._undo_job, entry))
+
+    def _update_subtitle(self):
+        tb = self.window.get_titlebar()
+        if not self.folder:
+            tb.set_subtitle("Target: None")
+        elif self.modes.get(self.folder) == self.COLLECT:
+            tb.set_subtitle("Collect into: "+self.folder)
+        else:
+            tb.set_subtitle("Target: "+self.folder)
+
+    @watched
     def _new_activated_cb(self, action, param):
         dialog = Gtk.FileChooserDialog("Choose new target directory", self.window,
             Gtk.FileChooserAction.SELECT_FOLDER,
@@ -127,8 +329,7 @@ class QuickMove(GObject.GObject, Eog.WindowActivatable):
                 return
 
             self.folder = dialog.get_filename()
-            tb = self.window.get_titlebar()
-            tb.set_subtitle("Target: "+self.folder)
+            self._update_subtitle()
             logger.debug("New target folder: %s",self.folder)
 
         except:
@@ -136,3 +337,51 @@ class QuickMove(GObject.GObject, Eog.WindowActivatable):
         finally:
             dialog.destroy()
 
+    # Worker thread. Nothing in here may touch the UI.
+
+    def _worker_run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            func, arg = job
+            try:
+                func(arg)
+            except Exception:
+                logger.exception("Job %r failed", func)
+
+    def _do_entry(self, entry):
+        os.makedirs(entry.folder, exist_ok=True)
+        for src in entry.srcs:
+            try:
+                if entry.mode == self.COLLECT:
+                    (dst, how) = collect(src, entry.folder)
+                else:
+                    dst = shutil.move(src, entry.folder)
+                    how = "move"
+                st = os.lstat(dst)
+            except OSError as e:
+                logger.warning("Can't %s %r → %r: %s", entry.mode, src,
+                               entry.folder, e)
+                continue
+            logger.debug("%s %r → %r", how.capitalize(), src, dst)
+            entry.done.append((src, dst, st))
+
+    def _undo_job(self, entry):
+        while entry.done:
+            (src, dst, st) = entry.done.pop()
+            try:
+                # Only touch what's still exactly as we left it.
+                now = os.lstat(dst)
+                if (now.st_dev, now.st_ino) != (st.st_dev, st.st_ino):
+                    raise FileExistsError("%r was replaced" % (dst,))
+                if entry.mode == self.COLLECT:
+                    os.unlink(dst)
+                else:
+                    if os.path.lexists(src):
+                        raise FileExistsError(src)
+                    shutil.move(dst, src)
+            except OSError as e:
+                logger.warning("Can't undo %s of %r: %s", entry.mode, src, e)
+                continue
+            logger.debug("Undid %s of %r", entry.mode, src)
@@ -19,20 +19,154 @@
 from __future__ import print_function
 from __future__ import division
 
-import logging
 import os
+import time
+import queue
+import threading
 
 from gi.repository import Eog
 from gi.repository import GObject
+from gi.repository import Gio
+from gi.repository import GLib
+from gi.repository import Gtk
 
+import eogtricks
+from eogtricks.accels import AccelRegistry
+from eogtricks.undo import UndoHistory
+from eogtricks.watchdog import watched
 
-logger = logging.getLogger(__name__)
-if os.environ.get("EOGTRICKS_DEBUG"):
-    logging.basicConfig(level=logging.DEBUG)
+
+logger = eogtricks.get_logger(__name__)
+
+urllib_parse = eogtricks.lazy_import("urllib.parse")
+
+
+TRASH_ACTION_NAME = "safer-trash"
+REVIEW_ACTION_NAME = "review-staged-deletions"
+
+# EOG's own actions whose keys are taken over.
+REBOUND_ACTION_NAMES = ["win.delete", "win.move-trash"]
+
+# Deletions are staged, and committed to disk later in bulk.
+COMMIT_IDLE_SECONDS = 15  # after this long without a new deletion
+COMMIT_INTERVAL_SECONDS = 120  # and at least this often
+
+# Longest a closing window waits for the last deletions to be done.
+# The worker carries on with any left over by itself.
+DEACTIVATE_WAIT_SECONDS = 1.0
+
+# What committing does: "trash" (the default), or "unlink".
+DELETE_MODE = os.environ.get("EOGTRICKS_DELETE_MODE", "trash")
+
+
+# Freedesktop.org trash specification helpers:
+
+def _home_trash_dir():
+    """Returns the path to the user's home trash directory."""
+    return os.path.join(GLib.get_user_data_dir(), "Trash")
+
+
+def _unique_trash_name(basename, i):
+    """Names to try for a trashed file, like GIO's g_file_trash()."""
+    if i == 1:
+        return basename
+    stem, dot, rest = basename.partition(".")
+    if dot:
+        return "%s.%d.%s" % (stem, i, rest)
+    return "%s.%d" % (basename, i)
+
+
+def trash_to_home(path):
+    """Move a file into the home trash, following the trash spec.
+
+    Returns a (trashed_path, info_path) tuple describing where the file
+    went, or None if the file cannot be trashed this way because it is
+    on a different filesystem to the home trash.
+
+    """
+    trash_dir = _home_trash_dir()
+    files_dir = os.path.join(trash_dir, "files")
+    info_dir = os.path.join(trash_dir, "info")
+    for d in (files_dir, info_dir):
+        os.makedirs(d, mode=0o700, exist_ok=True)
+    if os.lstat(path).st_dev != os.stat(files_dir).st_dev:
+        return None
+
+    # Claim a name by creating the .trashinfo file exclusively.
+    basename = os.path.basename(path)
+    i = 1
+    while True:
+        trash_name = _unique_trash_name(basename, i)
+        info_path = os.path.join(info_dir, trash_name + ".trashinfo")
+        try:
+            fd = os.open(info_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                         0o600)
+        except FileExistsError:
+            i += 1
+            continue
+        break
+
+    info = "[Trash Info]\nPath=%s\nDeletionDate=%s\n" % (
+        urllib_parse.quote(os.path.abspath(path)),
+        time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    trashed_path = os.path.join(files_dir, trash_name)
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write(info)
+        os.rename(path, trashed_path)
+    except Exception:
+        os.unlink(info_path)
+        raise
+    return (trashed_path, info_path)
+
+
+def _find_in_trash(path):
+    """Slow path: look up a trashed file by its original path via GIO."""
+    trash = Gio.File.new_for_uri("trash:///")
+    attrs = "standard::name,trash::orig-path"
+    flags = Gio.FileQueryInfoFlags.NONE
+    enumerator = trash.enumerate_children(attrs, flags, None)
+    found = None
+    for info in enumerator:
+        if info.get_attribute_byte_string("trash::orig-path") == path:
+            found = trash.get_child(info.get_name())
+    enumerator.close(None)
+    return found
+
+
+class _TrashEntry (object):
+    """An image staged for deletion, and where its file ended up."""
+
+    STAGED = "staged"
+    TRASHING = "trashing"
+    TRASHED = "trashed"
+    UNLINKED = "unlinked"
+    RESTORED = "restored"
+    FAILED = "failed"
+
+    def __init__(self, image):
+        super(_TrashEntry, self).__init__()
+        self.image = image
+        self.path = image.get_file().get_path()
+        self.state = self.STAGED
+        self.trashed_path = None
+        self.info_path = None
+        self.undo_requested = False
 
 
 class NoDelete (GObject.Object, Eog.WindowActivatable):
-    """Remove the insta-delete accelerator, Shift+Delete now trashes"""
+    """Remove the insta-delete accelerators, Shift+Delete now deletes.
+
+    Deletion is handled by this plugin rather than by EOG. The image is
+    hidden straight away and staged for deletion. Staged files are
+    trashed (or unlinked) later, in bulk, on a worker thread: after a
+    short pause in deleting, periodically, and when the window closes.
+    Where each file went is remembered so that Ctrl+Z can put it back
+    without scanning the trash. Undo is shared with the other plugins
+    which change files, see eogtricks.undo.
+
+    """
 
     window = GObject.property(type=Eog.Window)
 
@@ -40,33 +174,339 @@ class NoDelete (GObject.Object, Eog.WindowActivatable):
         super(NoDelete, self).__init__()
         self._improved_bindings = {
             "win.delete": [],                    # was Shift+Delete
-            "win.move-trash": ["<Shift>Delete"],  # was Delete
+            "win.move-trash": [],                # was Delete
+            "win." + TRASH_ACTION_NAME: ["<Shift>Delete"],
         }
-        self._old_bindings = {}
+        self._actions = []
+        self._staged = []
+        self._history = None
+        self._idle_commit_id = None
+        self._interval_commit_id = None
+        self._jobs = None
+        self._worker = None
+        self._indicator = None
 
     @property
     def app(self):
         return self.window.get_application()
 
+    # Plugin activation and deactivation:
+
+    def _setup_action(self, name, cb):
+        action = Gio.SimpleAction(name=name)
+        action.connect("activate", cb)
+        self._actions.append(action)
+        self.window.add_action(action)
+        return action
+
+    def _setup_indicator(self):
+        """Add a pending deletions count to the header bar."""
+        titlebar = self.window.get_titlebar()
+        if not isinstance(titlebar, Gtk.HeaderBar):
+            return
+        button = Gtk.Button()
+        button.set_action_name("win." + REVIEW_ACTION_NAME)
+        button.set_tooltip_text("Review files staged for deletion")
+        button.set_no_show_all(True)
+        titlebar.pack_end(button)
+        self._indicator = button
+
     def do_activate(self):
-        app = self.app
-        action_descs = app.list_action_descriptions()
-        for (detailed_name, new_accels) in self._improved_bindings.items():
-            assert detailed_name in action_descs, \
-                "Missing {} command".format(detailed_name)
-            old_accels = app.get_accels_for_action(detailed_name)
-            self._old_bindings[detailed_name] = old_accels
-            app.set_accels_for_action(detailed_name, new_accels)
+        registry = AccelRegistry.for_app(self.app)
+        for name in REBOUND_ACTION_NAMES:
+            assert registry.had_bindings(name), \
+                "Missing {} command".format(name)
+
+        self._setup_action(TRASH_ACTION_NAME, self._trash_activate_cb)
+        self._setup_action(REVIEW_ACTION_NAME, self._review_activate_cb)
+        self._setup_indicator()
+        self._history = UndoHistory.for_window(self.window)
+        self._history.attach()
+
+        self._jobs = queue.Queue()
+        self._worker = threading.Thread(
+            name="eogtricks-safer-delete",
+            target=self._worker_run,
+            daemon=True,
+        )
+        self._worker.start()
+        self._interval_commit_id = GLib.timeout_add_seconds(
+            COMMIT_INTERVAL_SECONDS,
+            self._interval_commit_cb,
+        )
+
+        registry.claim("eogtricks-safer-delete", self._improved_bindings)
         logger.debug("Activated. Now using %r.", self._improved_bindings)
 
     def do_deactivate(self):
-        app = self.app
-        for (detailed_name, old_accels) in self._old_bindings.items():
-            app.set_accels_for_action(detailed_name, old_accels)
-        logger.debug("Deactivated. Reverting to %r.", self._old_bindings)
-        self._old_bindings = {}
-
-    def _dump_accels(self):
-        for n in sorted(self.app.list_action_descriptions()):
-            a = self.app.get_accels_for_action(n)
-            print("%s → %r" % (n, a))
+        registry = AccelRegistry.for_app(self.app)
+        registry.release("eogtricks-safer-delete")
+        logger.debug("Deactivated. Reverting key bindings.")
+
+        # Commit anything staged before the window goes away. Give the
+        # worker a moment to finish with it, but don't hang the window.
+        GLib.source_remove(self._interval_commit_id)
+        self._interval_commit_id = None
+        self._commit_staged()
+        self._jobs.put(None)
+        self._worker.join(DEACTIVATE_WAIT_SECONDS)
+        if self._worker.is_alive():
+            # The queue still holds the stop marker.
+            logger.warning(
+                "Still deleting in the background, with %d more "
+                "batch(es) queued. Files not yet deleted if EOG quits "
+                "are left where they are.",
+                max(0, self._jobs.qsize() - 1),
+            )
+        self._worker = None
+        self._jobs = None
+
+        if self._indicator is not None:
+            self._indicator.destroy()
+            self._indicator = None
+
+        self._history.detach(self)
+        self._history = None
+        for action in self._actions:
+            self.window.remove_action(action.get_name())
+        self._actions[:] = []
+
+    # Action callbacks:
+
+    @watched
+    def _trash_activate_cb(self, action, param):
+        """Hide the current image at once, and stage it for deletion."""
+        img = self.window.get_image()
+        if not img:
+            return
+        if not img.is_file_writable():
+            return
+
+        entry = _TrashEntry(img)
+        self._hide_image(img)
+        self._staged.append(entry)
+        self._history.push(entry, self._undo_entry, self)
+        self._update_indicator()
+        logger.debug("Staged %r for deletion", entry.path)
+
+        # Restart the inactivity countdown.
+        if self._idle_commit_id is not None:
+            GLib.source_remove(self._idle_commit_id)
+        self._idle_commit_id = GLib.timeout_add_seconds(
+            COMMIT_IDLE_SECONDS,
+            self._idle_commit_cb,
+        )
+
+    def _undo_entry(self, entry):
+        """Restore a deleted image, when it's next in the undo history."""
+        logger.debug("Undo deleting %r (%s)", entry.path, entry.state)
+        if entry.state == _TrashEntry.STAGED:
+            self._unstage(entry)
+        elif entry.state == _TrashEntry.TRASHING:
+            entry.undo_requested = True
+        elif entry.state == _TrashEntry.TRASHED:
+            self._jobs.put((self._restore_entry, entry))
+
+    @watched
+    def _review_activate_cb(self, action, param):
+        """Show the staged deletions, allowing them to be restored."""
+        if not self._staged:
+            return
+
+        flags = Gtk.DialogFlags.MODAL | Gtk.DialogFlags.DESTROY_WITH_PARENT
+        dialog = Gtk.Dialog(
+            "Staged Deletions",
+            self.window,
+            flags,
+            buttons=[
+                "Restore Selected", Gtk.ResponseType.REJECT,
+                "Delete Now", Gtk.ResponseType.APPLY,
+                "Close", Gtk.ResponseType.CLOSE,
+            ],
+        )
+        dialog.set_default_response(Gtk.ResponseType.CLOSE)
+        dialog.set_default_size(400, 300)
+
+        model = Gtk.ListStore(str, object)
+        for entry in self._staged:
+            model.append([os.path.basename(entry.path), entry])
+        tree = Gtk.TreeView(model=model)
+        tree.set_headers_visible(False)
+        tree.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
+        column = Gtk.TreeViewColumn("File", Gtk.CellRendererText(), text=0)
+        tree.append_column(column)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(tree)
+        dialog.vbox.pack_start(scrolled, True, True, 0)
+        scrolled.show_all()
+
+        response = dialog.run()
+        try:
+            if response == Gtk.ResponseType.REJECT:
+                model, paths = tree.get_selection().get_selected_rows()
+                for path in paths:
+                    entry = model[path][1]
+                    if entry.state == _TrashEntry.STAGED:
+                        self._history.remove(entry)
+                        self._unstage(entry)
+            elif response == Gtk.ResponseType.APPLY:
+                self._commit_staged()
+        finally:
+            dialog.destroy()
+
+    # Staging and committing:
+
+    def _unstage(self, entry):
+        self._staged.remove(entry)
+        entry.state = _TrashEntry.RESTORED
+        self._update_indicator()
+        self._show_image(entry.image)
+
+    @watched
+    def _idle_commit_cb(self):
+        self._idle_commit_id = None
+        self._commit_staged()
+        return False
+
+    @watched
+    def _interval_commit_cb(self):
+        self._commit_staged()
+        return True
+
+    def _commit_staged(self):
+        """Hand everything staged over to the worker thread."""
+        if self._idle_commit_id is not None:
+            GLib.source_remove(self._idle_commit_id)
+            self._idle_commit_id = None
+        if not self._staged:
+            return
+        batch = self._staged
+        self._staged = []
+        for entry in batch:
+            entry.state = _TrashEntry.TRASHING
+        self._update_indicator()
+        logger.debug("Committing %d deletion(s) (%s)", len(batch), DELETE_MODE)
+        if DELETE_MODE == "unlink":
+            self._jobs.put((self._unlink_batch, batch))
+        else:
+            self._jobs.put((self._trash_batch, batch))
+
+    def _update_indicator(self):
+        if self._indicator is None:
+            return
+        n = len(self._staged)
+        self._indicator.set_label("%d to delete" % (n,))
+        self._indicator.set_visible(n > 0)
+
+    # Worker thread. Nothing in here may touch the UI directly.
+
+    def _worker_run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            func, arg = job
+            try:
+                func(arg)
+            except Exception:
+                logger.exception("Job %r failed", func)
+
+    def _trash_batch(self, batch):
+        for entry in batch:
+            try:
+                location = trash_to_home(entry.path)
+                if location is None:
+                    Gio.File.new_for_path(entry.path).trash(None)
+                else:
+                    entry.trashed_path, entry.info_path = location
+            except Exception:
+                logger.exception("Failed to trash %r", entry.path)
+                GLib.idle_add(self._delete_failed_idle_cb, entry)
+                continue
+            logger.debug("Trashed %r → %r", entry.path, entry.trashed_path)
+            GLib.idle_add(self._trashed_idle_cb, entry)
+
+    def _unlink_batch(self, batch):
+        for entry in batch:
+            try:
+                os.unlink(entry.path)
+            except Exception:
+                logger.exception("Failed to unlink %r", entry.path)
+                GLib.idle_add(self._delete_failed_idle_cb, entry)
+                continue
+            logger.debug("Unlinked %r", entry.path)
+            GLib.idle_add(self._unlinked_idle_cb, entry)
+
+    def _restore_entry(self, entry):
+        try:
+            if os.path.lexists(entry.path):
+                raise FileExistsError(entry.path)
+            if entry.trashed_path is not None:
+                os.rename(entry.trashed_path, entry.path)
+                os.unlink(entry.info_path)
+            else:
+                trashed = _find_in_trash(entry.path)
+                if trashed is None:
+                    raise FileNotFoundError(entry.path)
+                flags = Gio.FileCopyFlags.NOFOLLOW_SYMLINKS
+                trashed.move(Gio.File.new_for_path(entry.path), flags)
+        except Exception:
+            logger.exception("Failed to restore %r", entry.path)
+            return
+        logger.debug("Restored %r", entry.path)
+        GLib.idle_add(self._restored_idle_cb, entry)
+
+    # Completion callbacks, back in the main thread:
+
+    @watched
+    def _trashed_idle_cb(self, entry):
+        entry.state = _TrashEntry.TRASHED
+        if entry.undo_requested and self._jobs is not None:
+            self._jobs.put((self._restore_entry, entry))
+        return False
+
+    @watched
+    def _unlinked_idle_cb(self, entry):
+        # No way back from this one.
+        entry.state = _TrashEntry.UNLINKED
+        if self._history is not None:
+            self._history.remove(entry)
+        return False
+
+    @watched
+    def _delete_failed_idle_cb(self, entry):
+        entry.state = _TrashEntry.FAILED
+        if self._history is not None:
+            self._history.remove(entry)
+        if self.window is not None:
+            self._show_image(entry.image)
+        return False
+
+    @watched
+    def _restored_idle_cb(self, entry):
+        entry.state = _TrashEntry.RESTORED
+        if self.window is not None:
+            self._show_image(entry.image)
+        return False
+
+    # Store manipulation:
+
+    def _hide_image(self, img):
+        """Remove an image from the store, moving on to its neighbour."""
+        store = self.window.get_store()
+        view = self.window.get_thumb_view()
+        pos = store.get_pos_by_image(img)
+        n = store.length()
+        if n > 1:
+            next_pos = (pos + 1) if (pos + 1 < n) else (pos - 1)
+            next_img = store.get_image_by_pos(next_pos)
+            view.set_current_image(next_img, True)
+        store.remove_image(img)
+
+    def _show_image(self, img):
+        """Put an image back into the store, and make it current."""
+        store = self.window.get_store()
+        if store.get_pos_by_image(img) < 0:
+            store.append_image(img)
+        view = self.window.get_thumb_view()
+        view.set_current_image(img, True)
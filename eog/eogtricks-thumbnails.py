@@ -0,0 +1,257 @@
+# Thumbnail pre-generation plugin for Eye of GNOME.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from __future__ import print_function
+from __future__ import division
+
+import bisect
+import os
+
+from gi.repository import Eog
+from gi.repository import GObject
+from gi.repository import Gio
+from gi.repository import Gtk
+from gi.repository import GLib
+
+import eogtricks
+from eogtricks.accels import AccelRegistry
+from eogtricks.service import Service
+from eogtricks.service import file_id
+from eogtricks.watchdog import watched
+
+
+logger = eogtricks.get_logger(__name__)
+
+thumbs = eogtricks.lazy_import("eogtricks.thumbs")
+
+
+PREGENERATE_ACTION_NAME = "pregenerate-thumbnails"
+
+JOBS_PER_WORKER = 2  # queued ahead, so no worker waits
+
+# Most thumbnailing jobs to have in flight at once. Unset means a
+# couple per worker process, and 0 runs them on the service's worker
+# threads instead.
+_workers = os.environ.get("EOGTRICKS_THUMBNAIL_WORKERS")
+THUMBNAIL_WORKERS = int(_workers) if _workers else None
+
+
+class Thumbnailer (GObject.Object, Eog.WindowActivatable):
+    """Make thumbnails for the whole folder, in the background.
+
+    Thumbnails go in the shared freedesktop.org cache, where EOG's
+    thumbnail strip looks for them. Files with valid thumbnails already
+    are skipped. Work is handed out to the application's worker
+    processes a file at a time, always the files nearest the current
+    image first, so the part of the strip being looked at fills in
+    soonest. A file another window is already thumbnailing isn't done
+    twice.
+
+    """
+
+    window = GObject.property(type=Eog.Window)
+
+    def __init__(self):
+        super(Thumbnailer, self).__init__()
+        self._accels = {
+            "win." + PREGENERATE_ACTION_NAME: ["<Control><Shift>t"],
+        }
+        self._actions = []
+        self._indicator = None
+        self._service = None
+        self._running = False
+        self._root = None
+        self._todo = []  # [(store position, path, uri)], sorted
+        self._positions = {}  # {path: store position}
+        self._futures = set()
+        self._slots = 0
+        self._total = 0
+        self._done = 0
+        self._written = 0
+        self._generation = 0
+
+    # Plugin activation and deactivation:
+
+    def _setup_action(self, name, cb):
+        action = Gio.SimpleAction(name=name)
+        action.connect("activate", cb)
+        self._actions.append(action)
+        self.window.add_action(action)
+        return action
+
+    def _setup_indicator(self):
+        """Add a progress label to the header bar."""
+        titlebar = self.window.get_titlebar()
+        if not isinstance(titlebar, Gtk.HeaderBar):
+            return
+        label = Gtk.Label()
+        label.set_tooltip_text("Making thumbnails for this folder")
+        label.set_no_show_all(True)
+        titlebar.pack_end(label)
+        self._indicator = label
+
+    def do_activate(self):
+        self._setup_action(PREGENERATE_ACTION_NAME,
+                           self._pregenerate_activate_cb)
+        self._setup_indicator()
+        self._service = Service.for_app(self.window.get_application())
+        self._service.attach()
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.claim("eogtricks-thumbnails", self._accels)
+        logger.debug("Activated.")
+
+    def do_deactivate(self):
+        self._stop()
+        self._service.detach()
+        self._service = None
+        if self._indicator is not None:
+            self._indicator.destroy()
+            self._indicator = None
+        registry = AccelRegistry.for_app(self.window.get_application())
+        registry.release("eogtricks-thumbnails")
+        for action in self._actions:
+            self.window.remove_action(action.get_name())
+        self._actions[:] = []
+        logger.debug("Deactivated.")
+
+    # Action callbacks:
+
+    @watched
+    def _pregenerate_activate_cb(self, action, param):
+        """Start making thumbnails for the folder, or stop."""
+        if self._running:
+            logger.debug("Stopped after %d of %d file(s)",
+                         self._done, self._total)
+            self._stop()
+            return
+        self._start()
+
+    # Running the workers:
+
+    def _start(self):
+        store = self.window.get_store()
+        self._todo = []
+        self._positions = {}
+        for i in range(store.length()):
+            f = store.get_image_by_pos(i).get_file()
+            path = f.get_path()
+            if path is not None:
+                self._todo.append((i, path, f.get_uri()))
+                self._positions[path] = i
+        if not self._todo:
+            return
+        self._total = len(self._todo)
+        self._done = 0
+        self._written = 0
+        self._root = thumbs.default_root()
+        self._running = True
+        if THUMBNAIL_WORKERS:
+            self._slots = THUMBNAIL_WORKERS
+        else:
+            workers = self._service.worker_count(
+                process=(THUMBNAIL_WORKERS is None))
+            self._slots = workers * JOBS_PER_WORKER
+        logger.debug("Thumbnailing %d file(s), %d at a time",
+                     self._total, self._slots)
+        self._fill()
+        if not self._futures:
+            self._stop()
+        self._update_indicator()
+
+    def _stop(self):
+        """Give up on queued work. Running work is left to finish."""
+        self._generation += 1
+        for future in self._futures:
+            self._service.release(future)
+        self._futures.clear()
+        self._running = False
+        self._todo = []
+        self._positions = {}
+        self._update_indicator()
+
+    def _next_file(self):
+        """Takes the file nearest the current image off the to-do list.
+
+        Ties go to the file after the current image, since that's the
+        way people usually go.
+
+        """
+        current = 0
+        img = self.window.get_image()
+        if img is not None:
+            current = self._positions.get(img.get_file().get_path(), 0)
+        todo = self._todo
+        ahead = bisect.bisect_left(todo, (current,))
+        behind = ahead - 1
+        if behind < 0 or (ahead < len(todo) and
+                          todo[ahead][0] - current
+                          <= current - todo[behind][0]):
+            return todo.pop(ahead)[1:]
+        return todo.pop(behind)[1:]
+
+    def _fill(self):
+        """Keep the workers busy."""
+        while self._todo and len(self._futures) < self._slots:
+            (path, uri) = self._next_file()
+            try:
+                key = ("thumbnail", file_id(path))
+            except OSError:
+                self._done += 1
+                continue
+            future = self._service.submit(
+                key, thumbs.thumbnail_files, [(path, uri)], self._root,
+                process=(THUMBNAIL_WORKERS != 0),
+            )
+            future.add_done_callback(
+                lambda f, g=self._generation:
+                    GLib.idle_add(self._file_done_idle_cb, g, f),
+            )
+            self._futures.add(future)
+
+    # Completion callback, back in the main thread:
+
+    @watched
+    def _file_done_idle_cb(self, generation, future):
+        if generation != self._generation or future not in self._futures:
+            return False
+        self._futures.remove(future)
+        self._done += 1
+        try:
+            results = future.result()
+        except Exception:
+            logger.exception("Thumbnail worker failed")
+        else:
+            self._written += sum(w for (p, w) in results if w)
+        self._fill()
+        if not self._futures:
+            logger.debug("Made %d thumbnail(s) for %d file(s)",
+                         self._written, self._total)
+            self._stop()
+            return False
+        self._update_indicator()
+        return False
+
+    def _update_indicator(self):
+        if self._indicator is None:
+            return
+        if not self._running:
+            self._indicator.hide()
+            return
+        self._indicator.set_text("Thumbnails %d/%d"
+                                 % (self._done, self._total))
+        self._indicator.show()
@@ -0,0 +1,130 @@
+# Shared support code for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Support code shared by the EOGtricks plugins.
+
+The plugin modules themselves live in EOG's plugin folder. This package
+is installed alongside them as a normal Python package.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import importlib
+import logging
+import os
+import sys
+
+
+# Submodules, which are only imported when first used.
+_SUBMODULES = {
+    "accels",
+    "archive",
+    "folderwatch",
+    "frames",
+    "groups",
+    "pages",
+    "pageview",
+    "phash",
+    "retag",
+    "scrollanim",
+    "service",
+    "spreads",
+    "tags",
+    "thumbs",
+    "tiff",
+    "tiles",
+    "tileview",
+    "undo",
+    "watchdog",
+}
+
+
+def get_logger(name):
+    """Returns a logger for a plugin or support module.
+
+    This sets up debugging output for all of EOGtricks if the
+    EOGTRICKS_DEBUG environment variable is set.
+
+    """
+    if os.environ.get("EOGTRICKS_DEBUG"):
+        logging.basicConfig(level=logging.DEBUG)
+    return logging.getLogger(name)
+
+
+class LazyModule (object):
+    """Stand-in for a module which is imported on first attribute access.
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__()
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # Only called for attributes not found normally.
+        module = self.__dict__.get("_module")
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self._module = module
+        return getattr(module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return "<LazyModule %r (%s)>" % (self._name, state)
+
+
+def lazy_import(name):
+    """Returns a module proxy which imports the module when first used.
+
+    Use this for modules that a plugin only needs once the user does
+    something, to keep them out of EOG's startup time.
+
+    """
+    return LazyModule(name)
+
+
+def worker_context():
+    """A multiprocessing context for worker processes started in EOG.
+
+    Forking EOG would duplicate its GTK state, so workers are spawned.
+    Inside EOG, sys.executable may be the eog binary rather than Python,
+    so this points the context at a real interpreter.
+
+    """
+    import multiprocessing
+    ctx = multiprocessing.get_context("spawn")
+    if not hasattr(sys, "argv"):
+        sys.argv = [""]  # embedded interpreters may not have one
+    exe = os.path.basename(sys.executable or "")
+    if not exe.startswith("python"):
+        for candidate in [
+                os.path.join(sys.base_exec_prefix, "bin",
+                             "python%d.%d" % sys.version_info[:2]),
+                os.path.join(sys.base_exec_prefix, "bin", "python3")]:
+            if os.path.exists(candidate):
+                ctx.set_executable(candidate)
+                break
+    return ctx
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,260 @@
+# Shared accelerator bookkeeping for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Application-wide key binding registry.
+
+Accelerators belong to the Gtk.Application, but the plugins are
+activated once per window. Rather than have every plugin scan and
+rewrite the whole accel table for every window, plugins claim their
+bindings here. The table is snapshotted once per application, and the
+effective bindings are recalculated from the snapshot and the set of
+live claims. That makes restoring correct whatever order the plugins
+are deactivated in.
+
+Usage::
+
+    registry = AccelRegistry.for_app(app)
+    registry.claim("pager", {"win.page-forward": ["space"]})
+    ...
+    registry.release("pager")
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+from eogtricks import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def normalize_accel(accel):
+    """Returns a canonical form of an accelerator string, for comparing.
+
+    GTK hands back accelerators in its own spelling, so "<Control>z"
+    may come back as "<Primary>z". Unparseable strings are returned
+    unchanged.
+
+    """
+    from gi.repository import Gtk
+    key, mods = Gtk.accelerator_parse(accel)
+    if key == 0 and mods == 0:
+        return accel
+    return Gtk.accelerator_name(key, mods)
+
+
+def dump_accels(app):
+    """Prints an application's accel table, for debugging."""
+    for name in sorted(app.list_action_descriptions()):
+        accels = app.get_accels_for_action(name)
+        print("%s → %r" % (name, accels))
+
+
+class _Claim (object):
+    """One plugin's bindings, shared by all of its windows."""
+
+    def __init__(self, owner, bindings, priority, serial):
+        super(_Claim, self).__init__()
+        self.owner = owner
+        self.bindings = {
+            name: list(keys)
+            for (name, keys) in bindings.items()
+        }
+        self.priority = priority
+        self.serial = serial
+        self.refcount = 1
+
+
+class AccelRegistry (object):
+    """Key bindings claimed by the EOGtricks plugins for one application.
+
+    Each claim maps detailed action names to the complete list of
+    accelerators that action should have. Keys that are claimed are
+    removed from any other action which had them in the snapshot.
+
+    If two plugins claim the same key or the same action, the claim
+    with the lower priority number wins, then the earlier claim. The
+    loser is logged, and gets the key back if the winner is released.
+
+    """
+
+    _registries = {}  # {Gtk.Application: AccelRegistry}
+
+    def __init__(self, app):
+        super(AccelRegistry, self).__init__()
+        self._app = app
+        self._claims = {}  # {owner: _Claim}
+        self._serial = 0
+
+        # One scan of the accel table, ever, per application.
+        self._snapshot = {}  # {action: [accel]}
+        self._key_index = {}  # {normalized accel: set([action])}
+        for name in app.list_action_descriptions():
+            accels = list(app.get_accels_for_action(name))
+            self._snapshot[name] = accels
+            for accel in accels:
+                norm = normalize_accel(accel)
+                self._key_index.setdefault(norm, set()).add(name)
+
+        # The actions whose accels currently differ from the snapshot.
+        self._changed = {}  # {action: [accel]}
+
+    @classmethod
+    def for_app(cls, app):
+        """Returns the registry for an application, creating it if needed.
+        """
+        registry = cls._registries.get(app)
+        if registry is None:
+            registry = cls(app)
+            cls._registries[app] = registry
+            logger.debug("Snapshotted %d bound actions",
+                         len(registry._snapshot))
+        return registry
+
+    # Public interface:
+
+    def claim(self, owner, bindings, priority=0):
+        """Claims a set of bindings on behalf of a named owner.
+
+        Claiming again with the same owner name just increments a
+        reference count, so a plugin can do this once per window.
+
+        """
+        claim = self._claims.get(owner)
+        if claim is not None:
+            claim.refcount += 1
+            return
+        self._serial += 1
+        self._claims[owner] = _Claim(owner, bindings, priority,
+                                     self._serial)
+        affected = set(bindings)
+        for keys in bindings.values():
+            for key in keys:
+                affected.update(self._key_index.get(normalize_accel(key),
+                                                    ()))
+        self._update(affected)
+        logger.debug("%s claimed %r", owner, bindings)
+
+    def release(self, owner):
+        """Releases one reference to an owner's claim.
+
+        When the last reference goes, the owner's keys are handed back
+        to whatever had them before, or to the next claimant. When the
+        last claim in the application goes, the snapshot is restored
+        and the registry is discarded.
+
+        """
+        claim = self._claims.get(owner)
+        if claim is None:
+            return
+        claim.refcount -= 1
+        if claim.refcount > 0:
+            return
+        del self._claims[owner]
+        logger.debug("%s released %r", owner, claim.bindings)
+
+        if not self._claims:
+            for name in list(self._changed):
+                self._set(name, self._snapshot.get(name, []))
+            self._registries.pop(self._app, None)
+            logger.debug("All claims released; accels restored")
+            return
+
+        # Anything the released claim may have affected, including
+        # keys that a losing claimant can now have.
+        affected = set(claim.bindings)
+        for keys in claim.bindings.values():
+            for key in keys:
+                affected.update(self._key_index.get(normalize_accel(key),
+                                                    ()))
+        for other in self._claims.values():
+            affected.update(other.bindings)
+        self._update(affected)
+
+    def had_bindings(self, action):
+        """Returns whether an action had any accels in the snapshot."""
+        return bool(self._snapshot.get(action))
+
+    def get_owner(self, action):
+        """Returns the owner whose claim currently governs an action."""
+        for claim in self._ordered_claims():
+            if action in claim.bindings:
+                return claim.owner
+        return None
+
+    # Internals:
+
+    def _ordered_claims(self):
+        return sorted(self._claims.values(),
+                      key=lambda c: (c.priority, c.serial))
+
+    def _resolve(self):
+        """Work out which claim gets each action and each key.
+
+        Returns ({action: [accel]}, {normalized accel: action}).
+
+        """
+        actions = {}
+        keys = {}
+        for claim in self._ordered_claims():
+            for (name, accels) in claim.bindings.items():
+                if name in actions:
+                    if accels != actions[name]:
+                        logger.warning(
+                            "%s: %s is already bound by %s",
+                            claim.owner, name, self.get_owner(name),
+                        )
+                    continue
+                won = []
+                for accel in accels:
+                    norm = normalize_accel(accel)
+                    if norm in keys:
+                        logger.warning(
+                            "%s: %s for %s is already bound to %s",
+                            claim.owner, accel, name, keys[norm],
+                        )
+                        continue
+                    keys[norm] = name
+                    won.append(accel)
+                actions[name] = won
+        return actions, keys
+
+    def _update(self, affected):
+        """Recalculate and apply the accels for a set of actions."""
+        claimed_actions, claimed_keys = self._resolve()
+        affected = set(affected) | set(self._changed)
+        for name in affected:
+            if name in claimed_actions:
+                wanted = claimed_actions[name]
+            else:
+                wanted = [
+                    a for a in self._snapshot.get(name, [])
+                    if normalize_accel(a) not in claimed_keys
+                ]
+            self._set(name, wanted)
+
+    def _set(self, name, accels):
+        current = self._changed.get(name, self._snapshot.get(name, []))
+        if accels == current:
+            return
+        self._app.set_accels_for_action(name, accels)
+        if accels == self._snapshot.get(name, []):
+            self._changed.pop(name, None)
+        else:
+            self._changed[name] = list(accels)
@@ -0,0 +1,247 @@
+# Comic book archive (CBZ/ZIP) page source for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Read the pages of a CBZ or ZIP archive, in place.
+
+The archive is memory-mapped, and its central directory is parsed once
+when it's opened. The image members are put in natural sort order at
+the same time. After that, reading a page touches only that member's
+bytes: stored members are sliced straight out of the mapping, and
+deflated ones are inflated a chunk at a time as the pixbuf loader
+consumes them. Nothing is extracted to disk.
+
+Python's zipfile module isn't used because it reads through a shared
+file object, which would serialize the decoding threads, and because
+it can't hand out slices of the mapping.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import mmap
+import zlib
+import struct
+import collections
+
+from eogtricks import get_logger
+from eogtricks.pages import PageSource
+from eogtricks.pages import IMAGE_EXTENSIONS
+from eogtricks.pages import CHUNK_SIZE
+from eogtricks.pages import natural_key
+
+
+logger = get_logger(__name__)
+
+_EOCD = struct.Struct("<4sHHHHIIH")
+_EOCD_SIG = b"PK\x05\x06"
+_ZIP64_LOCATOR = struct.Struct("<4sIQI")
+_ZIP64_LOCATOR_SIG = b"PK\x06\x07"
+_ZIP64_EOCD = struct.Struct("<4sQHHIIQQQQ")
+_ZIP64_EOCD_SIG = b"PK\x06\x06"
+_CENTRAL = struct.Struct("<4sHHHHHHIIIHHHHHII")
+_CENTRAL_SIG = b"PK\x01\x02"
+_LOCAL = struct.Struct("<4sHHHHHIIIHH")
+_LOCAL_SIG = b"PK\x03\x04"
+
+_MAX_COMMENT = 0xFFFF
+_FLAG_ENCRYPTED = 0x1
+_FLAG_UTF8 = 0x800
+_STORED = 0
+_DEFLATED = 8
+
+
+Member = collections.namedtuple(
+    "Member",
+    ["name", "method", "crc", "compressed_size", "size", "header_offset"],
+)
+
+
+class ZipError (Exception):
+    """The file isn't a ZIP archive this can read."""
+
+
+class ZipPageSource (PageSource):
+    """The image members of a ZIP archive, in natural sort order."""
+
+    def __init__(self, path):
+        super(ZipPageSource, self).__init__(path)
+        self._fp = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._fp.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fp.close()
+            raise ZipError("%s: empty file" % (path,))
+        self._data_offsets = {}  # {index: offset}
+        try:
+            members = self._read_central_directory()
+        except Exception:
+            self.close()
+            raise
+        members = [m for m in members if self._is_page(m)]
+        members.sort(key=lambda m: natural_key(m.name))
+        self._members = members
+        logger.debug("%s: %d page(s)", path, len(members))
+
+    # Central directory:
+
+    def _read_central_directory(self):
+        mm = self._map
+        size = len(mm)
+        start = max(0, size - _EOCD.size - _MAX_COMMENT)
+        pos = mm.rfind(_EOCD_SIG, start)
+        if pos < 0:
+            raise ZipError("%s: no end of central directory" % (self.path,))
+        (sig, disk, cd_disk, n_here, n_total,
+         cd_size, cd_offset, comment_len) = _EOCD.unpack_from(mm, pos)
+
+        if 0xFFFFFFFF in (cd_size, cd_offset) or n_total == 0xFFFF:
+            loc_pos = pos - _ZIP64_LOCATOR.size
+            if loc_pos >= 0 and mm[loc_pos:loc_pos + 4] == _ZIP64_LOCATOR_SIG:
+                (sig, disk, eocd64_offset, n_disks) = \
+                    _ZIP64_LOCATOR.unpack_from(mm, loc_pos)
+                fields = _ZIP64_EOCD.unpack_from(mm, eocd64_offset)
+                if fields[0] != _ZIP64_EOCD_SIG:
+                    raise ZipError("%s: bad ZIP64 end record" % (self.path,))
+                n_total, cd_size, cd_offset = fields[7], fields[8], fields[9]
+
+        members = []
+        pos = cd_offset
+        for i in range(n_total):
+            fields = _CENTRAL.unpack_from(mm, pos)
+            if fields[0] != _CENTRAL_SIG:
+                raise ZipError("%s: bad central directory entry %d"
+                               % (self.path, i))
+            (sig, made_by, needed, flags, method, mtime, mdate, crc,
+             csize, usize, name_len, extra_len, comment_len,
+             disk_start, int_attr, ext_attr, offset) = fields
+            pos += _CENTRAL.size
+            raw_name = mm[pos:pos + name_len]
+            pos += name_len
+            extra = mm[pos:pos + extra_len]
+            pos += extra_len + comment_len
+
+            if 0xFFFFFFFF in (csize, usize, offset):
+                usize, csize, offset = self._zip64_extra(
+                    extra, usize, csize, offset,
+                )
+            if flags & _FLAG_ENCRYPTED:
+                continue
+            encoding = "utf-8" if flags & _FLAG_UTF8 else "cp437"
+            name = raw_name.decode(encoding, "replace")
+            members.append(Member(name, method, crc, csize, usize, offset))
+        return members
+
+    @staticmethod
+    def _zip64_extra(extra, usize, csize, offset):
+        """Fill in the 64-bit sizes and offset from the extra field."""
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, length = struct.unpack_from("<HH", extra, pos)
+            pos += 4
+            if tag == 0x0001:
+                values = []
+                for i in range(length // 8):
+                    values.extend(struct.unpack_from("<Q", extra,
+                                                     pos + i * 8))
+                if usize == 0xFFFFFFFF and values:
+                    usize = values.pop(0)
+                if csize == 0xFFFFFFFF and values:
+                    csize = values.pop(0)
+                if offset == 0xFFFFFFFF and values:
+                    offset = values.pop(0)
+                break
+            pos += length
+        return usize, csize, offset
+
+    def _is_page(self, member):
+        if member.name.endswith("/"):
+            return False
+        if member.method not in (_STORED, _DEFLATED):
+            logger.warning("%s: %r uses unsupported compression method %d",
+                           self.path, member.name, member.method)
+            return False
+        basename = os.path.basename(member.name)
+        if basename.startswith("."):
+            return False
+        ext = os.path.splitext(basename)[1].lower()
+        return ext in IMAGE_EXTENSIONS
+
+    # PageSource interface:
+
+    def __len__(self):
+        return len(self._members)
+
+    def page_name(self, index):
+        return self._members[index].name
+
+    def _data_offset(self, index):
+        """Where a member's data starts, from its local header."""
+        offset = self._data_offsets.get(index)
+        if offset is None:
+            member = self._members[index]
+            fields = _LOCAL.unpack_from(self._map, member.header_offset)
+            if fields[0] != _LOCAL_SIG:
+                raise ZipError("%s: bad local header for %r"
+                               % (self.path, member.name))
+            name_len, extra_len = fields[9], fields[10]
+            offset = (member.header_offset + _LOCAL.size
+                      + name_len + extra_len)
+            self._data_offsets[index] = offset
+        return offset
+
+    def iter_chunks(self, index, chunk_size=CHUNK_SIZE):
+        """Yields a page's bytes, verifying its CRC at the end."""
+        member = self._members[index]
+        start = self._data_offset(index)
+        end = start + member.compressed_size
+        if end > len(self._map):
+            raise ZipError("%s: %r is truncated" % (self.path, member.name))
+        crc = 0
+        with memoryview(self._map) as view:
+            if member.method == _STORED:
+                for pos in range(start, end, chunk_size):
+                    chunk = view[pos:min(end, pos + chunk_size)]
+                    crc = zlib.crc32(chunk, crc)
+                    yield chunk
+            else:
+                inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+                for pos in range(start, end, chunk_size):
+                    data = inflater.decompress(
+                        view[pos:min(end, pos + chunk_size)],
+                    )
+                    if data:
+                        crc = zlib.crc32(data, crc)
+                        yield data
+                data = inflater.flush()
+                if data:
+                    crc = zlib.crc32(data, crc)
+                    yield data
+        if crc != member.crc:
+            raise ZipError("%s: CRC mismatch in %r"
+                           % (self.path, member.name))
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
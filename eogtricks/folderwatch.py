@@ -0,0 +1,535 @@
+# Batched folder changes for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Changes to the folder being viewed, in batches.
+
+When a sync tool or an import script adds, removes or renames thousands
+of files in the folder being viewed, the file monitor reports each one
+separately. Anything which reacted to every event would rescan the
+folder thousands of times, and EOG loses its place when the current
+image is renamed or deleted from under it.
+
+Instead, a FolderMonitor collects a folder's events until they go quiet
+for a moment, and passes them on as a single Changes batch, in which
+creations and deletions that cancel out are dropped, and renames are
+chained together. A steady stream of events is still passed on every
+couple of seconds. There is one monitor per folder, shared between
+windows by the application's Service.
+
+Each window has a FolderWatch, which follows the window's folder, keeps
+the window on the right image across each batch, and passes the
+batches on to the plugins::
+
+    watch = FolderWatch.for_window(window)
+    watch.attach()
+    handle = watch.connect(self._folder_changed_cb)  # gets a Changes
+    ...
+    watch.hold_place(img)  # before renaming the current image
+    ...
+    watch.disconnect(handle)
+    watch.detach()
+
+Everything here is main thread only.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import itertools
+
+from gi.repository import GLib
+
+from eogtricks import get_logger
+from eogtricks.watchdog import watched
+
+
+logger = get_logger(__name__)
+
+COALESCE_MS = int(os.environ.get("EOGTRICKS_COALESCE_MS") or 250)
+MAX_TICKS = 8  # longest a batch is put off, in COALESCE_MS ticks
+NEIGHBOURS = 4  # images remembered either side of the current one
+
+
+class Coalescer (object):
+    """Calls a function once a run of pokes has gone quiet.
+
+    Poking is cheap enough to do for every event in a flood: a timer is
+    only set up once per run. While the pokes keep coming, the call is
+    put off a tick at a time, up to max_ticks.
+
+    """
+
+    def __init__(self, func, interval_ms=COALESCE_MS, max_ticks=MAX_TICKS):
+        super(Coalescer, self).__init__()
+        self.interval_ms = interval_ms
+        self.max_ticks = max_ticks
+        self._func = func
+        self._timeout_id = None
+        self._ticks = 0
+        self._poked = False
+
+    @property
+    def pending(self):
+        return self._timeout_id is not None
+
+    def poke(self):
+        """Calls the function later, when the pokes stop."""
+        if self._timeout_id is not None:
+            self._poked = True
+            return
+        self._ticks = 0
+        self._poked = False
+        self._timeout_id = GLib.timeout_add(
+            self.interval_ms,
+            self._timeout_cb,
+        )
+
+    def cancel(self):
+        """Forgets any pending call."""
+        if self._timeout_id is not None:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+
+    @watched
+    def _timeout_cb(self):
+        self._ticks += 1
+        if self._poked and self._ticks < self.max_ticks:
+            self._poked = False
+            return True
+        self._timeout_id = None
+        self._func()
+        return False
+
+
+class Changes (object):
+    """One batch of changes to the files in a folder, by path.
+
+    Apply them in this order: deleted, renamed ({old: new}), created.
+    The paths in created and changed are the files' paths afterwards.
+    Files in changed were written to where they are.
+
+    """
+
+    def __init__(self, folder):
+        super(Changes, self).__init__()
+        self.folder = folder
+        self.created = set()
+        self.deleted = set()
+        self.changed = set()
+        self.renamed = {}  # {old path: new path}
+        self._renamed_from = {}  # {new path: old path}
+        self._origins = {}  # {any name given in a rename: old path}
+        self.events = 0  # how many events the batch was made from
+
+    def __bool__(self):
+        return bool(self.created or self.deleted or self.changed
+                    or self.renamed)
+
+    def __repr__(self):
+        return "<Changes %r: +%d -%d ~%d >%d, from %d events>" % (
+            self.folder, len(self.created), len(self.deleted),
+            len(self.changed), len(self.renamed), self.events,
+        )
+
+    def removed_paths(self):
+        """Paths that no longer name what they did before the batch."""
+        return self.deleted | set(self.renamed)
+
+    def added_paths(self):
+        """Paths that name something new after the batch."""
+        return self.created | set(self.renamed.values())
+
+    def new_path(self, path):
+        """Where a file is now, if it was renamed, or None.
+
+        The path may be the file's name before the batch, or any name it
+        was given along the way.
+
+        """
+        return self.renamed.get(self._origins.get(path, path))
+
+    def add_created(self, path):
+        self.events += 1
+        if path in self.deleted:
+            self.deleted.discard(path)
+            self.changed.add(path)
+        else:
+            self.created.add(path)
+
+    def add_deleted(self, path):
+        self.events += 1
+        if path in self.created:
+            self.created.discard(path)
+            return
+        self.changed.discard(path)
+        old = self._renamed_from.pop(path, None)
+        if old is not None:
+            del self.renamed[old]
+            path = old
+        self.deleted.add(path)
+
+    def add_changed(self, path):
+        self.events += 1
+        if path not in self.created:
+            self.changed.add(path)
+
+    def add_renamed(self, path, new_path):
+        self.events += 1
+        if path in self.created:
+            self.created.discard(path)
+            self.created.add(new_path)
+            return
+        if path in self.changed:
+            self.changed.discard(path)
+            self.changed.add(new_path)
+        old = self._renamed_from.pop(path, path)
+        self.renamed.pop(old, None)
+        if old != new_path:
+            self.renamed[old] = new_path
+            self._renamed_from[new_path] = old
+            self._origins[new_path] = old
+
+
+class FolderMonitor (object):
+    """Batches of changes to one folder, from a Gio.FileMonitor.
+
+    The Service makes these, see Service.watch_folder().
+
+    """
+
+    def __init__(self, folder):
+        super(FolderMonitor, self).__init__()
+        self.folder = folder
+        self._callbacks = []
+        self._changes = Changes(folder)
+        self._coalescer = Coalescer(self._flush)
+        self._monitor = None
+        self._handler_id = None
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def start(self):
+        """Starts monitoring. Folders that can't be monitored are logged.
+        """
+        from gi.repository import Gio
+        gfile = Gio.File.new_for_path(self.folder)
+        try:
+            monitor = gfile.monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES,
+                None,
+            )
+        except GLib.Error as e:
+            logger.warning("Can't monitor %r: %s", self.folder, e)
+            return
+        self._handler_id = monitor.connect("changed", self._changed_cb)
+        self._monitor = monitor
+        logger.debug("Monitoring %r", self.folder)
+
+    def stop(self):
+        """Stops monitoring, dropping any changes not yet passed on."""
+        self._coalescer.cancel()
+        if self._monitor is not None:
+            self._monitor.disconnect(self._handler_id)
+            self._monitor.cancel()
+            self._monitor = None
+            self._handler_id = None
+        self._changes = Changes(self.folder)
+
+    def add_callback(self, func):
+        """Calls func(changes) with every batch, after those before it."""
+        self._callbacks.append(func)
+
+    def remove_callback(self, func):
+        """Stops calling func. Returns how many callbacks are left."""
+        self._callbacks.remove(func)
+        return len(self._callbacks)
+
+    def poke(self):
+        """Makes sure a batch is passed on soon, even an empty one."""
+        self._coalescer.poke()
+
+    @watched
+    def _changed_cb(self, monitor, gfile, other, event):
+        from gi.repository import Gio
+        path = gfile.get_path()
+        other_path = (other is not None) and other.get_path() or None
+        E = Gio.FileMonitorEvent
+        if path is None:
+            return
+        elif event == E.CREATED:
+            self._changes.add_created(path)
+        elif event == E.DELETED:
+            self._changes.add_deleted(path)
+        elif event in (E.CHANGES_DONE_HINT, E.ATTRIBUTE_CHANGED):
+            self._changes.add_changed(path)
+        elif event == E.RENAMED and other_path:
+            self._changes.add_renamed(path, other_path)
+        elif event == E.MOVED_IN:
+            self._changes.add_created(path)
+        elif event == E.MOVED_OUT:
+            self._changes.add_deleted(path)
+        else:
+            return
+        self._coalescer.poke()
+
+    def _flush(self):
+        changes = self._changes
+        self._changes = Changes(self.folder)
+        logger.debug("%r", changes)
+        for func in list(self._callbacks):
+            func(changes)
+
+
+class FolderWatch (object):
+    """Batched changes to the folder that a window is showing.
+
+    This follows the window's current image to its folder, and passes
+    each batch of changes there on to the plugins' callbacks.
+
+    It also keeps the window on the right image. When the current image
+    is renamed, EOG loses it, and shows another. Once the batch with
+    the rename arrives, the image is found under its new name and shown
+    again. If it was deleted instead, the nearest surviving neighbour
+    is shown. A plugin that renames the current image itself can ask
+    for the place in the sequence to be kept instead, see hold_place().
+
+    """
+
+    _watches = {}  # {Eog.Window: FolderWatch}
+
+    def __init__(self, window):
+        super(FolderWatch, self).__init__()
+        self._window = window
+        self._refcount = 0
+        self._callbacks = {}  # {handle: func}
+        self._handles = itertools.count(1)
+        self._service = None
+        self._view = None
+        self._handler_id = None
+        self._folder = None
+        self._current = None  # the image being shown, as far as we know
+        self._neighbours = []  # images near it, nearest first
+        self._lost = None  # (path, neighbours) of an image EOG lost
+        self._standin = None  # what EOG showed instead, until idle
+        self._standin_idle_id = None
+        self._held = None  # image whose place is being held
+        self._anchor = None  # the image before it, or None
+
+    @classmethod
+    def for_window(cls, window):
+        """Returns the watch for a window, creating it if needed."""
+        watch = cls._watches.get(window)
+        if watch is None:
+            watch = cls(window)
+            cls._watches[window] = watch
+        return watch
+
+    # Public interface:
+
+    def attach(self):
+        """Takes a reference. The first starts watching."""
+        self._refcount += 1
+        if self._refcount > 1:
+            return
+        from eogtricks.service import Service
+        self._service = Service.for_app(self._window.get_application())
+        self._service.attach()
+        self._view = self._window.get_view()
+        self._handler_id = self._view.connect(
+            "notify::image",
+            self._notify_image_cb,
+        )
+        self._track(self._window.get_image())
+
+    def detach(self):
+        """Drops a reference. The last stops watching."""
+        self._refcount -= 1
+        if self._refcount > 0:
+            return
+        self._view.disconnect(self._handler_id)
+        if self._standin_idle_id is not None:
+            GLib.source_remove(self._standin_idle_id)
+            self._standin_idle_id = None
+        self._view = None
+        self._handler_id = None
+        self._set_folder(None)
+        self._service.detach()
+        self._service = None
+        self._current = None
+        self._neighbours = []
+        self._lost = None
+        self._standin = None
+        self._held = None
+        self._anchor = None
+        self._callbacks.clear()
+        self._watches.pop(self._window, None)
+
+    def connect(self, func):
+        """Calls func(changes) for each batch. Returns a handle."""
+        handle = next(self._handles)
+        self._callbacks[handle] = func
+        return handle
+
+    def disconnect(self, handle):
+        """Stops calling a connected function."""
+        self._callbacks.pop(handle, None)
+
+    def hold_place(self, img):
+        """Keeps the window at an image's place in the sequence.
+
+        Call this before renaming the current image. When the changes
+        arrive, the window shows whatever is now at that place: the
+        image itself, if it sorts to the same place under its new name,
+        or the image after it. Moving to another image meanwhile
+        cancels this.
+
+        """
+        store = self._window.get_store()
+        pos = store.get_pos_by_image(img)
+        if pos < 0:
+            return
+        self._held = img
+        self._anchor = (pos > 0) and store.get_image_by_pos(pos - 1) or None
+        monitor = self._monitor()
+        if monitor is not None:
+            monitor.poke()
+        else:
+            GLib.idle_add(self._folder_changed_cb, Changes(self._folder))
+
+    # Internals:
+
+    def _monitor(self):
+        if self._folder is None:
+            return None
+        return self._service.folder_monitor(self._folder)
+
+    def _set_folder(self, folder):
+        if folder == self._folder:
+            return
+        if self._folder is not None:
+            self._service.unwatch_folder(self._folder,
+                                         self._folder_changed_cb)
+        self._folder = folder
+        if folder is not None:
+            self._service.watch_folder(folder, self._folder_changed_cb)
+
+    def _track(self, img):
+        """Remembers the current image, and the images around it."""
+        self._current = img
+        self._neighbours = []
+        if img is None:
+            return
+        path = img.get_file().get_path()
+        if path is None:
+            return
+        self._set_folder(os.path.dirname(path))
+        store = self._window.get_store()
+        pos = store.get_pos_by_image(img)
+        if pos < 0:
+            return
+        for i in range(1, NEIGHBOURS + 1):
+            for other_pos in (pos + i, pos - i):
+                other = store.get_image_by_pos(other_pos)
+                if other is not None:
+                    self._neighbours.append(other)
+
+    @watched
+    def _notify_image_cb(self, view, pspec):
+        img = self._window.get_image()
+        old = self._current
+        if img is old:
+            return
+        if old is not None:
+            store = self._window.get_store()
+            if store.get_pos_by_image(old) < 0:
+                # EOG moved off an image that vanished from under it.
+                # Which image to show is decided when the batch arrives.
+                # If its stand-in vanished too in the same flood, before
+                # it could even be seen, the first one still counts.
+                if self._lost is None or old is not self._standin:
+                    self._lost = (old.get_file().get_path(),
+                                  self._neighbours)
+                self._standin = img
+                if self._standin_idle_id is None:
+                    self._standin_idle_id = GLib.idle_add(
+                        self._standin_shown_cb,
+                    )
+                if old is not self._held:
+                    self._held = None
+                    self._anchor = None
+                monitor = self._monitor()
+                if monitor is not None:
+                    monitor.poke()
+            else:
+                # The user moved on.
+                self._lost = None
+                self._standin = None
+                self._held = None
+                self._anchor = None
+        self._track(img)
+
+    @watched
+    def _standin_shown_cb(self):
+        self._standin_idle_id = None
+        self._standin = None
+        return False
+
+    def _restore_place(self, changes):
+        """Shows the right image, after a batch of changes."""
+        store = self._window.get_store()
+        target = None
+        if self._held is not None:
+            if self._anchor is None:
+                target = store.get_image_by_pos(0)
+            else:
+                pos = store.get_pos_by_image(self._anchor)
+                if pos >= 0:
+                    target = store.get_image_by_pos(pos + 1)
+        if target is None and self._lost is not None:
+            (path, neighbours) = self._lost
+            new_path = changes.new_path(path)
+            if new_path is not None:
+                for i in range(store.length()):
+                    img = store.get_image_by_pos(i)
+                    if img.get_file().get_path() == new_path:
+                        target = img
+                        break
+            for img in neighbours:
+                if target is not None:
+                    break
+                if store.get_pos_by_image(img) >= 0:
+                    target = img
+        self._lost = None
+        self._standin = None
+        self._held = None
+        self._anchor = None
+        if target is None or target is self._window.get_image():
+            return
+        logger.debug("Showing %r after changes",
+                     target.get_file().get_path())
+        self._window.get_thumb_view().set_current_image(target, True)
+
+    @watched
+    def _folder_changed_cb(self, changes):
+        self._restore_place(changes)
+        for func in list(self._callbacks.values()):
+            func(changes)
+        return False
@@ -0,0 +1,115 @@
+# Frame timing for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Frame timings of the plugins' animations.
+
+Anything animated from a widget's frame clock records each frame in a
+FrameTimeLog, which knows the display's refresh interval and so can
+count the frames that were dropped. If EOGTRICKS_FRAME_LOG names a
+file, the logs are appended to it as tab-separated lines of frame time,
+interval and refresh interval, all in microseconds, for later study
+with bench/page_scroll.py.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+from eogtricks import get_logger
+
+
+logger = get_logger(__name__)
+
+# Per-frame timings are written to this file, if set.
+LOG_FILE = os.environ.get("EOGTRICKS_FRAME_LOG")
+
+
+class FrameTimeLog (object):
+    """Records frame clock timings, and counts the dropped frames."""
+
+    DEFAULT_REFRESH_INTERVAL = 16667  # µs; 60Hz
+
+    def __init__(self):
+        super(FrameTimeLog, self).__init__()
+        self.intervals = []  # [(frame_time, interval, refresh_interval)]
+        self.stalls = 0
+        self._last_frame_time = None
+
+    @classmethod
+    def read(cls, filename):
+        """Loads a log written by write()."""
+        log = cls()
+        with open(filename) as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) == 3:
+                    log.intervals.append(tuple(int(f) for f in fields))
+        return log
+
+    def reset_sequence(self):
+        """Forget the previous frame: the next one starts a new run."""
+        self._last_frame_time = None
+
+    def record(self, frame_clock):
+        frame_time = frame_clock.get_frame_time()
+        last = self._last_frame_time
+        self._last_frame_time = frame_time
+        if last is None:
+            return
+        refresh_interval = self.DEFAULT_REFRESH_INTERVAL
+        try:
+            refresh_interval, presentation = \
+                frame_clock.get_refresh_info(frame_time)
+        except Exception:
+            pass
+        if not refresh_interval:
+            refresh_interval = self.DEFAULT_REFRESH_INTERVAL
+        self.intervals.append((frame_time, frame_time - last,
+                               refresh_interval))
+
+    @property
+    def dropped(self):
+        """Number of frames that took over 1.5× the refresh interval."""
+        return sum(1 for (t, dt, r) in self.intervals if dt > 1.5 * r)
+
+    def summary(self):
+        n = len(self.intervals)
+        if not n:
+            return "no frames recorded, %d decode stall(s)" % (self.stalls,)
+        dts = [dt for (t, dt, r) in self.intervals]
+        return (
+            "%d frames, mean %0.2fms, max %0.2fms, %d dropped, "
+            "%d decode stall(s)"
+        ) % (n, sum(dts) / n / 1000, max(dts) / 1000, self.dropped,
+             self.stalls)
+
+    def write(self, filename):
+        with open(filename, "a") as fp:
+            for (t, dt, r) in self.intervals:
+                fp.write("%d\t%d\t%d\n" % (t, dt, r))
+
+    def save(self):
+        """Appends the timings to EOGTRICKS_FRAME_LOG, if it's set."""
+        if not (LOG_FILE and self.intervals):
+            return
+        try:
+            self.write(LOG_FILE)
+        except OSError:
+            logger.exception("Can't write to %r", LOG_FILE)
@@ -0,0 +1,67 @@
+# Per-window image groups, shared between the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Groups of related images, published per window.
+
+One plugin works out which images belong together (near-duplicate burst
+shots, for example) and publishes them here. Others can then act on the
+group containing the current image, without knowing how it was found::
+
+    groups.publish(window, [["/a/1.jpg", "/a/2.jpg"], ...])
+    ...
+    paths = groups.get_group(window, "/a/1.jpg")
+
+The registry holds windows weakly, and publishers should withdraw()
+their groups when deactivated.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import weakref
+
+
+_groups = weakref.WeakKeyDictionary()  # {window: {path: (path, ...)}}
+
+
+def publish(window, groups):
+    """Replaces a window's groups. Each group is a sequence of paths."""
+    index = {}
+    for group in groups:
+        group = tuple(group)
+        for path in group:
+            index[path] = group
+    _groups[window] = index
+
+
+def withdraw(window):
+    """Forgets a window's groups."""
+    _groups.pop(window, None)
+
+
+def get_group(window, path):
+    """Returns the tuple of paths grouped with path, or None.
+
+    The path itself is included in the tuple.
+
+    """
+    index = _groups.get(window)
+    if not index:
+        return None
+    return index.get(path)
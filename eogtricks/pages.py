@@ -0,0 +1,298 @@
+# Page sources: sequences of images that aren't separate files.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Sequences of pages held inside a single file.
+
+EOG only knows about one image per file. A PageSource presents the
+pages of a comic book archive or a multi-page TIFF as an indexed
+sequence, and decodes them on demand by streaming their encoded bytes
+into a GdkPixbuf.PixbufLoader, so no page is ever written out to disk.
+
+PageCache decodes the pages the reader is likely to want next in the
+background, on the application's Service, and shares decoded pages with
+any other windows reading the same file.
+
+Use open_source() to get the right kind of PageSource for a file.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import re
+import threading
+
+from eogtricks import get_logger
+from eogtricks.service import file_id
+from eogtricks.watchdog import watched
+
+
+logger = get_logger(__name__)
+
+CHUNK_SIZE = 64 * 1024  # bytes fed to the pixbuf loader at a time
+
+PREFETCH_AHEAD = 2
+PREFETCH_BEHIND = 1
+
+# Decoded pages kept for all windows, in megabytes.
+PAGE_CACHE_BYTES = int(float(os.environ.get("EOGTRICKS_PAGE_CACHE_MB", 256))
+                       * 1024 * 1024)
+
+IMAGE_EXTENSIONS = {
+    ".jpg", ".jpeg", ".jpe", ".png", ".gif", ".webp", ".bmp",
+    ".tif", ".tiff", ".avif", ".jxl",
+}
+
+
+def natural_key(name):
+    """Sort key putting "page2" before "page10"."""
+    return [
+        (0, int(part), part) if part.isdigit() else (1, 0, part.casefold())
+        for part in re.split(r"(\d+)", name)
+        if part
+    ]
+
+
+class PageSource (object):
+    """Abstract sequence of pages.
+
+    Subclasses implement __len__(), page_name(), and iter_chunks(),
+    which yields a page's encoded bytes as a series of bytes-like
+    objects. They must be safe to call from several threads at once.
+    Sources whose pages aren't just the file's can override decode()
+    and page_key() instead. Sources holding files open release them
+    in _close().
+
+    A decode may be shared with other windows, and so outlive the
+    reader that started it. Anything running decode() holds the source
+    open with hold() and unhold(), and close() waits for the last one.
+
+    """
+
+    def __init__(self, path):
+        super(PageSource, self).__init__()
+        self.path = path
+        self._file_id = None
+        self._hold_lock = threading.Lock()
+        self._holds = 0
+        self._closing = False
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def page_name(self, index):
+        raise NotImplementedError
+
+    def iter_chunks(self, index):
+        raise NotImplementedError
+
+    def page_key(self, index):
+        """Identifies a decoded page, for sharing it between windows.
+
+        Only call this from the main thread.
+
+        """
+        if self._file_id is None:
+            self._file_id = file_id(self.path)
+        return ("page", self._file_id, index)
+
+    def hold(self):
+        """Keeps the source open until unhold(), even if it's closed."""
+        with self._hold_lock:
+            self._holds += 1
+
+    def unhold(self):
+        """Drops a hold. A closed source is closed on the last one."""
+        with self._hold_lock:
+            self._holds -= 1
+            close_now = self._closing and self._holds == 0
+        if close_now:
+            self._close()
+
+    def close(self):
+        """Closes the source now, or when the last hold is dropped."""
+        with self._hold_lock:
+            self._closing = True
+            if self._holds > 0:
+                return
+        self._close()
+
+    def _close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def decode(self, index):
+        """Decodes a page to a GdkPixbuf, orientation applied.
+
+        This streams the page through a PixbufLoader, so only one chunk
+        of the encoded data need be in memory at a time. It's safe to
+        call from worker threads.
+
+        """
+        from gi.repository import GdkPixbuf
+        loader = GdkPixbuf.PixbufLoader()
+        chunks = self.iter_chunks(index)
+        try:
+            for chunk in chunks:
+                # PyGObject only passes bytes objects through directly.
+                if not isinstance(chunk, bytes):
+                    chunk = bytes(chunk)
+                loader.write(chunk)
+        except Exception:
+            try:
+                loader.close()
+            except Exception:
+                pass
+            raise
+        finally:
+            chunks.close()
+        loader.close()
+        pixbuf = loader.get_pixbuf()
+        if pixbuf is None:
+            raise ValueError("%s: no image in page %d"
+                             % (self.path, index))
+        return pixbuf.apply_embedded_orientation() or pixbuf
+
+
+def open_source(path):
+    """Returns a PageSource for a file, or None if it isn't supported."""
+    with open(path, "rb") as fp:
+        magic = fp.read(4)
+    if magic in (b"PK\x03\x04", b"PK\x05\x06"):
+        from eogtricks.archive import ZipPageSource
+        return ZipPageSource(path)
+    elif magic in (b"II*\x00", b"MM\x00*"):
+        from eogtricks.tiff import TiffPageSource
+        return TiffPageSource(path)
+    return None
+
+
+class PageCache (object):
+    """Decoded pages near the reader's position, decoded in advance.
+
+    Decoding is done by the application's Service. Decoded pages go in
+    its "pages" cache, keyed by the source's page_key(), normally the
+    file's identity and the page index, so windows reading the same
+    file share pages and decoding work.
+    When a page that was asked for is ready, the ready_cb is called on
+    the main thread with its index and pixbuf.
+
+    The shared cache has a fixed budget in bytes, so memory use stays
+    bounded however long the sources are, and however many windows
+    have them open.
+
+    """
+
+    def __init__(self, source, ready_cb, service, ahead=PREFETCH_AHEAD,
+                 behind=PREFETCH_BEHIND):
+        super(PageCache, self).__init__()
+        self.source = source
+        self._ready_cb = ready_cb
+        self._service = service
+        self._pages = service.cache("pages", PAGE_CACHE_BYTES)
+        self._ahead = ahead
+        self._behind = behind
+        self._futures = {}  # {index: Future}
+        self._closed = False
+
+    def get(self, index):
+        """Returns a page if it's decoded. Otherwise it's queued.
+
+        The neighbouring pages are queued for decoding too.
+
+        """
+        pixbuf = self._pages.get(self._key(index))
+        self._prefetch(index)
+        return pixbuf
+
+    def close(self):
+        """Gives up on pending decodes.
+
+        Running decodes, and queued ones other windows still want, keep
+        the source open until they finish.
+
+        """
+        self._closed = True
+        pending = list(self._futures.values())
+        self._futures.clear()
+        for future in pending:
+            self._service.release(future)
+
+    def _key(self, index):
+        return self.source.page_key(index)
+
+    def _prefetch(self, index):
+        n = len(self.source)
+        wanted = [index]
+        for offset in range(1, max(self._ahead, self._behind) + 1):
+            if offset <= self._ahead:
+                wanted.append(index + offset)
+            if offset <= self._behind:
+                wanted.append(index - offset)
+        wanted = [i for i in wanted if 0 <= i < n]
+
+        # Give up on decodes outside the window.
+        for i in list(self._futures):
+            if i not in wanted:
+                self._service.release(self._futures.pop(i))
+
+        for i in wanted:
+            if i in self._futures or self._key(i) in self._pages:
+                continue
+            source = self.source
+            source.hold()
+            future = self._service.submit(self._key(i), source.decode, i)
+            future.add_done_callback(lambda f: source.unhold())
+            future.add_done_callback(
+                lambda f, i=i: self._decode_done(i, f),
+            )
+            self._futures[i] = future
+
+    def _decode_done(self, index, future):
+        # Called from a worker thread.
+        from gi.repository import GLib
+        GLib.idle_add(self._decoded_idle_cb, index, future)
+
+    @watched
+    def _decoded_idle_cb(self, index, future):
+        if self._closed or self._futures.get(index) is not future:
+            return False
+        del self._futures[index]
+        if future.cancelled():
+            return False
+        try:
+            pixbuf = future.result()
+        except OSError as e:
+            # Files can be moved or deleted while they're being read.
+            logger.warning("Can't read page %d of %r: %s",
+                           index, self.source.path, e)
+            return False
+        except Exception:
+            logger.exception("Failed to decode page %d of %r",
+                             index, self.source.path)
+            return False
+        nbytes = pixbuf.get_rowstride() * pixbuf.get_height()
+        self._pages.put(self._key(index), pixbuf, nbytes)
+        self._ready_cb(index, pixbuf)
+        return False
@@ -0,0 +1,281 @@
+# Scrollable view of the pages in a PageSource.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""A widget showing one page at a time from a PageSource.
+
+EOG's own view can only show images that EOG loaded from files, so the
+pager overlays one of these on top of it to show the pages of an
+archive. It has real scrollbars, so the pager can page through it the
+same way it pages through EOG's view.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+from enum import Enum
+
+from gi.repository import GObject
+from gi.repository import Gtk
+from gi.repository import Gdk
+from gi.repository import GdkPixbuf
+from gi.repository import GLib
+
+from eogtricks import get_logger
+from eogtricks.pages import PageCache
+from eogtricks.watchdog import watched
+
+
+logger = get_logger(__name__)
+
+BACKGROUND_RGB = (0.1, 0.1, 0.1)
+
+
+class Fit (Enum):
+    PAGE = 0
+    WIDTH = 1
+    HEIGHT = 2
+    MIN = 3
+
+
+class PageView (Gtk.ScrolledWindow):
+    """Shows a page of a PageSource, scaled to fit.
+
+    Pages are decoded in the background by a PageCache, using the
+    application's Service. Until a page is ready, the previous one stays
+    on screen.
+
+    """
+
+    __gsignals__ = {
+        "page-changed": (GObject.SignalFlags.RUN_FIRST, None, (int,)),
+    }
+
+    def __init__(self, service):
+        super(PageView, self).__init__()
+        self._service = service
+        self._area = Gtk.DrawingArea()
+        self._area.connect("draw", self._draw_cb)
+        self._area.connect("size-allocate", self._area_size_allocate_cb)
+        self.add(self._area)
+        self.connect("size-allocate", self._size_allocate_cb)
+        self._cache = None
+        self._index = 0
+        self._pixbuf = None
+        self._surface = None  # (key, cairo.Surface)
+        self._fit = Fit.PAGE
+        self._request = (0, 0)
+        self._allocation = (0, 0)
+        self._pending_scroll = {}  # {Gtk.Orientation: fraction}
+        self._resize_id = None
+
+    # Public interface:
+
+    def set_source(self, source, index=0, scroll=None):
+        """Starts showing a new PageSource, by default from the start.
+
+        The view does not take ownership of the source. The index and
+        scroll params are as for set_index().
+
+        """
+        if self._cache is not None:
+            self._cache.close()
+        self._cache = PageCache(source, self._page_ready_cb, self._service)
+        self._pixbuf = None
+        self._surface = None
+        self.set_index(index, scroll)
+
+    def get_source(self):
+        if self._cache is None:
+            return None
+        return self._cache.source
+
+    def get_index(self):
+        return self._index
+
+    def get_n_pages(self):
+        if self._cache is None:
+            return 0
+        return len(self._cache.source)
+
+    def set_index(self, index, scroll=None):
+        """Moves to a page.
+
+        If scroll is given, it's a dict of {Gtk.Orientation: fraction}
+        saying where to scroll to once the page is shown.
+
+        """
+        n = self.get_n_pages()
+        if n == 0:
+            return
+        self._index = min(n - 1, max(0, index))
+        self._pending_scroll = dict(scroll or {})
+        pixbuf = self._cache.get(self._index)
+        if pixbuf is not None:
+            self._show(pixbuf)
+        self.emit("page-changed", self._index)
+
+    def go(self, delta, scroll=None):
+        """Moves by delta pages. Returns False if that's off the end."""
+        index = self._index + delta
+        if not (0 <= index < self.get_n_pages()):
+            return False
+        self.set_index(index, scroll)
+        return True
+
+    def get_fit(self):
+        return self._fit
+
+    def set_fit(self, fit, scroll=None):
+        """Changes how pages are fitted to the view.
+
+        The scroll parameter is as for set_index().
+
+        """
+        self._fit = fit
+        if scroll is not None:
+            self._pending_scroll = dict(scroll)
+        self._update_size()
+
+    def get_pixbuf(self):
+        """Returns the page being shown, or None."""
+        return self._pixbuf
+
+    def close(self):
+        """Stops decoding, and releases the pages."""
+        if self._resize_id is not None:
+            GLib.source_remove(self._resize_id)
+            self._resize_id = None
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+        self._pixbuf = None
+        self._surface = None
+
+    # Layout:
+
+    def _get_zoom(self):
+        view_w = self.get_allocated_width()
+        view_h = self.get_allocated_height()
+        page_w = self._pixbuf.get_width()
+        page_h = self._pixbuf.get_height()
+        fit = self._fit
+        if fit is Fit.MIN:
+            fit = (page_w < page_h) and Fit.WIDTH or Fit.HEIGHT
+        if fit is Fit.WIDTH:
+            return view_w / page_w
+        elif fit is Fit.HEIGHT:
+            return view_h / page_h
+        return min(view_w / page_w, view_h / page_h)
+
+    def _show(self, pixbuf):
+        self._pixbuf = pixbuf
+        self._surface = None
+        self._update_size()
+        self._area.queue_draw()
+
+    def _update_size(self):
+        """Sizes the drawing area for the page's zoomed size."""
+        if self._pixbuf is None:
+            return
+        zoom = self._get_zoom()
+        request = (
+            max(1, int(round(self._pixbuf.get_width() * zoom))),
+            max(1, int(round(self._pixbuf.get_height() * zoom))),
+        )
+        if request != self._request:
+            self._request = request
+            self._area.set_size_request(*request)
+            # The pending scroll happens when that's allocated.
+        else:
+            self._apply_pending_scroll()
+
+    def _apply_pending_scroll(self):
+        adjustments = {
+            Gtk.Orientation.HORIZONTAL: self.get_hadjustment(),
+            Gtk.Orientation.VERTICAL: self.get_vadjustment(),
+        }
+        for (orientation, frac) in self._pending_scroll.items():
+            adj = adjustments[orientation]
+            lower = adj.get_lower()
+            top = adj.get_upper() - adj.get_page_size()
+            adj.set_value(lower + frac * max(0, top - lower))
+        self._pending_scroll.clear()
+
+    # Signal handlers:
+
+    @watched
+    def _size_allocate_cb(self, widget, allocation):
+        size = (self.get_allocated_width(), self.get_allocated_height())
+        if size == self._allocation:
+            return
+        self._allocation = size
+        # Can't resize the child while being allocated.
+        if self._resize_id is None:
+            self._resize_id = GLib.idle_add(self._resize_idle_cb)
+
+    @watched
+    def _resize_idle_cb(self):
+        self._resize_id = None
+        self._update_size()
+        return False
+
+    @watched
+    def _area_size_allocate_cb(self, area, allocation):
+        # The viewport sets its adjustments before it allocates us.
+        self._apply_pending_scroll()
+
+    @watched
+    def _page_ready_cb(self, index, pixbuf):
+        if index == self._index and pixbuf is not self._pixbuf:
+            self._show(pixbuf)
+
+    @watched
+    def _draw_cb(self, area, cr):
+        cr.set_source_rgb(*BACKGROUND_RGB)
+        cr.paint()
+        surface = self._get_surface()
+        if surface is None:
+            return False
+        (w, h) = self._request
+        x = max(0, (area.get_allocated_width() - w) // 2)
+        y = max(0, (area.get_allocated_height() - h) // 2)
+        cr.set_source_surface(surface, x, y)
+        cr.paint()
+        return False
+
+    def _get_surface(self):
+        """The page at its zoomed size, as a surface. Cached."""
+        if self._pixbuf is None:
+            return None
+        scale = self._area.get_scale_factor()
+        key = (self._request, scale)
+        if self._surface is None or self._surface[0] != key:
+            (w, h) = self._request
+            pixbuf = self._pixbuf
+            if (pixbuf.get_width(), pixbuf.get_height()) != (w * scale,
+                                                             h * scale):
+                pixbuf = pixbuf.scale_simple(
+                    w * scale, h * scale,
+                    GdkPixbuf.InterpType.BILINEAR,
+                )
+            surface = Gdk.cairo_surface_create_from_pixbuf(
+                pixbuf, scale, self._area.get_window(),
+            )
+            self._surface = (key, surface)
+        return self._surface[1]
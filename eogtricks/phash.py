@@ -0,0 +1,510 @@
+# Perceptual hashing and near-duplicate grouping for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Perceptual hashes of image files, and grouping by Hamming distance.
+
+Two 64-bit hashes are supported:
+
+* "dhash": the sign of the horizontal gradient of a 9×8 thumbnail.
+  Cheap, and good at spotting burst shots.
+* "phash": the signs of the low frequency DCT coefficients of a 32×32
+  thumbnail, compared to their median. Sturdier against exposure and
+  small shifts, but needs NumPy.
+
+Decoding happens in GdkPixbuf, at thumbnail size, so hashing is mostly
+I/O and JPEG decode. hash_paths() spreads that over a pool of worker
+processes, and HashCache keeps the results in an SQLite database keyed
+by path, mtime, size and algorithm, so revisiting a folder is cheap.
+
+group_hashes() finds connected groups of hashes within a Hamming
+distance of each other, using multi-index hashing for the neighbour
+searches and a union-find for the grouping.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import math
+import sqlite3
+import itertools
+import threading
+
+from eogtricks import get_logger
+from eogtricks import lazy_import
+from eogtricks import worker_context
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+logger = get_logger(__name__)
+
+futures = lazy_import("concurrent.futures")
+
+ALGORITHMS = ("dhash", "phash")
+HASH_BITS = 64
+CHUNK_SIZE = 16  # files per job sent to a worker process
+
+_DHASH_SIZE = (9, 8)
+_PHASH_SIZE = (32, 32)
+_PHASH_LOW = 8
+
+
+# Hashing (these run in the worker processes):
+
+def _load_gray(path, width, height):
+    """Decode a file at a tiny size, returning rows of luma values.
+
+    The result is a NumPy float array if NumPy is available, otherwise
+    a list of lists.
+
+    """
+    from gi.repository import GdkPixbuf
+    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+        path, width, height, False,
+    )
+    pixbuf = pixbuf.apply_embedded_orientation() or pixbuf
+    w = pixbuf.get_width()
+    h = pixbuf.get_height()
+    if (w, h) != (width, height):
+        pixbuf = pixbuf.scale_simple(width, height,
+                                     GdkPixbuf.InterpType.BILINEAR)
+    n = pixbuf.get_n_channels()
+    stride = pixbuf.get_rowstride()
+    pixels = pixbuf.get_pixels()
+    if numpy is not None:
+        buf = numpy.frombuffer(pixels, dtype=numpy.uint8)
+        rows = numpy.lib.stride_tricks.as_strided(
+            buf, shape=(height, width, 3), strides=(stride, n, 1),
+        )
+        return rows.astype(numpy.float32) @ numpy.array(
+            [0.299, 0.587, 0.114], dtype=numpy.float32,
+        )
+    gray = []
+    for y in range(height):
+        row = []
+        for x in range(width):
+            i = y * stride + x * n
+            r, g, b = pixels[i], pixels[i + 1], pixels[i + 2]
+            row.append(0.299 * r + 0.587 * g + 0.114 * b)
+        gray.append(row)
+    return gray
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bool(bit))
+    return value
+
+
+def dhash_gray(gray):
+    """Difference hash of a 9-wide, 8-high luma array."""
+    if numpy is not None:
+        bits = numpy.asarray(gray)
+        bits = (bits[:, 1:] > bits[:, :-1]).ravel()
+        return int.from_bytes(numpy.packbits(bits).tobytes(), "big")
+    return _bits_to_int(
+        row[x + 1] > row[x]
+        for row in gray
+        for x in range(len(row) - 1)
+    )
+
+
+_dct_matrices = {}
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix, so that D @ x is the DCT of x."""
+    matrix = _dct_matrices.get(n)
+    if matrix is None:
+        k = numpy.arange(n).reshape(-1, 1)
+        i = numpy.arange(n).reshape(1, -1)
+        matrix = numpy.cos(math.pi * (2 * i + 1) * k / (2 * n))
+        matrix[0] *= math.sqrt(1 / n)
+        matrix[1:] *= math.sqrt(2 / n)
+        _dct_matrices[n] = matrix
+    return matrix
+
+
+def phash_gray(gray):
+    """DCT hash of a square luma array. Needs NumPy."""
+    gray = numpy.asarray(gray, dtype=numpy.float64)
+    d = _dct_matrix(gray.shape[0])
+    coeffs = (d @ gray @ d.T)[:_PHASH_LOW, :_PHASH_LOW].ravel()
+    median = numpy.median(coeffs[1:])  # ignoring the DC term
+    return int.from_bytes(numpy.packbits(coeffs > median).tobytes(), "big")
+
+
+def hash_file(path, algorithm):
+    """Returns the perceptual hash of an image file, or None."""
+    try:
+        if algorithm == "phash":
+            return phash_gray(_load_gray(path, *_PHASH_SIZE))
+        return dhash_gray(_load_gray(path, *_DHASH_SIZE))
+    except Exception as e:
+        logger.debug("Can't hash %r: %s", path, e)
+        return None
+
+
+def hash_files(paths, algorithm):
+    """Hashes a chunk of files: [(path, hash or None)]."""
+    return [(path, hash_file(path, algorithm)) for path in paths]
+
+
+def available_algorithm(algorithm):
+    """Returns the algorithm to use, falling back if NumPy is missing."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown hash algorithm %r" % (algorithm,))
+    if algorithm == "phash" and numpy is None:
+        logger.warning("pHash needs NumPy: using dHash instead")
+        return "dhash"
+    return algorithm
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+
+if hasattr(int, "bit_count"):
+    def hamming(a, b):
+        return (a ^ b).bit_count()
+
+
+# Persistent cache:
+
+def default_cache_file():
+    from gi.repository import GLib
+    return os.path.join(GLib.get_user_cache_dir(), "eogtricks",
+                        "phash.sqlite")
+
+
+class HashCache (object):
+    """Hashes stored by (path, algorithm), valid for one mtime and size.
+
+    Connections are per thread, so a cache object may be shared, but
+    each thread pays for opening the database once.
+
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS hashes (
+            path TEXT NOT NULL,
+            algorithm TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            hash INTEGER NOT NULL,
+            PRIMARY KEY (path, algorithm)
+        )
+    """
+
+    def __init__(self, filename=None):
+        super(HashCache, self).__init__()
+        if filename is None:
+            filename = default_cache_file()
+        self.filename = filename
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            dirname = os.path.dirname(self.filename)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            conn = sqlite3.connect(self.filename, timeout=10)
+            conn.execute(self._SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # SQLite integers are signed 64-bit.
+
+    @staticmethod
+    def _to_db(h):
+        return h - (1 << 63)
+
+    @staticmethod
+    def _from_db(v):
+        return v + (1 << 63)
+
+    def get_many(self, stats, algorithm):
+        """Returns {path: hash} for the still-valid cached entries.
+
+        The stats argument maps paths to (mtime_ns, size).
+
+        """
+        conn = self._connection()
+        found = {}
+        paths = list(stats)
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            query = (
+                "SELECT path, mtime_ns, size, hash FROM hashes "
+                "WHERE algorithm = ? AND path IN (%s)"
+                % (",".join("?" * len(chunk)),)
+            )
+            for (path, mtime_ns, size, h) in conn.execute(
+                    query, [algorithm] + chunk):
+                if stats.get(path) == (mtime_ns, size):
+                    found[path] = self._from_db(h)
+        return found
+
+    def put_many(self, entries, algorithm):
+        """Stores [(path, (mtime_ns, size), hash)]."""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO hashes "
+                "(path, algorithm, mtime_ns, size, hash) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(path, algorithm, st[0], st[1], self._to_db(h))
+                 for (path, st, h) in entries],
+            )
+
+    def rename_many(self, renames):
+        """Moves the entries for renamed files, given [(old, new)] paths.
+
+        Renaming a file leaves its mtime and size alone, so its hashes
+        are still valid under the new name.
+
+        """
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "UPDATE OR REPLACE hashes SET path = ? WHERE path = ?",
+                [(new, old) for (old, new) in renames],
+            )
+
+
+# Computing hashes in bulk:
+
+def stat_paths(paths):
+    """Returns {path: (mtime_ns, size)} for the paths that exist."""
+    stats = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+
+def hash_paths(paths, algorithm, cache=None, workers=None, cancelled=None,
+               service=None):
+    """Returns {path: hash} for the image files it can hash.
+
+    Cached hashes are used where they're still valid. The rest are
+    computed in a pool of worker processes (or in this thread if
+    workers is 0), and stored in the cache. Pass an application's
+    eogtricks.service.Service as service to run the chunks as its
+    process jobs instead: chunks that another window is already
+    hashing are then shared, not hashed twice.
+
+    Pass a threading.Event as cancelled to be able to stop early, in
+    which case None is returned.
+
+    """
+    stats = stat_paths(paths)
+    hashes = cache.get_many(stats, algorithm) if cache else {}
+    todo = [p for p in stats if p not in hashes]
+    logger.debug("%d cached hash(es), %d to compute", len(hashes), len(todo))
+    if not todo:
+        return hashes
+
+    chunks = [todo[i:i + CHUNK_SIZE] for i in range(0, len(todo), CHUNK_SIZE)]
+    pool = None
+    own_pool = False
+    jobs = []
+    if service is None and workers != 0:
+        if workers is None:
+            workers = max(1, min(len(chunks), os.cpu_count() or 1))
+        pool = futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=worker_context(),
+        )
+        own_pool = True
+    if service is not None:
+        for chunk in chunks:
+            if cancelled is not None and cancelled.is_set():
+                for job in jobs:
+                    service.release(job)
+                return None
+            jobs.append(service.submit(
+                ("phash", algorithm, tuple((p, stats[p]) for p in chunk)),
+                hash_files, chunk, algorithm,
+                process=True,
+            ))
+        results = (job.result() for job in jobs)
+    elif pool is not None:
+        jobs = [pool.submit(hash_files, chunk, algorithm) for chunk in chunks]
+        results = (job.result() for job in jobs)
+    else:
+        results = (hash_files(chunk, algorithm) for chunk in chunks)
+
+    try:
+        for result in results:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            computed = [(p, stats[p], h) for (p, h) in result if h is not None]
+            hashes.update((p, h) for (p, st, h) in computed)
+            if cache and computed:
+                cache.put_many(computed, algorithm)
+    except futures.CancelledError:
+        return None  # the service was stopped
+    finally:
+        for job in jobs:
+            if service is not None:
+                service.release(job)
+            else:
+                job.cancel()
+        if own_pool:
+            pool.shutdown(wait=True)
+    return hashes
+
+
+# Grouping:
+
+class MultiIndex (object):
+    """Multi-index hashing, for Hamming radius searches over hashes.
+
+    Each hash is split into BLOCKS equal substrings, with a lookup table
+    for each. By the pigeonhole principle, two hashes within distance d
+    of each other have at least one block within d // BLOCKS, so only
+    the buckets near the query's own blocks need checking. For the
+    distances that make sense here this is far quicker than a BK-tree,
+    which ends up visiting most of its nodes.
+
+    """
+
+    BLOCKS = 4
+
+    def __init__(self, bits=HASH_BITS):
+        super(MultiIndex, self).__init__()
+        self._block_bits = bits // self.BLOCKS
+        self._mask = (1 << self._block_bits) - 1
+        self._tables = [{} for i in range(self.BLOCKS)]
+        self._flip_masks = {}  # {radius: [mask]}
+
+    def _blocks(self, h):
+        n = self._block_bits
+        return [(h >> (i * n)) & self._mask for i in range(self.BLOCKS)]
+
+    def _masks(self, radius):
+        """All the ways to flip up to radius bits of a block."""
+        masks = self._flip_masks.get(radius)
+        if masks is None:
+            masks = [0]
+            for k in range(1, radius + 1):
+                for bits in itertools.combinations(range(self._block_bits),
+                                                   k):
+                    mask = 0
+                    for b in bits:
+                        mask |= 1 << b
+                    masks.append(mask)
+            self._flip_masks[radius] = masks
+        return masks
+
+    def add(self, h, item):
+        for (table, key) in zip(self._tables, self._blocks(h)):
+            table.setdefault(key, []).append((h, item))
+
+    def search(self, h, radius):
+        """Returns every item within radius of h."""
+        found = set()
+        masks = self._masks(radius // self.BLOCKS)
+        for (table, key) in zip(self._tables, self._blocks(h)):
+            for mask in masks:
+                for (other, item) in table.get(key ^ mask, ()):
+                    if hamming(h, other) <= radius:
+                        found.add(item)
+        return list(found)
+
+
+class UnionFind (object):
+    """Disjoint sets, with path halving and union by size."""
+
+    def __init__(self):
+        super(UnionFind, self).__init__()
+        self._parent = {}
+        self._size = {}
+
+    def find(self, x):
+        parent = self._parent
+        if x not in parent:
+            parent[x] = x
+            self._size[x] = 1
+            return x
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size[b]
+
+
+def group_hashes(hashes, distance):
+    """Groups keys whose hashes are within distance of each other.
+
+    Grouping is transitive: A and C end up together if both are near B.
+    Keys must be sortable.
+    Returns a list of sorted lists of keys, with only the groups that
+    have more than one member, ordered by their first key.
+
+    """
+    index = MultiIndex()
+    by_hash = {}
+    for (key, h) in hashes.items():
+        if h in by_hash:
+            by_hash[h].append(key)
+        else:
+            by_hash[h] = [key]
+            index.add(h, h)
+
+    sets = UnionFind()
+    for (h, keys) in by_hash.items():
+        for key in keys[1:]:
+            sets.union(keys[0], key)
+        for other in index.search(h, distance):
+            if other != h:
+                sets.union(keys[0], by_hash[other][0])
+
+    groups = {}
+    for key in hashes:
+        groups.setdefault(sets.find(key), []).append(key)
+    result = [sorted(g) for g in groups.values() if len(g) > 1]
+    result.sort()
+    return result
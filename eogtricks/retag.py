@@ -0,0 +1,392 @@
+# Bulk filename tag editing for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Retag every file in a folder tree, by rules.
+
+The Edit Filename Tags plugin changes one file at a time. This applies
+rules to the tags of every file under some folders instead::
+
+    python3 -m eogtricks.retag --rename kitty cat \\
+        --merge pup puppy doggo dog --remove wip \\
+        --to-end favourite ~/Pictures
+
+By default that's a dry run, which shows a summary of what would be
+renamed. Add --apply to do the renames. Rules can also be read from a
+file with --rules, one per line, in the same form without the dashes:
+
+    rename kitty cat
+    merge pup puppy doggo dog
+    remove wip
+    to-end favourite
+
+Rules are looked up once per tag, and don't chain: renaming a to b and
+b to c changes a to b only. Tags are matched ignoring case.
+
+The tree is walked once. Renames that would replace an existing file,
+or give two files the same name, are reported and skipped. The rest
+are done in parallel.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+import argparse
+import collections
+
+from eogtricks import get_logger
+from eogtricks import lazy_import
+from eogtricks.tags import clean_tag
+from eogtricks.tags import split_tags
+from eogtricks.tags import join_tags
+from eogtricks.tags import uniq
+
+
+logger = get_logger(__name__)
+
+futures = lazy_import("concurrent.futures")
+
+APPLY_THREADS = 8
+APPLY_CHUNK_SIZE = 256  # renames per job
+SHOW_RENAMES = 20
+
+_START = 0
+_END = 1
+
+# Rule kind: (minimum args, maximum args, or None for any number).
+RULE_ARGS = {
+    "rename": (2, 2),
+    "merge": (2, None),
+    "remove": (1, 1),
+    "to-start": (1, 1),
+    "to-end": (1, 1),
+}
+
+
+class RuleError (ValueError):
+    """A rule is malformed, or conflicts with an earlier one."""
+
+
+Rename = collections.namedtuple(
+    "Rename",
+    ["folder", "old", "new", "rules"],
+)
+
+
+class Rules (object):
+    """A set of retagging rules, indexed by the tags they affect."""
+
+    def __init__(self):
+        super(Rules, self).__init__()
+        self.descriptions = []
+        self._renames = {}  # {tag: (rule index, new tag or None)}
+        self._moves = {}  # {tag: (rule index, _START or _END)}
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def add(self, kind, args):
+        """Adds a rule, e.g. add("rename", ["old", "new"])."""
+        if kind not in RULE_ARGS:
+            raise RuleError("Unknown rule %r" % (kind,))
+        (least, most) = RULE_ARGS[kind]
+        if len(args) < least or (most is not None and len(args) > most):
+            raise RuleError("Wrong number of tags for %s: %s"
+                            % (kind, " ".join(args)))
+        tags = [clean_tag(a) for a in args]
+        if not all(tags):
+            raise RuleError("Empty tag in %s: %s" % (kind, " ".join(args)))
+        index = len(self.descriptions)
+        description = "%s %s" % (kind, " ".join(tags))
+
+        if kind in ("rename", "merge"):
+            target = tags[-1]
+            for tag in tags[:-1]:
+                if tag != target:
+                    self._add_rename(tag, index, target, description)
+        elif kind == "remove":
+            self._add_rename(tags[0], index, None, description)
+        else:
+            block = (kind == "to-start") and _START or _END
+            if tags[0] in self._moves:
+                raise RuleError("%s: %r is already moved by rule %d"
+                                % (description, tags[0],
+                                   self._moves[tags[0]][0] + 1))
+            self._moves[tags[0]] = (index, block)
+        self.descriptions.append(description)
+
+    def _add_rename(self, tag, index, new, description):
+        if tag in self._renames:
+            raise RuleError("%s: %r is already changed by rule %d"
+                            % (description, tag, self._renames[tag][0] + 1))
+        self._renames[tag] = (index, new)
+
+    def apply(self, start_tags, end_tags):
+        """Applies the rules to a name's tags.
+
+        Returns the new (start_tags, end_tags, indices of rules used).
+
+        """
+        used = set()
+        blocks = ([], [])
+        for (block, tags) in ((_START, start_tags), (_END, end_tags)):
+            for tag in tags:
+                rule = self._renames.get(clean_tag(tag))
+                if rule is not None:
+                    used.add(rule[0])
+                    tag = rule[1]
+                    if tag is None:
+                        continue
+                move = self._moves.get(clean_tag(tag))
+                if move is not None and move[1] != block:
+                    used.add(move[0])
+                    blocks[move[1]].append(tag)
+                else:
+                    blocks[block].append(tag)
+        seen = set()
+        return (list(uniq(blocks[_START], seen)),
+                list(uniq(blocks[_END], seen)), used)
+
+
+class Plan (object):
+    """The renames the rules call for under some folders."""
+
+    def __init__(self):
+        super(Plan, self).__init__()
+        self.renames = []
+        self.collisions = []  # [(Rename, reason)]
+        self.scanned = 0
+        self.folders = 0
+        self.rule_counts = collections.Counter()  # {rule index: files}
+
+
+def retag_name(name, rules):
+    """Returns a filename's new name under some rules, or None."""
+    if "[" not in name:
+        return None, ()
+    (start_tags, basename, end_tags, ext) = split_tags(name)
+    if not (start_tags or end_tags):
+        return None, ()
+    (new_start, new_end, used) = rules.apply(start_tags, end_tags)
+    if (new_start, new_end) == (start_tags, end_tags):
+        return None, ()
+    new_name = join_tags(new_start, basename, new_end, ext)
+    if new_name == name:
+        return None, ()
+    return new_name, used
+
+
+def plan(folders, rules):
+    """Walks the folders once, and works out what to rename.
+
+    Hidden files and folders are left alone.
+
+    """
+    result = Plan()
+    for top in folders:
+        for (folder, dirnames, filenames) in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            result.folders += 1
+            result.scanned += len(filenames)
+            renames = []
+            for name in sorted(filenames):
+                if name.startswith("."):
+                    continue
+                (new_name, used) = retag_name(name, rules)
+                if new_name is not None:
+                    renames.append(Rename(folder, name, new_name, used))
+            if renames:
+                _check_collisions(renames, set(filenames), result)
+    for rename in result.renames:
+        result.rule_counts.update(rename.rules)
+    return result
+
+
+def _check_collisions(renames, existing, result):
+    """Sorts one folder's renames into the safe ones and collisions."""
+    targets = collections.Counter(r.new for r in renames)
+    for rename in renames:
+        if rename.new in existing:
+            result.collisions.append((rename, "a file with that name exists"))
+        elif targets[rename.new] > 1:
+            result.collisions.append(
+                (rename, "%d files would get that name"
+                 % (targets[rename.new],)),
+            )
+        else:
+            result.renames.append(rename)
+
+
+def _apply_chunk(renames):
+    """Does some renames. Returns [(Rename, error or None)]."""
+    results = []
+    for rename in renames:
+        src = os.path.join(rename.folder, rename.old)
+        dst = os.path.join(rename.folder, rename.new)
+        try:
+            # Something may have appeared there since the plan was made.
+            if os.path.lexists(dst):
+                raise FileExistsError("%r exists" % (dst,))
+            os.rename(src, dst)
+        except OSError as e:
+            results.append((rename, e))
+        else:
+            results.append((rename, None))
+    return results
+
+
+def apply(plan, threads=APPLY_THREADS):
+    """Does a plan's renames, in parallel.
+
+    Returns [(Rename, error)] for those which failed.
+
+    """
+    renames = plan.renames
+    chunks = [renames[i:i + APPLY_CHUNK_SIZE]
+              for i in range(0, len(renames), APPLY_CHUNK_SIZE)]
+    failures = []
+    with futures.ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix="eogtricks-retag") as pool:
+        for results in pool.map(_apply_chunk, chunks):
+            failures.extend((r, e) for (r, e) in results if e is not None)
+    return failures
+
+
+# Command line:
+
+class _RuleAction (argparse.Action):
+    """Collects rules in the order they're given."""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        rules = getattr(namespace, self.dest) or []
+        rules.append((self.const, list(values)))
+        setattr(namespace, self.dest, rules)
+
+
+def read_rules_file(path):
+    """Returns [(kind, args)] from a rules file."""
+    rules = []
+    with open(path) as fp:
+        for line in fp:
+            words = line.split("#", 1)[0].split()
+            if words:
+                rules.append((words[0], words[1:]))
+    return rules
+
+
+def _describe(rename):
+    return "%s → %s" % (os.path.join(rename.folder, rename.old), rename.new)
+
+
+def print_summary(rules, plan, elapsed, show=SHOW_RENAMES, file=sys.stdout):
+    print("Scanned %d file(s) in %d folder(s) in %.2fs."
+          % (plan.scanned, plan.folders, elapsed), file=file)
+    print("%d file(s) to rename." % (len(plan.renames),), file=file)
+    for (i, description) in enumerate(rules.descriptions):
+        print("  %-40s %8d file(s)"
+              % (description, plan.rule_counts[i]), file=file)
+    if plan.collisions:
+        print("%d collision(s), which will be skipped:"
+              % (len(plan.collisions),), file=file)
+        for (rename, reason) in plan.collisions:
+            print("  %s: %s" % (_describe(rename), reason), file=file)
+    if show and plan.renames:
+        renames = plan.renames if show < 0 else plan.renames[:show]
+        print("Renames%s:" % ("" if show < 0 else " (first %d)" % (show,)),
+              file=file)
+        for rename in renames:
+            print("  - %s" % (os.path.join(rename.folder, rename.old),),
+                  file=file)
+            print("  + %s" % (os.path.join(rename.folder, rename.new),),
+                  file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m eogtricks.retag",
+        description=__doc__.split("\n")[0],
+    )
+    parser.add_argument("folders", nargs="+", metavar="FOLDER",
+                        help="folders to retag files in, recursively")
+    rules = parser.add_argument_group("rules, applied in the order given")
+    rules.add_argument("--rename", nargs=2, metavar=("OLD", "NEW"),
+                       dest="rules", action=_RuleAction, const="rename",
+                       help="rename a tag")
+    rules.add_argument("--merge", nargs="+", metavar="TAG",
+                       dest="rules", action=_RuleAction, const="merge",
+                       help="rename synonyms to the last tag given")
+    rules.add_argument("--remove", nargs=1, metavar="TAG",
+                       dest="rules", action=_RuleAction, const="remove",
+                       help="remove a tag")
+    rules.add_argument("--to-start", nargs=1, metavar="TAG",
+                       dest="rules", action=_RuleAction, const="to-start",
+                       help="move a tag to the start block")
+    rules.add_argument("--to-end", nargs=1, metavar="TAG",
+                       dest="rules", action=_RuleAction, const="to-end",
+                       help="move a tag to the end block")
+    rules.add_argument("--rules", dest="rules_files", action="append",
+                       metavar="FILE", default=[],
+                       help="read more rules from a file, one per line")
+    parser.add_argument("--apply", action="store_true",
+                        help="do the renames (default: dry run)")
+    parser.add_argument("--show", type=int, default=SHOW_RENAMES,
+                        metavar="N",
+                        help="list the first N renames, or all with -1 "
+                             "(default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=APPLY_THREADS,
+                        help="parallel renames (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    retag_rules = Rules()
+    try:
+        rule_list = list(args.rules or [])
+        for path in args.rules_files:
+            rule_list.extend(read_rules_file(path))
+        for (kind, tags) in rule_list:
+            retag_rules.add(kind, tags)
+    except (OSError, RuleError) as e:
+        parser.error(str(e))
+    if not retag_rules:
+        parser.error("no rules given")
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            parser.error("not a folder: %s" % (folder,))
+
+    t0 = time.perf_counter()
+    result = plan(args.folders, retag_rules)
+    print_summary(retag_rules, result, time.perf_counter() - t0,
+                  show=args.show)
+    if not args.apply:
+        print("Dry run: nothing was renamed. Use --apply to rename.")
+        return 0
+
+    t0 = time.perf_counter()
+    failures = apply(result, threads=max(1, args.threads))
+    print("Renamed %d file(s) in %.2fs."
+          % (len(result.renames) - len(failures), time.perf_counter() - t0))
+    for (rename, error) in failures:
+        print("Failed: %s: %s" % (_describe(rename), error), file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
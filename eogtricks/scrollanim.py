@@ -0,0 +1,147 @@
+# Animated scrolling for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Smooth scrolling of an adjustment, driven by the frame clock.
+
+Jumping a whole screenful at once makes it hard to keep your place.
+A ScrollAnimation eases the adjustment from where it is to where it's
+going instead, over a fraction of a second, one step per frame::
+
+    anim = ScrollAnimation(widget, adj, target, frame_log=log)
+    anim.start()
+    ...
+    anim.finish()  # a new key was pressed: jump to the end
+
+Each step lands on a whole device pixel, and steps which wouldn't move
+a whole pixel are skipped. Scrolling by whole pixels lets the view
+move what it has already drawn and paint just the strip that scrolled
+into view, instead of resampling everything that's visible of a large,
+scaled image on every frame.
+
+If something else moves the adjustment meanwhile, such as the user
+dragging the scrollbar, the animation stops where it is.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+from gi.repository import GLib
+
+from eogtricks import get_logger
+from eogtricks.watchdog import watched
+
+
+logger = get_logger(__name__)
+
+# How long a page scroll takes. Zero means jump, as before.
+DURATION_MS = int(os.environ.get("EOGTRICKS_PAGE_SCROLL_MS") or 200)
+
+
+def ease_out_cubic(t):
+    """Starts quickly, and slows down into the end."""
+    t = 1.0 - t
+    return 1.0 - t * t * t
+
+
+class ScrollAnimation (object):
+    """Eases one Gtk.Adjustment to a target value."""
+
+    def __init__(self, widget, adjustment, target, duration_ms=DURATION_MS,
+                 frame_log=None, easing=ease_out_cubic):
+        super(ScrollAnimation, self).__init__()
+        self._widget = widget
+        self._adj = adjustment
+        self._start = adjustment.get_value()
+        self._target = self._snap(target)
+        self._duration = duration_ms * 1000  # µs, like frame times
+        self._frame_log = frame_log
+        self._easing = easing
+        self._start_time = None
+        self._tick_id = None
+        self._value = self._start  # the last value we set
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def running(self):
+        return self._tick_id is not None
+
+    def start(self):
+        """Starts moving, from the next frame.
+
+        Without a frame clock to drive it, this jumps to the target.
+
+        """
+        frame_clock = self._widget.get_frame_clock()
+        if (self._duration <= 0 or frame_clock is None
+                or self._target == self._start):
+            self._set_value(self._target)
+            return
+        if self._frame_log is not None:
+            self._frame_log.reset_sequence()
+        self._start_time = frame_clock.get_frame_time()
+        self._tick_id = self._widget.add_tick_callback(self._tick_cb)
+
+    def finish(self):
+        """Jumps straight to the target, if still moving, and stops."""
+        if self._tick_id is None:
+            return
+        self.cancel()
+        self._set_value(self._target)
+
+    def cancel(self):
+        """Stops where it is."""
+        if self._tick_id is not None:
+            self._widget.remove_tick_callback(self._tick_id)
+            self._tick_id = None
+
+    # Internals:
+
+    def _snap(self, value):
+        """Rounds a value to the nearest whole device pixel."""
+        scale = self._widget.get_scale_factor() or 1
+        return round(value * scale) / scale
+
+    def _set_value(self, value):
+        self._adj.set_value(value)
+        self._value = self._adj.get_value()  # after any clamping
+
+    @watched
+    def _tick_cb(self, widget, frame_clock):
+        if self._adj.get_value() != self._value:
+            logger.debug("Scrolled by something else, stopping")
+            self._tick_id = None
+            return GLib.SOURCE_REMOVE
+        frame_time = frame_clock.get_frame_time()
+        if self._frame_log is not None:
+            self._frame_log.record(frame_clock)
+        t = (frame_time - self._start_time) / self._duration
+        if t >= 1.0:
+            self._tick_id = None
+            self._set_value(self._target)
+            return GLib.SOURCE_REMOVE
+        value = self._start + (self._target - self._start) * self._easing(t)
+        value = self._snap(value)
+        if value != self._value:
+            self._set_value(value)
+        return GLib.SOURCE_CONTINUE
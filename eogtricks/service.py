@@ -0,0 +1,459 @@
+# Application-wide workers and caches for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Work and caches shared by all of an application's windows.
+
+EOG activates every plugin once per window, so anything a plugin did
+in the background for itself would be done once per window. Two
+windows on the same folder would decode, hash and index it all twice,
+each with its own pool of workers. Instead, the plugins attach to the
+application's Service, which has one bounded pool of worker threads,
+one of worker processes, and caches that every window can use.
+
+Jobs are submitted with a key, normally made from the file_id() of
+the file they're about. A job with the same key as one already queued
+or running isn't started again: the caller gets the existing Future.
+When a caller no longer wants a job's result, it releases its Future,
+and the job is cancelled once nobody wants it.
+
+Usage::
+
+    service = Service.for_app(app)
+    service.attach()
+    ...
+    future = service.submit(("page", file_id(path), 3), decode, 3)
+    pixbuf = service.cache("pages", PAGE_CACHE_BYTES).get(key)
+    service.release(future)
+    ...
+    service.detach()
+
+The service also has one monitor per folder that any window is
+showing, see eogtricks.folderwatch. Its batches of changes keep the
+shared indexes up to date, without rescanning the folder.
+
+Apart from what runs on its workers, the service is main thread only.
+The exceptions are submit() and release(), which background threads
+may call too, and the SharedCaches and file_info(), which jobs on the
+workers may use. Once the last window has detached, submit() refuses
+new work by returning an already cancelled Future.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import threading
+import collections
+
+from eogtricks import get_logger
+from eogtricks import lazy_import
+from eogtricks import worker_context
+
+
+logger = get_logger(__name__)
+
+futures = lazy_import("concurrent.futures")
+
+# Worker threads, for I/O-bound jobs and decoding.
+THREADS = int(os.environ.get("EOGTRICKS_THREADS") or 4)
+
+# Worker processes, for CPU-bound jobs. Unset means one per CPU, 0
+# means run those jobs on the worker threads instead.
+_workers = os.environ.get("EOGTRICKS_WORKERS")
+WORKERS = int(_workers) if _workers else None
+
+INFO_CACHE_ITEMS = 4096  # files whose image size is remembered
+TAG_INDEX_FOLDERS = 16  # folders whose tag counts are remembered
+
+
+def _has_tags(name):
+    return "[" in name and not name.startswith(".")
+
+
+def file_id(path):
+    """Identifies a file as it is now: the same file, unchanged.
+
+    Raises OSError if the file can't be looked at.
+
+    """
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class SharedCache (object):
+    """Values in least recently used order, up to a total size.
+
+    Each value has a size, which is 1 unless the caller says otherwise,
+    so a cache can be bounded by bytes or by item count. It's safe to
+    use from any thread.
+
+    """
+
+    def __init__(self, max_size):
+        super(SharedCache, self).__init__()
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()  # {key: (value, size)}
+        self._size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """Returns a value, or None, marking it as recently used."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def peek(self, key):
+        """Returns a value, or None, without marking it as used."""
+        item = self._items.get(key)
+        return item and item[0]
+
+    def put(self, key, value, size=1):
+        """Adds a value, evicting the least recently used to make room.
+
+        The newest value is always kept, even if it's too big.
+
+        """
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size and len(self._items) > 1:
+                (old_key, (old_value, old_size)) = \
+                    self._items.popitem(last=False)
+                self._size -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+
+class _TagIndex (object):
+    """The filename tags used in a folder, as of its last change."""
+
+    def __init__(self, folder, stamp):
+        super(_TagIndex, self).__init__()
+        from eogtricks.tags import split_tags
+        self.stamp = stamp  # the folder's mtime
+        self.names = set()  # the tagged names counted
+        self.counts = collections.Counter()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                self._add(entry.name, split_tags)
+
+    def _add(self, name, split_tags):
+        if not _has_tags(name) or name in self.names:
+            return
+        (start_tags, base, end_tags, ext) = split_tags(name)
+        self.names.add(name)
+        self.counts.update(start_tags)
+        self.counts.update(end_tags)
+
+    def _remove(self, name, split_tags):
+        if name not in self.names:
+            return
+        (start_tags, base, end_tags, ext) = split_tags(name)
+        self.names.discard(name)
+        self.counts.subtract(start_tags)
+        self.counts.subtract(end_tags)
+        for tag in start_tags + end_tags:
+            if self.counts[tag] <= 0:
+                del self.counts[tag]
+
+    def update(self, changes, stamp):
+        """Applies a batch of changes to the folder."""
+        from eogtricks.tags import split_tags
+        for path in changes.removed_paths():
+            if not os.path.lexists(path):
+                self._remove(os.path.basename(path), split_tags)
+        for path in changes.added_paths():
+            if os.path.lexists(path):
+                self._add(os.path.basename(path), split_tags)
+        self.stamp = stamp
+
+
+class _Job (object):
+    """A submitted job, and how many callers want it."""
+
+    def __init__(self, key, future):
+        super(_Job, self).__init__()
+        self.key = key
+        self.future = future
+        self.wanted = 1
+
+
+class Service (object):
+    """The workers and caches shared by one application's windows."""
+
+    _services = {}  # {Gtk.Application: Service}
+
+    def __init__(self, app):
+        super(Service, self).__init__()
+        self._app = app
+        self._refcount = 0
+        self._lock = threading.Lock()  # for the job tables and pools
+        self._stopped = False
+        self._jobs = {}  # {key: _Job}, unfinished only
+        self._futures = {}  # {Future: _Job}, unfinished only
+        self._threads = None
+        self._processes = None
+        self._caches = {}  # {name: SharedCache}
+        self._monitors = {}  # {folder: FolderMonitor}
+
+    @classmethod
+    def for_app(cls, app):
+        """Returns the service for an application, creating it if needed.
+        """
+        service = cls._services.get(app)
+        if service is None:
+            service = cls(app)
+            cls._services[app] = service
+        return service
+
+    # Attaching and detaching:
+
+    def attach(self):
+        """Takes a reference, once per plugin per window."""
+        self._refcount += 1
+
+    def detach(self):
+        """Drops a reference. The last stops the workers and clears up.
+
+        Queued jobs are cancelled, and running ones are left to finish
+        by themselves, so closing the last window never waits for them.
+
+        """
+        self._refcount -= 1
+        if self._refcount > 0:
+            return
+        with self._lock:
+            self._stopped = True
+            pending = list(self._futures)
+            self._jobs.clear()
+            self._futures.clear()
+            threads, self._threads = self._threads, None
+            processes, self._processes = self._processes, None
+        # Every queued job is one of ours, so this cancels them all.
+        for future in pending:
+            future.cancel()
+        if threads is not None:
+            threads.shutdown(wait=False)
+        if processes is not None:
+            processes.shutdown(wait=False)
+        for monitor in self._monitors.values():
+            monitor.stop()
+        self._monitors.clear()
+        for cache in self._caches.values():
+            cache.clear()
+        self._caches.clear()
+        self._services.pop(self._app, None)
+        logger.debug("Stopped")
+
+    # Jobs:
+
+    def _process_pool(self):
+        # The worker processes, or None if jobs should run in-process.
+        # Call with the lock held.
+        if WORKERS == 0:
+            return None
+        if self._processes is None:
+            self._processes = futures.ProcessPoolExecutor(
+                max_workers=WORKERS or os.cpu_count() or 1,
+                mp_context=worker_context(),
+            )
+        return self._processes
+
+    def worker_count(self, process=False):
+        """How many jobs of a kind can run at once."""
+        if process and WORKERS != 0:
+            return WORKERS or os.cpu_count() or 1
+        return THREADS
+
+    def _thread_pool(self):
+        # Call with the lock held.
+        if self._threads is None:
+            self._threads = futures.ThreadPoolExecutor(
+                max_workers=THREADS,
+                thread_name_prefix="eogtricks-service",
+            )
+        return self._threads
+
+    def submit(self, key, func, *args, process=False):
+        """Runs func(*args) on a worker, unless it's already underway.
+
+        If a job with the same key is queued or running, its Future is
+        returned instead of starting another. A key of None means the
+        job is never shared. With process=True, the job runs in a
+        worker process, so func and args must be picklable.
+
+        Release the Future when its result is no longer wanted.
+
+        """
+        with self._lock:
+            if self._stopped:
+                future = futures.Future()
+                future.cancel()
+                return future
+            job = self._jobs.get(key) if key is not None else None
+            if job is not None:
+                job.wanted += 1
+                return job.future
+            executor = (process and self._process_pool()
+                        or self._thread_pool())
+            future = executor.submit(func, *args)
+            job = _Job(key, future)
+            if key is not None:
+                self._jobs[key] = job
+            self._futures[future] = job
+        future.add_done_callback(self._job_done)
+        return future
+
+    def release(self, future):
+        """Says a Future's result is no longer wanted by one caller.
+
+        When nobody wants it, a queued job is cancelled. Releasing a
+        finished job's Future does nothing.
+
+        """
+        with self._lock:
+            job = self._futures.get(future)
+            if job is None:
+                return
+            job.wanted -= 1
+            if job.wanted > 0:
+                return
+        future.cancel()
+
+    def _job_done(self, future):
+        # Called from a worker thread, or on cancellation.
+        with self._lock:
+            job = self._futures.pop(future, None)
+            if job is not None and self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+
+    # Caches:
+
+    def cache(self, name, max_size):
+        """Returns a named SharedCache, creating it if needed."""
+        cache = self._caches.get(name)
+        if cache is None:
+            cache = SharedCache(max_size)
+            self._caches[name] = cache
+        return cache
+
+    def file_info(self, path):
+        """Returns (format name, width, height) for an image file.
+
+        This is GdkPixbuf.Pixbuf.get_file_info(), which only reads the
+        file's header, remembered for as long as the file is unchanged.
+        The format name is None for files that aren't images.
+
+        """
+        try:
+            key = file_id(path)
+        except OSError:
+            return (None, 0, 0)
+        cache = self.cache("info", INFO_CACHE_ITEMS)
+        info = cache.get(key)
+        if info is None:
+            from gi.repository import GdkPixbuf
+            (fmt, width, height) = GdkPixbuf.Pixbuf.get_file_info(path)
+            info = ((fmt is not None) and fmt.get_name() or None,
+                    width, height)
+            cache.put(key, info)
+        return info
+
+    def folder_tags(self, folder):
+        """Returns a Counter of the filename tags used in a folder.
+
+        The counts are kept up to date while the folder is watched, and
+        counted again if it changed while it wasn't.
+
+        """
+        try:
+            st = os.stat(folder)
+        except OSError:
+            return collections.Counter()
+        key = (st.st_dev, st.st_ino)
+        cache = self.cache("tags", TAG_INDEX_FOLDERS)
+        index = cache.get(key)
+        if index is None or index.stamp != st.st_mtime_ns:
+            index = _TagIndex(folder, st.st_mtime_ns)
+            cache.put(key, index)
+        return index.counts
+
+    # Folder monitoring:
+
+    def watch_folder(self, folder, callback):
+        """Calls callback(changes) with each batch of changes to a folder.
+
+        The callback gets an eogtricks.folderwatch.Changes. The shared
+        indexes are updated before any callbacks are called.
+
+        """
+        monitor = self._monitors.get(folder)
+        if monitor is None:
+            from eogtricks.folderwatch import FolderMonitor
+            monitor = FolderMonitor(folder)
+            monitor.add_callback(self._folder_changed_cb)
+            monitor.start()
+            self._monitors[folder] = monitor
+        monitor.add_callback(callback)
+
+    def unwatch_folder(self, folder, callback):
+        """Stops calling a callback. Unwatched folders aren't monitored.
+        """
+        monitor = self._monitors.get(folder)
+        if monitor is None:
+            return
+        if monitor.remove_callback(callback) > 1:
+            return
+        # Only our own index callback is left.
+        monitor.stop()
+        del self._monitors[folder]
+
+    def folder_monitor(self, folder):
+        """Returns the FolderMonitor for a watched folder, or None."""
+        return self._monitors.get(folder)
+
+    def _folder_changed_cb(self, changes):
+        """Brings the shared indexes up to date with a batch of changes.
+        """
+        if not changes:
+            return
+        try:
+            st = os.stat(changes.folder)
+        except OSError:
+            return
+        index = self.cache("tags", TAG_INDEX_FOLDERS).peek(
+            (st.st_dev, st.st_ino),
+        )
+        if index is not None:
+            index.update(changes, st.st_mtime_ns)
@@ -0,0 +1,186 @@
+# Two-page spreads, for reading books laid out as facing pages.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Folders of page images, shown as facing pages.
+
+A SpreadSource is a PageSource whose pages are spreads: one or two
+image files, side by side, composited into a single pixbuf no bigger
+than the screen. The PageView shows it like any other source, so paging
+forward swaps one ready-made spread for the next, which the PageCache
+has already composited on a worker.
+
+How images pair up is decided from their headers alone, by pair_pages().
+The cover stands alone, as do wide pages, which are spreads already.
+Everything else pairs up in reading order. For right-to-left books, the
+first page of each pair goes on the right.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+from eogtricks import get_logger
+from eogtricks.pages import PageSource
+from eogtricks.pageview import BACKGROUND_RGB
+from eogtricks.service import file_id
+
+
+logger = get_logger(__name__)
+
+WIDE_PAGE_RATIO = 1.0  # width/height above which a page stands alone
+BACKGROUND_PIXEL = sum(  # BACKGROUND_RGB, as an opaque RGBA pixel
+    int(round(c * 255)) << shift
+    for (c, shift) in zip(BACKGROUND_RGB, (24, 16, 8))
+) | 0xff
+
+
+def is_wide(width, height):
+    """Whether a page of this size is a spread by itself."""
+    return height > 0 and width / height > WIDE_PAGE_RATIO
+
+
+def pair_pages(sizes, cover=True):
+    """Groups pages into spreads, in reading order.
+
+    The sizes are (width, height) pairs, with (0, 0) for unknown sizes.
+    Returns a list of tuples of page indices, each one or two long.
+
+    """
+    spreads = []
+    pending = None
+    for (i, (width, height)) in enumerate(sizes):
+        alone = (cover and i == 0) or is_wide(width, height)
+        if alone:
+            if pending is not None:
+                spreads.append((pending,))
+                pending = None
+            spreads.append((i,))
+        elif pending is None:
+            pending = i
+        else:
+            spreads.append((pending, i))
+            pending = None
+    if pending is not None:
+        spreads.append((pending,))
+    return spreads
+
+
+class SpreadSource (PageSource):
+    """Image files as spreads, composited to fit a given size.
+
+    The paths are in reading order, and the sizes are the image sizes
+    from their headers. The spreads are made to fit within width x
+    height pixels, which should be the size of the view on screen.
+
+    """
+
+    def __init__(self, paths, sizes, width, height, rtl=False):
+        folder = paths and os.path.dirname(paths[0]) or ""
+        super(SpreadSource, self).__init__(folder)
+        self.paths = list(paths)
+        self.spreads = pair_pages(sizes)
+        self._sizes = list(sizes)
+        self._width = max(1, width)
+        self._height = max(1, height)
+        self._rtl = rtl
+        self._keys = {}  # {spread index: page_key()}
+        self._spread_of = {}  # {path: spread index}
+        for (s, spread) in enumerate(self.spreads):
+            for i in spread:
+                self._spread_of[self.paths[i]] = s
+
+    def __len__(self):
+        return len(self.spreads)
+
+    def page_name(self, index):
+        return " + ".join(os.path.basename(self.paths[i])
+                          for i in self.spreads[index])
+
+    def page_key(self, index):
+        """Spreads are the same if their files and layout are."""
+        key = self._keys.get(index)
+        if key is None:
+            files = []
+            for i in self.spreads[index]:
+                try:
+                    files.append(file_id(self.paths[i]))
+                except OSError:
+                    files.append(self.paths[i])  # decoding will say why
+            key = ("spread", tuple(files), self._width, self._height,
+                   self._rtl)
+            self._keys[index] = key
+        return key
+
+    def spread_of(self, path):
+        """The index of the spread showing a file, or None."""
+        return self._spread_of.get(path)
+
+    def decode(self, index):
+        """Composites a spread. It's safe to call from worker threads.
+
+        Each page is loaded straight at the size it'll be shown at,
+        scaled to a common height, so the pages' full-size pixels are
+        never held in memory.
+
+        """
+        from gi.repository import GdkPixbuf
+        spread = self.spreads[index]
+        sizes = [self._sizes[i] for i in spread]
+
+        # Scale every page to the same height, shrinking them all
+        # together if that's too wide for the view. Don't enlarge.
+        height = min(self._height, max(h for (w, h) in sizes) or 1)
+        widths = [w * height / h if h else height for (w, h) in sizes]
+        if sum(widths) > self._width:
+            shrink = self._width / sum(widths)
+            height *= shrink
+            widths = [w * shrink for w in widths]
+
+        pixbufs = []
+        for (i, w) in zip(spread, widths):
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+                self.paths[i],
+                max(1, int(round(w))),
+                max(1, int(round(height))),
+                True,
+            )
+            pixbufs.append(pixbuf.apply_embedded_orientation() or pixbuf)
+        if len(pixbufs) == 1:
+            return pixbufs[0]
+
+        if self._rtl:
+            pixbufs.reverse()
+        out_w = sum(p.get_width() for p in pixbufs)
+        out_h = max(p.get_height() for p in pixbufs)
+        spread_pixbuf = GdkPixbuf.Pixbuf.new(
+            GdkPixbuf.Colorspace.RGB, False, 8, out_w, out_h,
+        )
+        spread_pixbuf.fill(BACKGROUND_PIXEL)
+        x = 0
+        for pixbuf in pixbufs:
+            (w, h) = (pixbuf.get_width(), pixbuf.get_height())
+            y = (out_h - h) // 2
+            if pixbuf.get_has_alpha():
+                pixbuf.composite(spread_pixbuf, x, y, w, h, x, y, 1, 1,
+                                 GdkPixbuf.InterpType.NEAREST, 255)
+            else:
+                pixbuf.copy_area(0, 0, w, h, spread_pixbuf, x, y)
+            x += w
+        return spread_pixbuf
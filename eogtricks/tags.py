@@ -0,0 +1,130 @@
+# Filename “tags” for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2017 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Tags kept in filenames, in square brackets.
+
+A filename can have a block of tags at the start and another at the
+end, like "[start tags] name [end tags].jpg". Tags are lowercase words,
+and appear only once per name, in either block.
+
+When editing, both blocks are written as one string, with a "/"
+between the start and end blocks: "start tags / end tags".
+
+"""
+
+from __future__ import print_function
+
+import os
+import re
+
+
+TAG_RE = re.compile(r'\s*(\[[^\[\]]*\])\s*')
+FORBIDDEN_ENTRY_CHARS = '[ ] ; ,'.split(' ')
+FORBIDDEN_CHARS = re.compile(r'[\[\];,/]')
+FORBIDDEN_CHAR_REPLACEMENT = '_'
+
+
+def uniq(list, seen=None):
+    if seen is None:
+        seen = set()
+    for item in list:
+        if item in seen:
+            continue
+        seen.add(item)
+        yield(item)
+
+
+def clean_tag(tag):
+    """A word as a tag: lowercase, with no forbidden characters."""
+    return FORBIDDEN_CHARS.sub(FORBIDDEN_CHAR_REPLACEMENT, tag.lower())
+
+
+def split_tags(basename):
+    basename, ext = os.path.splitext(basename)
+    tokens = TAG_RE.split(basename)
+    tokens = [t for t in tokens if t != ""]
+    if not tokens:
+        return ([], basename, [], ext)
+
+    start_tags = []
+    end_tags = []
+
+    if TAG_RE.fullmatch(tokens[0]):
+        block = tokens[0].strip("[]").strip()
+        tokens = tokens[1:]
+        start_tags.extend(block.split())
+    non_tag_tokens = []
+    for token in tokens:
+        if TAG_RE.fullmatch(token):
+            block = token.strip("[]").strip()
+            end_tags.extend(block.split())
+        else:
+            non_tag_tokens.append(token)
+
+    basename = "".join(non_tag_tokens)
+
+    seen = set()
+    start_tags = list(uniq(start_tags, seen))
+    end_tags = list(uniq(end_tags, seen))
+
+    return (start_tags, basename, end_tags, ext)
+
+
+def join_tags(start_tags, basename, end_tags, ext):
+    """The inverse of split_tags()."""
+    name = ""
+    if start_tags:
+        name += "[{}] ".format(" ".join(start_tags))
+    name += basename
+    if end_tags:
+        name += " [{}]".format(" ".join(end_tags))
+    return name + ext
+
+
+def tags2editstr(start_tags, end_tags):
+    seen = set()
+    start_tags = list(uniq(start_tags, seen))
+    end_tags = list(uniq(end_tags, seen))
+    if start_tags and end_tags:
+        return ' / '.join((' '.join(start_tags), ' '.join(end_tags)))
+    elif end_tags and not start_tags:
+        return ' '.join(end_tags)
+    elif start_tags and not end_tags:
+        return ' '.join(start_tags) + ' /'
+    else:
+        return ''
+
+
+def editstr2tags(editstr):
+    blocks = editstr.split('/')
+    while len(blocks) > 2:
+        blocks[1] = blocks[1] + ' ' + blocks.pop()
+    tags = []
+    for b in blocks:
+        b_tags = [clean_tag(w) for w in b.strip().split() if w != '']
+        tags.append(b_tags)
+    start_tags = []
+    end_tags = []
+    if len(tags) == 2:
+        start_tags, end_tags = tags
+    else:
+        end_tags = tags[0]
+    seen = set()
+    start_tags = list(uniq(start_tags, seen))
+    end_tags = list(uniq(end_tags, seen))
+    return start_tags, end_tags
@@ -0,0 +1,194 @@
+# Freedesktop thumbnails for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Thumbnails in the shared freedesktop.org thumbnail cache.
+
+EOG's thumbnail strip, like most file managers, looks for thumbnails in
+~/.cache/thumbnails, under the MD5 of the file's URI. A thumbnail is
+valid while its Thumb::URI and Thumb::MTime PNG text fields match the
+file. This module writes normal (128px) and large (256px) ones in bulk,
+so that a freshly imported folder's strip fills in without waiting for
+EOG to make each thumbnail as it scrolls by.
+
+Validity is checked by reading the PNG text chunks directly, which is
+much cheaper than decoding the thumbnail. thumbnail_files() is meant to
+be run in worker processes, a chunk of files at a time.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import struct
+import hashlib
+import tempfile
+
+from eogtricks import get_logger
+
+
+logger = get_logger(__name__)
+
+SIZES = [("normal", 128), ("large", 256)]
+FAIL_FOLDER = os.path.join("fail", "eogtricks")
+SOFTWARE = "EOGtricks"
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_PNG_CHUNK = struct.Struct(">I4s")
+
+
+def default_root():
+    """The user's thumbnail cache folder."""
+    from gi.repository import GLib
+    return os.path.join(GLib.get_user_cache_dir(), "thumbnails")
+
+
+def thumbnail_name(uri):
+    return hashlib.md5(uri.encode("utf-8")).hexdigest() + ".png"
+
+
+def read_png_text(path):
+    """Returns a PNG file's tEXt fields, as a dict.
+
+    Only the chunks before the image data are read, which is where
+    thumbnailers put them.
+
+    """
+    text = {}
+    with open(path, "rb") as fp:
+        if fp.read(len(_PNG_SIGNATURE)) != _PNG_SIGNATURE:
+            raise ValueError("%s: not a PNG" % (path,))
+        while True:
+            head = fp.read(_PNG_CHUNK.size)
+            if len(head) < _PNG_CHUNK.size:
+                break
+            (length, type_) = _PNG_CHUNK.unpack(head)
+            if type_ in (b"IDAT", b"IEND"):
+                break
+            if type_ != b"tEXt":
+                fp.seek(length + 4, os.SEEK_CUR)
+                continue
+            data = fp.read(length)
+            fp.seek(4, os.SEEK_CUR)  # CRC
+            (key, sep, value) = data.partition(b"\0")
+            text[key.decode("latin-1")] = value.decode("latin-1")
+    return text
+
+
+def is_valid(thumb_path, uri, mtime):
+    """Whether a thumbnail exists, and is still for the file as it is."""
+    try:
+        text = read_png_text(thumb_path)
+    except (OSError, ValueError):
+        return False
+    return (text.get("Thumb::URI") == uri
+            and text.get("Thumb::MTime") == str(int(mtime)))
+
+
+def _save(pixbuf, thumb_path, options):
+    """Saves a thumbnail atomically, readable only by the user."""
+    folder = os.path.dirname(thumb_path)
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    (fd, tmp_path) = tempfile.mkstemp(prefix=".eogtricks-", suffix=".png",
+                                      dir=folder)
+    os.close(fd)
+    try:
+        pixbuf.savev(tmp_path, "png", list(options), list(options.values()))
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, thumb_path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def thumbnail_file(path, uri, root):
+    """Writes any missing or stale thumbnails for one file.
+
+    Returns the number written. A file that can't be thumbnailed gets
+    a failure marker instead, as the spec asks, so that it's not tried
+    again until it changes.
+
+    """
+    from gi.repository import GdkPixbuf
+    mtime = os.stat(path).st_mtime
+    name = thumbnail_name(uri)
+    todo = [(size, os.path.join(root, folder, name))
+            for (folder, size) in SIZES]
+    todo = [(size, p) for (size, p) in todo if not is_valid(p, uri, mtime)]
+    if not todo:
+        return 0
+    fail_path = os.path.join(root, FAIL_FOLDER, name)
+    if is_valid(fail_path, uri, mtime):
+        return 0
+
+    options = {
+        "tEXt::Thumb::URI": uri,
+        "tEXt::Thumb::MTime": str(int(mtime)),
+        "tEXt::Software": SOFTWARE,
+    }
+    try:
+        (fmt, width, height) = GdkPixbuf.Pixbuf.get_file_info(path)
+        if fmt is None:
+            raise ValueError("%s: unknown image format" % (path,))
+        largest = max(size for (size, p) in todo)
+        scale = min(1.0, largest / max(width, height))
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+            path,
+            max(1, int(round(width * scale))),
+            max(1, int(round(height * scale))),
+            True,
+        )
+        pixbuf = pixbuf.apply_embedded_orientation() or pixbuf
+    except Exception as e:
+        logger.debug("Can't thumbnail %r: %s", path, e)
+        _save(GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1),
+              fail_path, options)
+        return 0
+
+    options["tEXt::Thumb::Image::Width"] = str(width)
+    options["tEXt::Thumb::Image::Height"] = str(height)
+    written = 0
+    for (size, thumb_path) in sorted(todo, reverse=True):
+        w = pixbuf.get_width()
+        h = pixbuf.get_height()
+        scale = min(1.0, size / max(w, h))
+        if scale < 1.0:
+            pixbuf = pixbuf.scale_simple(
+                max(1, int(round(w * scale))),
+                max(1, int(round(h * scale))),
+                GdkPixbuf.InterpType.BILINEAR,
+            )
+        _save(pixbuf, thumb_path, options)
+        written += 1
+    return written
+
+
+def thumbnail_files(entries, root):
+    """Thumbnails a chunk of (path, uri) entries.
+
+    Returns [(path, number written, or None on error)].
+
+    """
+    results = []
+    for (path, uri) in entries:
+        try:
+            results.append((path, thumbnail_file(path, uri, root)))
+        except Exception as e:
+            logger.debug("Failed to thumbnail %r: %s", path, e)
+            results.append((path, None))
+    return results
@@ -0,0 +1,248 @@
+# Multi-page TIFF page source for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Read the pages of a multi-page TIFF, one at a time.
+
+Each image file directory (IFD) in a TIFF is a page, but GdkPixbuf's
+TIFF loader only ever decodes the first. So to decode page N, this
+streams a small single-page TIFF into the loader: a new header, page
+N's directory with its out-of-line values, and then page N's strips or
+tiles, sliced straight out of a memory map of the original file.
+
+The chain of directories is walked once, when the file is opened.
+Only classic TIFF is supported, not BigTIFF.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import mmap
+import struct
+
+from eogtricks import get_logger
+from eogtricks.pages import PageSource
+from eogtricks.pages import CHUNK_SIZE
+
+
+logger = get_logger(__name__)
+
+_BYTE_ORDERS = {b"II": "<", b"MM": ">"}
+_CLASSIC = 42
+_BIGTIFF = 43
+
+# Field type: size in bytes.
+_TYPE_SIZES = {
+    1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1,
+    7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4,
+}
+_SHORT = 3
+_LONG = 4
+
+# (offsets tag, byte counts tag) for strip and tiled images.
+_DATA_TAGS = [(273, 279), (324, 325)]
+
+# Tags pointing at other parts of the file which aren't carried over:
+# FreeOffsets, FreeByteCounts, SubIFDs, old-style JPEG, and the Exif,
+# GPS and Interoperability directories.
+_DROPPED_TAGS = {288, 289, 330, 513, 514, 34665, 34853, 40965}
+
+
+class TiffError (Exception):
+    """The file isn't a TIFF this can read."""
+
+
+class TiffPageSource (PageSource):
+    """The pages of a TIFF, in file order."""
+
+    def __init__(self, path):
+        super(TiffPageSource, self).__init__(path)
+        self._fp = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._fp.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fp.close()
+            raise TiffError("%s: empty file" % (path,))
+        try:
+            self._order = _BYTE_ORDERS.get(self._map[:2])
+            self._ifd_offsets = self._index_pages()
+        except Exception:
+            self.close()
+            raise
+        logger.debug("%s: %d page(s)", path, len(self._ifd_offsets))
+
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(self._order + fmt, self._map, offset)
+
+    def _index_pages(self):
+        """Returns the offset of each page's IFD."""
+        if self._order is None:
+            raise TiffError("%s: not a TIFF" % (self.path,))
+        (version, offset) = self._unpack("HI", 2)
+        if version == _BIGTIFF:
+            raise TiffError("%s: BigTIFF isn't supported" % (self.path,))
+        elif version != _CLASSIC:
+            raise TiffError("%s: not a TIFF" % (self.path,))
+
+        offsets = []
+        seen = set()
+        size = len(self._map)
+        while offset and offset not in seen:
+            seen.add(offset)
+            if offset + 2 > size:
+                logger.warning("%s: truncated after %d page(s)",
+                               self.path, len(offsets))
+                break
+            (n,) = self._unpack("H", offset)
+            next_pos = offset + 2 + 12 * n
+            if next_pos + 4 > size:
+                logger.warning("%s: truncated after %d page(s)",
+                               self.path, len(offsets))
+                break
+            offsets.append(offset)
+            (offset,) = self._unpack("I", next_pos)
+        return offsets
+
+    # Rebuilding one page as a TIFF of its own:
+
+    def _read_ifd(self, index):
+        """Returns a page's entries as [(tag, type, count, data)]."""
+        entries = []
+        offset = self._ifd_offsets[index]
+        (n,) = self._unpack("H", offset)
+        for pos in range(offset + 2, offset + 2 + 12 * n, 12):
+            (tag, type_, count) = self._unpack("HHI", pos)
+            if tag in _DROPPED_TAGS or type_ not in _TYPE_SIZES:
+                continue
+            nbytes = _TYPE_SIZES[type_] * count
+            if nbytes <= 4:
+                data = self._map[pos + 8:pos + 8 + nbytes]
+            else:
+                (value_offset,) = self._unpack("I", pos + 8)
+                data = self._map[value_offset:value_offset + nbytes]
+                if len(data) != nbytes:
+                    raise TiffError("%s: page %d: tag %d is truncated"
+                                    % (self.path, index + 1, tag))
+            entries.append((tag, type_, count, data))
+        return entries
+
+    def _ints(self, type_, count, data):
+        if type_ == _SHORT:
+            return struct.unpack(self._order + "%dH" % (count,), data)
+        elif type_ == _LONG:
+            return struct.unpack(self._order + "%dI" % (count,), data)
+        raise TiffError("%s: bad data offsets type %d" % (self.path, type_))
+
+    def _layout(self, index):
+        """Lays out a single-page TIFF for a page.
+
+        Returns the encoded header, directory and values, and a list of
+        (offset, length) ranges of the original file which must follow
+        them, in order.
+
+        """
+        entries = {e[0]: e for e in self._read_ifd(index)}
+        for (offsets_tag, counts_tag) in _DATA_TAGS:
+            if offsets_tag in entries and counts_tag in entries:
+                break
+        else:
+            raise TiffError("%s: page %d has no image data"
+                            % (self.path, index + 1))
+        offsets = self._ints(*entries[offsets_tag][1:])
+        counts = self._ints(*entries[counts_tag][1:])
+        if len(offsets) != len(counts):
+            raise TiffError("%s: page %d: bad image data offsets"
+                            % (self.path, index + 1))
+
+        # Placeholder for the new offsets, which are always LONGs.
+        n = len(offsets)
+        entries[offsets_tag] = (offsets_tag, _LONG, n, bytes(4 * n))
+        entries = [entries[tag] for tag in sorted(entries)]
+
+        # Out-of-line values go right after the directory, word aligned.
+        pos = 8 + 2 + 12 * len(entries) + 4
+        value_offsets = {}
+        for (tag, type_, count, data) in entries:
+            if len(data) > 4:
+                value_offsets[tag] = pos
+                pos += len(data) + (len(data) & 1)
+
+        # Then the image data. Adjacent strips are read as one range.
+        new_offsets = []
+        ranges = []
+        for (offset, count) in zip(offsets, counts):
+            new_offsets.append(pos)
+            pos += count
+            if ranges and sum(ranges[-1]) == offset:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + count)
+            else:
+                ranges.append((offset, count))
+        new_offsets = struct.pack(self._order + "%dI" % (n,), *new_offsets)
+
+        order = self._order
+        parts = [
+            self._map[:2],
+            struct.pack(order + "HI", _CLASSIC, 8),
+            struct.pack(order + "H", len(entries)),
+        ]
+        values = []
+        for (tag, type_, count, data) in entries:
+            if tag == offsets_tag:
+                data = new_offsets
+            parts.append(struct.pack(order + "HHI", tag, type_, count))
+            if tag in value_offsets:
+                parts.append(struct.pack(order + "I", value_offsets[tag]))
+                values.append(data)
+                if len(data) & 1:
+                    values.append(b"\0")
+            else:
+                parts.append(data.ljust(4, b"\0"))
+        parts.append(struct.pack(order + "I", 0))
+        parts.extend(values)
+        return (b"".join(parts), ranges)
+
+    # PageSource interface:
+
+    def __len__(self):
+        return len(self._ifd_offsets)
+
+    def page_name(self, index):
+        return "Page %d" % (index + 1,)
+
+    def iter_chunks(self, index, chunk_size=CHUNK_SIZE):
+        """Yields a page as a single-page TIFF."""
+        (prefix, ranges) = self._layout(index)
+        yield prefix
+        size = len(self._map)
+        with memoryview(self._map) as view:
+            for (start, length) in ranges:
+                end = start + length
+                if end > size:
+                    raise TiffError("%s: page %d is truncated"
+                                    % (self.path, index + 1))
+                for pos in range(start, end, chunk_size):
+                    yield view[pos:min(end, pos + chunk_size)]
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
@@ -0,0 +1,382 @@
+# Tiled image pyramids for EOGtricks.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Image pyramids, for showing very large images a tile at a time.
+
+A pyramid is an image cut into square tiles at its full size, then
+again at half that size, and so on until it fits in a single tile. It
+is built once, by make_pyramid() in a worker, and kept in the user's
+cache folder under a key made from the file's path, size and
+modification time. After that, showing any part of the image at any
+zoom only means loading the handful of tiles which cover the screen at
+the nearest level of detail.
+
+Building is the one time the whole image is held decoded. GdkPixbuf
+can't decode part of an image, so cutting the full-size level needs a
+full decode, in a worker process, once per file. The smaller levels
+of JPEGs are decoded straight to their own size, and the full-size
+image is dropped first. Other formats are halved from the level
+before, which briefly holds both.
+
+TileCache holds loaded tiles as cairo surfaces, in least recently used
+order, up to a fixed number of bytes shared by all windows.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import json
+import math
+import time
+import shutil
+import hashlib
+import tempfile
+
+from eogtricks import get_logger
+from eogtricks.watchdog import watched
+
+
+logger = get_logger(__name__)
+
+TILE_SIZE = 512
+FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+BUILD_PREFIX = ".build-"
+STALE_BUILD_SECONDS = 60 * 60
+
+# Formats whose loaders can decode straight to a fraction of the size,
+# without holding the full-size image.
+SCALED_DECODE_FORMATS = {"jpeg"}
+
+MAX_PYRAMIDS = int(os.environ.get("EOGTRICKS_TILE_PYRAMIDS", 16))
+CACHE_BYTES = int(os.environ.get("EOGTRICKS_TILE_CACHE_MB", 128)) << 20
+
+
+def cache_root():
+    """The folder holding all the cached pyramids."""
+    from gi.repository import GLib
+    return os.path.join(GLib.get_user_cache_dir(), "eogtricks", "tiles")
+
+
+def pyramid_key(path):
+    """Cache folder name for a file's current contents."""
+    st = os.stat(path)
+    ident = "%s\0%d\0%d" % (os.path.realpath(path), st.st_mtime_ns,
+                            st.st_size)
+    return hashlib.sha1(ident.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+def _read_manifest(folder):
+    """Returns a complete pyramid's manifest, or None."""
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME)) as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+class Pyramid (object):
+    """A built pyramid: its geometry, and where its tiles are.
+
+    Level 0 is the full-size image, and the last level is a single
+    tile. Each level is half the size of the one before, rounded up.
+
+    """
+
+    def __init__(self, folder, manifest):
+        super(Pyramid, self).__init__()
+        self.folder = folder
+        self.width = manifest["width"]
+        self.height = manifest["height"]
+        self.tile_size = manifest["tile_size"]
+        self.sizes = [tuple(s) for s in manifest["sizes"]]
+        self.ext = manifest["ext"]
+
+    @property
+    def levels(self):
+        return len(self.sizes)
+
+    def tile_path(self, level, col, row):
+        return os.path.join(self.folder, str(level),
+                            "%d_%d.%s" % (col, row, self.ext))
+
+    def tile_size_at(self, level, col, row):
+        """A tile's (width, height): those on the far edges are smaller."""
+        (w, h) = self.sizes[level]
+        t = self.tile_size
+        return (min(t, w - col * t), min(t, h - row * t))
+
+    def level_scale(self, level):
+        """Image pixels per pixel of a level, as (x, y)."""
+        (w, h) = self.sizes[level]
+        return (self.width / w, self.height / h)
+
+    def level_for_zoom(self, zoom):
+        """The coarsest level with at least one pixel per screen pixel."""
+        if zoom <= 0:
+            return self.levels - 1
+        level = int(math.floor(math.log(1 / zoom, 2)))
+        return min(self.levels - 1, max(0, level))
+
+    def tiles_in(self, level, x, y, w, h):
+        """Yields the (col, row) of a level's tiles covering a rectangle.
+
+        The rectangle is in full-size image pixels.
+
+        """
+        (lw, lh) = self.sizes[level]
+        (sx, sy) = self.level_scale(level)
+        t = self.tile_size
+        col0 = max(0, int(x / sx) // t)
+        row0 = max(0, int(y / sy) // t)
+        col1 = min(-(-lw // t), int(math.ceil((x + w) / sx / t)))
+        row1 = min(-(-lh // t), int(math.ceil((y + h) / sy / t)))
+        for row in range(row0, row1):
+            for col in range(col0, col1):
+                yield (col, row)
+
+
+def load_pyramid(path, root):
+    """Returns the cached Pyramid for a file, or None if there isn't one.
+    """
+    try:
+        folder = os.path.join(root, pyramid_key(path))
+    except OSError:
+        return None
+    manifest = _read_manifest(folder)
+    if manifest is None:
+        return None
+    try:
+        # Recently viewed pyramids are the last to be pruned.
+        os.utime(os.path.join(folder, MANIFEST_NAME))
+    except OSError:
+        pass
+    return Pyramid(folder, manifest)
+
+
+def build_pyramid(path, folder, tile_size=TILE_SIZE):
+    """Cuts an image file into a pyramid of tiles, in an empty folder.
+
+    This decodes the whole image, so run it in a worker. The manifest
+    is written last, and returned.
+
+    """
+    from gi.repository import GdkPixbuf
+    fmt = GdkPixbuf.Pixbuf.get_file_info(path)[0]
+    rescale = fmt is not None and fmt.get_name() in SCALED_DECODE_FORMATS
+    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+    (raw_w, raw_h) = (pixbuf.get_width(), pixbuf.get_height())
+    pixbuf = pixbuf.apply_embedded_orientation() or pixbuf
+    if pixbuf.get_has_alpha():
+        (ext, type_, keys, values) = ("png", "png", [], [])
+    else:
+        (ext, type_, keys, values) = ("jpg", "jpeg", ["quality"], ["90"])
+
+    t = tile_size
+    sizes = []
+    while True:
+        (w, h) = (pixbuf.get_width(), pixbuf.get_height())
+        level_folder = os.path.join(folder, str(len(sizes)))
+        os.mkdir(level_folder)
+        for row in range(-(-h // t)):
+            for col in range(-(-w // t)):
+                (x, y) = (col * t, row * t)
+                tile = pixbuf.new_subpixbuf(x, y, min(t, w - x),
+                                            min(t, h - y))
+                tile_path = os.path.join(level_folder,
+                                         "%d_%d.%s" % (col, row, ext))
+                tile.savev(tile_path, type_, keys, values)
+        sizes.append([w, h])
+        if w <= t and h <= t:
+            break
+        if rescale:
+            # Sizes before orientation, which may swap them.
+            (raw_w, raw_h) = (max(1, (raw_w + 1) // 2),
+                              max(1, (raw_h + 1) // 2))
+            pixbuf = None
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+                path, raw_w, raw_h, False,
+            )
+            pixbuf = pixbuf.apply_embedded_orientation() or pixbuf
+        else:
+            pixbuf = pixbuf.scale_simple(
+                max(1, (w + 1) // 2), max(1, (h + 1) // 2),
+                GdkPixbuf.InterpType.BILINEAR,
+            )
+
+    manifest = {
+        "version": FORMAT_VERSION,
+        "width": sizes[0][0],
+        "height": sizes[0][1],
+        "tile_size": t,
+        "sizes": sizes,
+        "ext": ext,
+    }
+    with open(os.path.join(folder, MANIFEST_NAME), "w") as fp:
+        json.dump(manifest, fp)
+    return manifest
+
+
+def make_pyramid(path, root, tile_size=TILE_SIZE):
+    """Builds a file's pyramid in the cache, if needed.
+
+    Returns the pyramid's folder. It's safe for several processes to do
+    this at once: each builds in a temporary folder of its own, which
+    is only renamed into place when complete.
+
+    """
+    folder = os.path.join(root, pyramid_key(path))
+    if _read_manifest(folder) is not None:
+        return folder
+    if os.path.isdir(folder):
+        shutil.rmtree(folder, ignore_errors=True)  # old format
+    os.makedirs(root, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=root)
+    try:
+        build_pyramid(path, tmp, tile_size)
+        try:
+            os.rename(tmp, folder)
+        except OSError:
+            if _read_manifest(folder) is None:
+                raise
+            logger.debug("%r: tiles were built elsewhere meanwhile", path)
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+    prune(root, keep=folder)
+    return folder
+
+
+def prune(root, max_pyramids=MAX_PYRAMIDS, keep=None):
+    """Removes all but the most recently used pyramids.
+
+    Abandoned builds are cleared out too.
+
+    """
+    now = time.time()
+    pyramids = []
+    for name in os.listdir(root):
+        folder = os.path.join(root, name)
+        if name.startswith(BUILD_PREFIX):
+            try:
+                age = now - os.stat(folder).st_mtime
+            except OSError:
+                continue
+            if age > STALE_BUILD_SECONDS:
+                shutil.rmtree(folder, ignore_errors=True)
+            continue
+        try:
+            mtime = os.stat(os.path.join(folder, MANIFEST_NAME)).st_mtime
+        except OSError:
+            continue
+        pyramids.append((mtime, folder))
+    pyramids.sort(reverse=True)
+    for (mtime, folder) in pyramids[max_pyramids:]:
+        if folder != keep:
+            logger.debug("Pruning %r", folder)
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+def _load_tile(path):
+    # Tiles are at most TILE_SIZE square, so this is always small.
+    from gi.repository import GdkPixbuf
+    return GdkPixbuf.Pixbuf.new_from_file(path)
+
+
+class TileCache (object):
+    """Loaded tiles, as cairo surfaces, up to a fixed number of bytes.
+
+    Tiles are keyed by their file path, which names the pyramid's image
+    by its contents. They're read and decoded by the application's
+    Service, and made into surfaces on the main thread, after which the
+    ready_cb is called there with the tile's path. The surfaces go in
+    the service's "tiles" cache, so windows showing the same image
+    share them.
+
+    """
+
+    def __init__(self, ready_cb, service, max_bytes=CACHE_BYTES):
+        super(TileCache, self).__init__()
+        self._ready_cb = ready_cb
+        self._service = service
+        self._surfaces = service.cache("tiles", max_bytes)
+        self._futures = {}  # {path: Future}
+        self._failed = set()
+        self._closed = False
+
+    def get(self, path):
+        """Returns a tile's surface if it's loaded. Otherwise it's queued.
+        """
+        surface = self._surfaces.get(path)
+        if surface is not None:
+            return surface
+        if path not in self._futures and path not in self._failed:
+            future = self._service.submit(("tile", path), _load_tile, path)
+            future.add_done_callback(
+                lambda f, p=path: self._load_done(p, f),
+            )
+            self._futures[path] = future
+        return None
+
+    def peek(self, path):
+        """Returns a tile's surface if it's loaded, without queueing it."""
+        return self._surfaces.peek(path)
+
+    def retain(self, paths):
+        """Gives up on queued loads of any tiles not in paths."""
+        for path in list(self._futures):
+            if path not in paths:
+                self._service.release(self._futures.pop(path))
+
+    def close(self):
+        """Gives up on queued loads."""
+        self._closed = True
+        for future in self._futures.values():
+            self._service.release(future)
+        self._futures.clear()
+
+    def _load_done(self, path, future):
+        # Called from a worker thread.
+        from gi.repository import GLib
+        GLib.idle_add(self._loaded_idle_cb, path, future)
+
+    @watched
+    def _loaded_idle_cb(self, path, future):
+        if self._closed or self._futures.get(path) is not future:
+            return False
+        del self._futures[path]
+        if future.cancelled():
+            return False
+        try:
+            pixbuf = future.result()
+        except Exception:
+            logger.warning("Failed to load tile %r", path, exc_info=True)
+            self._failed.add(path)
+            return False
+        if path not in self._surfaces:
+            from gi.repository import Gdk
+            surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, 1, None)
+            nbytes = pixbuf.get_width() * pixbuf.get_height() * 4
+            self._surfaces.put(path, surface, nbytes)
+        self._ready_cb(path)
+        return False
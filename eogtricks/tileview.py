@@ -0,0 +1,374 @@
+# Tiled level-of-detail view of very large images.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""A widget showing a very large image from its tile pyramid.
+
+The pager overlays one of these on EOG's view, and keeps it at the same
+zoom as EOG's. Only the tiles covering the screen at the nearest level
+of detail are drawn, from a TileCache with a fixed memory budget, so
+scrolling around a gigapixel image costs about the same as scrolling
+around a screenful. Until the finer tiles arrive, coarser ones stand in
+for them.
+
+The view doesn't scroll a child widget the size of the zoomed image,
+since that can be far bigger than GTK allows. Instead its scrollbars
+have adjustments of their own, in zoomed pixels.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+
+from gi.repository import Gtk
+from gi.repository import Gdk
+from gi.repository import GLib
+
+from eogtricks import get_logger
+from eogtricks import tiles
+from eogtricks.pageview import BACKGROUND_RGB
+from eogtricks.watchdog import watched
+
+
+logger = get_logger(__name__)
+
+# Images with fewer pixels than this are left to EOG.
+MIN_PIXELS = int(float(os.environ.get("EOGTRICKS_TILED_MIN_MP", 16)) * 1e6)
+
+SCROLL_STEP = 0.1  # of a page, per wheel click
+
+
+class TiledView (Gtk.Grid):
+    """Shows a large image's pyramid, a few tiles at a time.
+
+    The view hides itself while it has nothing to show: when the image
+    is too small to need tiles, or while its pyramid is being built.
+    Pyramids are built, and tiles loaded, by the application's Service.
+
+    """
+
+    def __init__(self, service):
+        super(TiledView, self).__init__()
+        self._service = service
+        self._hadj = Gtk.Adjustment()
+        self._vadj = Gtk.Adjustment()
+        self._hbar = Gtk.Scrollbar(
+            orientation=Gtk.Orientation.HORIZONTAL,
+            adjustment=self._hadj,
+        )
+        self._vbar = Gtk.Scrollbar(
+            orientation=Gtk.Orientation.VERTICAL,
+            adjustment=self._vadj,
+        )
+        self._area = Gtk.DrawingArea()
+        self._area.set_hexpand(True)
+        self._area.set_vexpand(True)
+        self._area.add_events(
+            Gdk.EventMask.SCROLL_MASK
+            | Gdk.EventMask.SMOOTH_SCROLL_MASK
+            | Gdk.EventMask.BUTTON_PRESS_MASK
+            | Gdk.EventMask.BUTTON_MOTION_MASK
+        )
+        self.attach(self._area, 0, 0, 1, 1)
+        self.attach(self._vbar, 1, 0, 1, 1)
+        self.attach(self._hbar, 0, 1, 1, 1)
+        self._area.connect("draw", self._draw_cb)
+        self._area.connect("size-allocate", self._area_size_allocate_cb)
+        self._area.connect("scroll-event", self._scroll_event_cb)
+        self._area.connect("button-press-event", self._button_press_cb)
+        self._area.connect("motion-notify-event", self._motion_notify_cb)
+        for adj in (self._hadj, self._vadj):
+            adj.connect("value-changed", self._value_changed_cb)
+
+        self._root = tiles.cache_root()
+        self._cache = tiles.TileCache(self._tile_ready_cb, service)
+        self._build_future = None
+        self._path = None
+        self._pyramid = None
+        self._top = None  # the coarsest level's only tile, always kept
+        self._zoom = 1.0
+        self._pending_scroll = {}  # {Gtk.Orientation: fraction}
+        self._drag_start = None  # (x, y, hvalue, vvalue)
+
+    # Public interface:
+
+    def set_image(self, path, zoom, scroll=None):
+        """Starts showing an image file at a zoom, if it's big enough.
+
+        If scroll is given, it's a dict of {Gtk.Orientation: fraction}
+        saying where to scroll to once the image is shown.
+
+        """
+        self._path = path
+        self._zoom = zoom
+        self._pending_scroll = dict(scroll or {})
+        self._pyramid = None
+        self._top = None
+        self._cancel_build()
+        self.hide()
+        if path is None or not self._needs_tiles(path):
+            return
+        pyramid = tiles.load_pyramid(path, self._root)
+        if pyramid is not None:
+            self._show_pyramid(pyramid)
+            return
+        logger.debug("Building tiles for %r", path)
+        future = self._service.submit(
+            ("pyramid", tiles.pyramid_key(path)),
+            tiles.make_pyramid, path, self._root,
+            process=True,
+        )
+        future.add_done_callback(
+            lambda f: GLib.idle_add(self._built_idle_cb, path, f),
+        )
+        self._build_future = future
+
+    def set_zoom(self, zoom, scroll=None):
+        """Changes the zoom, keeping the scroll position proportional.
+
+        The scroll parameter is as for set_image().
+
+        """
+        self._zoom = zoom
+        if scroll is not None:
+            self._pending_scroll.update(scroll)
+        self._update_adjustments()
+
+    def is_ready(self):
+        """Whether the view is showing the image."""
+        return self._top is not None
+
+    def get_hscrollbar(self):
+        return self._hbar
+
+    def get_vscrollbar(self):
+        return self._vbar
+
+    def close(self):
+        """Stops building and loading tiles, and releases them."""
+        # A build that's already running is left to finish, and will be
+        # there next time.
+        self._cancel_build()
+        self._cache.close()
+        self._pyramid = None
+        self._top = None
+
+    # Building pyramids:
+
+    def _needs_tiles(self, path):
+        (fmt, w, h) = self._service.file_info(path)
+        return (fmt is not None) and (w * h >= MIN_PIXELS)
+
+    def _cancel_build(self):
+        if self._build_future is not None:
+            self._service.release(self._build_future)
+            self._build_future = None
+
+    @watched
+    def _built_idle_cb(self, path, future):
+        if future is not self._build_future:
+            return False
+        self._build_future = None
+        try:
+            future.result()
+        except Exception:
+            logger.exception("Failed to build tiles for %r", path)
+            return False
+        pyramid = tiles.load_pyramid(path, self._root)
+        if pyramid is not None:
+            self._show_pyramid(pyramid)
+        return False
+
+    def _show_pyramid(self, pyramid):
+        """Shows a pyramid, once its coarsest tile is loaded."""
+        self._pyramid = pyramid
+        top_path = pyramid.tile_path(pyramid.levels - 1, 0, 0)
+        self._top = self._cache.get(top_path)
+        if self._top is not None:
+            self._became_ready()
+
+    def _became_ready(self):
+        logger.debug("Showing %r from %d levels of tiles",
+                     self._path, self._pyramid.levels)
+        self._area.show()
+        self._update_adjustments()
+        self.show()
+
+    @watched
+    def _tile_ready_cb(self, path):
+        pyramid = self._pyramid
+        if pyramid is None:
+            return
+        if self._top is None:
+            if path == pyramid.tile_path(pyramid.levels - 1, 0, 0):
+                self._top = self._cache.peek(path)
+                self._became_ready()
+            return
+        self._area.queue_draw()
+
+    # Layout:
+
+    def _update_adjustments(self):
+        """Sizes the scrollbars for the zoomed image."""
+        if self._pyramid is None:
+            return
+        view_w = self._area.get_allocated_width()
+        view_h = self._area.get_allocated_height()
+        content_w = self._pyramid.width * self._zoom
+        content_h = self._pyramid.height * self._zoom
+        for (orientation, adj, content, page) in [
+                (Gtk.Orientation.HORIZONTAL, self._hadj, content_w, view_w),
+                (Gtk.Orientation.VERTICAL, self._vadj, content_h, view_h)]:
+            frac = self._pending_scroll.get(orientation)
+            if frac is None:
+                frac = self._get_frac(adj)
+            upper = max(content, page)
+            adj.configure(0, 0, upper, page * SCROLL_STEP, page * 0.9, page)
+            adj.set_value(frac * (upper - page))
+        self._pending_scroll.clear()
+
+        # Bars come and go by the whole view's size, not the area's, so
+        # that showing one can't make the other come and go.
+        self._hbar.set_visible(content_w > self.get_allocated_width())
+        self._vbar.set_visible(content_h > self.get_allocated_height())
+        self._area.queue_draw()
+
+    @staticmethod
+    def _get_frac(adj):
+        top = adj.get_upper() - adj.get_page_size()
+        if top <= adj.get_lower():
+            return 0.5
+        return (adj.get_value() - adj.get_lower()) / (top - adj.get_lower())
+
+    def _get_origin(self):
+        """Where the image's top left corner is in the drawing area."""
+        origin = []
+        for (adj, size, alloc) in [
+                (self._hadj, self._pyramid.width,
+                 self._area.get_allocated_width()),
+                (self._vadj, self._pyramid.height,
+                 self._area.get_allocated_height())]:
+            content = size * self._zoom
+            if content < alloc:
+                origin.append((alloc - content) / 2)
+            else:
+                origin.append(-adj.get_value())
+        return origin
+
+    # Signal handlers:
+
+    @watched
+    def _area_size_allocate_cb(self, area, allocation):
+        self._update_adjustments()
+
+    @watched
+    def _value_changed_cb(self, adj):
+        self._area.queue_draw()
+
+    @watched
+    def _scroll_event_cb(self, area, event):
+        (ok, dx, dy) = event.get_scroll_deltas()
+        if not ok:
+            direction = event.direction
+            dx = {Gdk.ScrollDirection.LEFT: -1,
+                  Gdk.ScrollDirection.RIGHT: 1}.get(direction, 0)
+            dy = {Gdk.ScrollDirection.UP: -1,
+                  Gdk.ScrollDirection.DOWN: 1}.get(direction, 0)
+        for (adj, d) in [(self._hadj, dx), (self._vadj, dy)]:
+            if d:
+                adj.set_value(adj.get_value() + d * adj.get_step_increment())
+        return True
+
+    @watched
+    def _button_press_cb(self, area, event):
+        if event.button != 1:
+            return False
+        self._drag_start = (event.x, event.y, self._hadj.get_value(),
+                            self._vadj.get_value())
+        return True
+
+    @watched
+    def _motion_notify_cb(self, area, event):
+        if self._drag_start is None:
+            return False
+        if not (event.state & Gdk.ModifierType.BUTTON1_MASK):
+            self._drag_start = None
+            return False
+        (x0, y0, h0, v0) = self._drag_start
+        self._hadj.set_value(h0 - (event.x - x0))
+        self._vadj.set_value(v0 - (event.y - y0))
+        return True
+
+    # Drawing:
+
+    @watched
+    def _draw_cb(self, area, cr):
+        cr.set_source_rgb(*BACKGROUND_RGB)
+        cr.paint()
+        pyramid = self._pyramid
+        if pyramid is None or self._top is None:
+            return False
+        zoom = self._zoom
+        (ox, oy) = self._get_origin()
+
+        # The part of the image on screen, in full-size image pixels.
+        x = max(0.0, -ox / zoom)
+        y = max(0.0, -oy / zoom)
+        w = min(pyramid.width, (area.get_allocated_width() - ox) / zoom) - x
+        h = min(pyramid.height, (area.get_allocated_height() - oy) / zoom) - y
+        if w <= 0 or h <= 0:
+            return False
+
+        top = pyramid.levels - 1
+        level = pyramid.level_for_zoom(zoom * area.get_scale_factor())
+        self._paint_tile(cr, top, 0, 0, self._top, ox, oy)
+
+        # Coarser tiles already loaded stand in for the finer ones
+        # until those arrive. Only the finer ones are asked for.
+        if level + 1 < top:
+            for (col, row) in pyramid.tiles_in(level + 1, x, y, w, h):
+                path = pyramid.tile_path(level + 1, col, row)
+                surface = self._cache.peek(path)
+                if surface is not None:
+                    self._paint_tile(cr, level + 1, col, row, surface, ox, oy)
+        wanted = set()
+        if level < top:
+            for (col, row) in pyramid.tiles_in(level, x, y, w, h):
+                path = pyramid.tile_path(level, col, row)
+                wanted.add(path)
+                surface = self._cache.get(path)
+                if surface is not None:
+                    self._paint_tile(cr, level, col, row, surface, ox, oy)
+        self._cache.retain(wanted)
+        return False
+
+    def _paint_tile(self, cr, level, col, row, surface, ox, oy):
+        pyramid = self._pyramid
+        (sx, sy) = pyramid.level_scale(level)
+        sx *= self._zoom
+        sy *= self._zoom
+        t = pyramid.tile_size
+        (tw, th) = pyramid.tile_size_at(level, col, row)
+        cr.save()
+        cr.translate(ox + col * t * sx, oy + row * t * sy)
+        cr.scale(sx, sy)
+        cr.set_source_surface(surface, 0, 0)
+        cr.rectangle(0, 0, tw, th)
+        cr.fill()
+        cr.restore()
@@ -0,0 +1,147 @@
+# Shared undo history for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""One undo history per window, for every plugin that changes files.
+
+Safer deletion and Quick Move both do things to files which can be put
+right again. Rather than each binding Ctrl+Z and fighting over it, they
+push what they did onto the window's history, and Ctrl+Z undoes the
+most recent thing, whichever plugin did it. When there's nothing of
+ours left to undo, EOG's own undo runs instead. Only the most recent
+MAX_ENTRIES things are remembered.
+
+Usage::
+
+    history = UndoHistory.for_window(window)
+    history.attach()
+    history.push(item, self._undo_item, self)  # calls _undo_item(item)
+    ...
+    history.remove(item)  # if it can't be undone after all
+    ...
+    history.detach(self)  # forgets what self pushed
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import collections
+
+from eogtricks import get_logger
+from eogtricks.accels import AccelRegistry
+from eogtricks.watchdog import watched
+
+
+logger = get_logger(__name__)
+
+UNDO_ACTION_NAME = "eogtricks-undo"
+UNDO_ACCELS = ["<Control>z"]
+
+MAX_ENTRIES = 1000  # older things can no longer be undone
+
+
+class UndoHistory (object):
+    """Undoable things done to files in one window, most recent last."""
+
+    _histories = {}  # {Eog.Window: UndoHistory}
+
+    def __init__(self, window):
+        super(UndoHistory, self).__init__()
+        self._window = window
+        # {id(item): (item, callback, owner)}, oldest first. Keyed by
+        # id, so forgetting a whole committed batch of deletions one
+        # item at a time doesn't rescan the history for each.
+        self._entries = collections.OrderedDict()
+        self._refcount = 0
+        self._action = None
+
+    @classmethod
+    def for_window(cls, window):
+        """Returns the history for a window, creating it if needed."""
+        history = cls._histories.get(window)
+        if history is None:
+            history = cls(window)
+            cls._histories[window] = history
+        return history
+
+    # Public interface:
+
+    def attach(self):
+        """Takes a reference. The first adds the undo action."""
+        self._refcount += 1
+        if self._refcount > 1:
+            return
+        from gi.repository import Gio
+        action = Gio.SimpleAction(name=UNDO_ACTION_NAME)
+        action.connect("activate", self._undo_activate_cb)
+        self._window.add_action(action)
+        self._action = action
+        registry = AccelRegistry.for_app(self._window.get_application())
+        registry.claim("eogtricks-undo", {
+            "win." + UNDO_ACTION_NAME: UNDO_ACCELS,
+        })
+
+    def detach(self, owner):
+        """Drops a reference, and forgets everything owner pushed.
+
+        The owner's callbacks can't run once it has gone, even if other
+        plugins keep the history going. The last reference removes the
+        action and the history.
+
+        """
+        for (key, entry) in list(self._entries.items()):
+            if entry[2] is owner:
+                del self._entries[key]
+        self._refcount -= 1
+        if self._refcount > 0:
+            return
+        registry = AccelRegistry.for_app(self._window.get_application())
+        registry.release("eogtricks-undo")
+        self._window.remove_action(UNDO_ACTION_NAME)
+        self._action = None
+        self._entries.clear()
+        self._histories.pop(self._window, None)
+
+    def push(self, item, callback, owner):
+        """Records something undoable, how to undo it, and who did it."""
+        key = id(item)
+        self._entries.pop(key, None)
+        self._entries[key] = (item, callback, owner)
+        while len(self._entries) > MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    def remove(self, item):
+        """Forgets an item, if it's still in the history."""
+        self._entries.pop(id(item), None)
+
+    def __contains__(self, item):
+        return id(item) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Action callbacks:
+
+    @watched
+    def _undo_activate_cb(self, action, param):
+        """Undo the most recent thing, or let EOG undo its own."""
+        if not self._entries:
+            self._window.activate_action("undo", None)
+            return
+        (key, (item, callback, owner)) = self._entries.popitem()
+        callback(item)
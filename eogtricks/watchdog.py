@@ -0,0 +1,249 @@
+# Main loop stall watchdog for the EOGtricks plugins.
+# -*- encoding: utf-8 -*-
+# Copyright (C) 2018 Andrew Chadwick <a.t.chadwick@gmail.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Find callbacks that block the main loop for too long.
+
+This is opt-in. Set EOGTRICKS_WATCHDOG to a threshold in milliseconds
+(16 is one frame at 60Hz) and every plugin callback decorated with
+@watched is timed. Any call which takes longer than the threshold is
+recorded in a ring buffer with its duration, its name, and Python stacks
+sampled from the thread while it was still running.
+
+The buffer is written out when EOG exits, or on demand by sending the
+process SIGUSR1. It goes to the file named by EOGTRICKS_WATCHDOG_FILE,
+or to eogtricks-stalls.txt in the user's cache directory.
+
+When the watchdog is off, @watched returns the function unchanged and
+costs nothing.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import time
+import atexit
+import functools
+import threading
+import collections
+
+from eogtricks import get_logger
+
+
+logger = get_logger(__name__)
+
+THRESHOLD_MS = float(os.environ.get("EOGTRICKS_WATCHDOG") or 0)
+ENABLED = THRESHOLD_MS > 0
+DUMP_FILE = os.environ.get("EOGTRICKS_WATCHDOG_FILE")
+
+RING_SIZE = 200  # stall records kept
+MAX_SAMPLES = 5  # stacks sampled per stall
+MAX_STACK_DEPTH = 30
+
+
+StallRecord = collections.namedtuple(
+    "StallRecord",
+    ["start", "name", "duration", "thread", "samples"],
+)
+
+
+class _ActiveCall (object):
+    """A watched call in progress."""
+
+    __slots__ = ("name", "start", "thread_id", "thread_name", "samples")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.samples = []
+
+
+class Watchdog (object):
+    """Times calls, samples slow ones, and keeps a ring of stall records.
+    """
+
+    def __init__(self, threshold_ms, ring_size=RING_SIZE):
+        super(Watchdog, self).__init__()
+        self.threshold = threshold_ms / 1000
+        self.records = collections.deque(maxlen=ring_size)
+        self._active = []
+        self._lock = threading.Lock()
+        self._local = threading.local()  # .depth of nested watched calls
+        self._sampler = None
+
+    # Timing:
+
+    def call(self, name, func, args, kwargs):
+        """Calls func, recording a stall if it takes too long.
+
+        Only the outermost watched call on a thread is timed, so that a
+        slow callback which calls other watched code is one stall.
+
+        """
+        local = self._local
+        if getattr(local, "depth", 0) > 0:
+            local.depth += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                local.depth -= 1
+        local.depth = 1
+        active = _ActiveCall(name)
+        with self._lock:
+            self._active.append(active)
+            if self._sampler is None:
+                self._start_sampler()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = time.perf_counter() - active.start
+            local.depth = 0
+            with self._lock:
+                self._active.remove(active)
+                if duration > self.threshold:
+                    self.records.append(StallRecord(
+                        time.time() - duration,
+                        name,
+                        duration,
+                        active.thread_name,
+                        active.samples,
+                    ))
+            if duration > self.threshold:
+                logger.debug("Stall: %s took %0.1fms", name,
+                             duration * 1000)
+
+    # Stack sampling:
+
+    def _start_sampler(self):
+        self._sampler = threading.Thread(
+            name="eogtricks-watchdog",
+            target=self._sampler_run,
+            daemon=True,
+        )
+        self._sampler.start()
+
+    def _sampler_run(self):
+        import traceback
+        interval = max(self.threshold / 2, 0.001)
+        while True:
+            time.sleep(interval)
+            now = time.perf_counter()
+            with self._lock:
+                overdue = [
+                    a for a in self._active
+                    if (now - a.start) > self.threshold
+                    and len(a.samples) < MAX_SAMPLES
+                ]
+                if not overdue:
+                    continue
+                frames = sys._current_frames()
+                for active in overdue:
+                    frame = frames.get(active.thread_id)
+                    if frame is None:
+                        continue
+                    stack = traceback.extract_stack(frame,
+                                                    limit=MAX_STACK_DEPTH)
+                    active.samples.append(
+                        (now - active.start, traceback.format_list(stack)),
+                    )
+                del frames
+
+    # Reporting:
+
+    def dump(self, filename=None):
+        """Writes the stall records to a file, and returns its name."""
+        if filename is None:
+            filename = default_dump_file()
+        with self._lock:
+            records = list(self.records)
+        with open(filename, "w") as fp:
+            fp.write("# EOGtricks stalls over %0.1fms, pid %d\n"
+                     % (self.threshold * 1000, os.getpid()))
+            for rec in records:
+                fp.write("\n%s %s: %0.1fms in %s\n" % (
+                    time.strftime("%Y-%m-%dT%H:%M:%S",
+                                  time.localtime(rec.start)),
+                    rec.name, rec.duration * 1000, rec.thread,
+                ))
+                for (elapsed, stack) in rec.samples:
+                    fp.write("  sampled at +%0.1fms:\n" % (elapsed * 1000,))
+                    for entry in stack:
+                        for line in entry.rstrip("\n").split("\n"):
+                            fp.write("    %s\n" % (line,))
+        logger.info("Wrote %d stall record(s) to %r", len(records), filename)
+        return filename
+
+
+def default_dump_file():
+    if DUMP_FILE:
+        return DUMP_FILE
+    from gi.repository import GLib
+    return os.path.join(GLib.get_user_cache_dir(), "eogtricks-stalls.txt")
+
+
+_watchdog = None
+
+
+def get_watchdog():
+    """Returns the process's watchdog, or None if it's turned off."""
+    return _watchdog
+
+
+def watched(func):
+    """Decorator for plugin callbacks which run on the main loop."""
+    if _watchdog is None:
+        return func
+    name = "%s.%s" % (func.__module__, func.__qualname__)
+
+    @functools.wraps(func)
+    def _watched_wrapper(*args, **kwargs):
+        return _watchdog.call(name, func, args, kwargs)
+
+    return _watched_wrapper
+
+
+def _sigusr1_cb(*args):
+    try:
+        _watchdog.dump()
+    except Exception:
+        logger.exception("Failed to dump the watchdog's stall records")
+    return True
+
+
+def _atexit_cb():
+    if _watchdog.records:
+        _watchdog.dump()
+
+
+if ENABLED:
+    _watchdog = Watchdog(THRESHOLD_MS)
+    atexit.register(_atexit_cb)
+    try:
+        import signal
+        from gi.repository import GLib
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1,
+                             _sigusr1_cb)
+    except Exception:
+        logger.exception("Can't dump stall records on SIGUSR1")
+    logger.info("Watchdog on: recording callbacks over %0.1fms",
+                THRESHOLD_MS)
@@ -7,6 +7,7 @@ setup(
     description="Collected plugins for EOG (Eye of GNOME Image Viewer)",
     author="Andrew Chadwick",
     author_email="a.t.chadwick@gmail.com",
+    packages=["eogtricks"],
     data_files=[
         ('share/eog/plugins', (
             list(glob.glob("eog/*.py")) +